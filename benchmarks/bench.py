@@ -0,0 +1,283 @@
+#!/usr/bin/env python3
+''' End-to-end benchmark of SalmonellaTypeFinder using stub external tools
+    (see stubs/). Runs offline without sequencing data or databases and
+    measures how the orchestration scales with the number of samples and
+    workers.
+
+    Modes:
+        library: Types the samples in this process with batch.iter_batch.
+        cli: Runs SalmonellaTypeFinder.py -b on a sample sheet.
+
+    Reported per run:
+        throughput: Samples per second.
+        p50/p95: Latency of a single sample (TypingProfile stage).
+        overhead p50/p95: Time of a sample spent outside the external tools,
+                          i.e. TypingProfile minus the slowest tool.
+        run overhead: Wall time minus the ideal wall time, which is the
+                      number of sample rounds times the median tool time.
+'''
+
+import argparse
+import json
+import math
+import os
+import shutil
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+BENCH_DIR = os.path.dirname(os.path.realpath(__file__))
+REPO_DIR = os.path.dirname(BENCH_DIR)
+STUB_DIR = os.path.join(BENCH_DIR, "stubs")
+
+sys.path.insert(0, REPO_DIR)
+from salmonellatypefinder.batch import Sample, iter_batch  # noqa: E402
+from salmonellatypefinder.mlst2serotype import MLST2Serotype  # noqa: E402
+
+
+def eprint(*args, **kwargs):
+    print(*args, file=sys.stderr, **kwargs)
+
+
+def percentile(values, fraction):
+    ''' Nearest-rank percentile.
+    '''
+    if(not values):
+        return float("nan")
+    values = sorted(values)
+    rank = max(math.ceil(fraction * len(values)), 1)
+    return values[rank - 1]
+
+
+def make_samples(work_dir, count):
+    ''' Writes a small pair of FASTQ files for each sample and a sample sheet.
+        RETURN: (sample sheet path, list of Sample objects)
+    '''
+    data_dir = os.path.join(work_dir, "data")
+    os.makedirs(data_dir, exist_ok=True)
+    sheet_path = os.path.join(work_dir, "samples.tsv")
+    samples = []
+    with open(sheet_path, "w", encoding="utf-8") as sheet_fh:
+        for i in range(count):
+            name = "sample{:05d}".format(i)
+            files = []
+            for read in ("R1", "R2"):
+                filepath = os.path.join(data_dir,
+                                        "{}_{}.fastq".format(name, read))
+                with open(filepath, "w") as fastq_fh:
+                    fastq_fh.write("@{}\nACGT\n+\nIIII\n".format(name))
+                files.append(filepath)
+            sheet_fh.write("{}\t{}\t{}\tpaired\n".format(name, *files))
+            samples.append(Sample(name, tuple(files), seqtype="paired"))
+    return (sheet_path, samples)
+
+
+def stub_typing_options(seromethod):
+    return {
+        "cgemlst_path": os.path.join(STUB_DIR, "mlst.py"),
+        "cgemlstdb_path": STUB_DIR,
+        "python3": sys.executable,
+        "seqsero": os.path.join(STUB_DIR, "SeqSero.py"),
+        "python2": sys.executable,
+        "seqsero2": os.path.join(STUB_DIR, "SeqSero2_package.py"),
+        "seromethod": seromethod
+    }
+
+
+def summarize(mode, workers, wall, durations):
+    ''' durations: sample name --> {stage name: seconds}
+    '''
+    latencies = []
+    tool_times = []
+    overheads = []
+    for stages in durations.values():
+        tool_time = max(stages.get("cgemlst.run", 0),
+                        stages.get("seqsero.run", 0),
+                        stages.get("seqsero2.run", 0))
+        latencies.append(stages.get("typing_profile", 0))
+        tool_times.append(tool_time)
+        overheads.append(stages.get("typing_profile", 0) - tool_time)
+
+    count = len(durations)
+    ideal = 0
+    if(tool_times):
+        ideal = math.ceil(count / workers) * statistics.median(tool_times)
+
+    return {
+        "mode": mode,
+        "samples": count,
+        "workers": workers,
+        "wall_s": wall,
+        "throughput": count / wall if(wall) else float("nan"),
+        "latency_p50_s": percentile(latencies, 0.5),
+        "latency_p95_s": percentile(latencies, 0.95),
+        "overhead_p50_s": percentile(overheads, 0.5),
+        "overhead_p95_s": percentile(overheads, 0.95),
+        "tool_p50_s": percentile(tool_times, 0.5),
+        "run_overhead_s": wall - ideal
+    }
+
+
+def run_library(samples, workers, serotyper, tmp_dir, typing_options):
+    durations = {}
+    start = time.perf_counter()
+    for sample, profile in iter_batch(samples, serotyper, tmp_dir,
+                                      workers=workers, **typing_options):
+        if(profile is None):
+            sys.exit("! ERROR: Typing failed for sample: {}"
+                     .format(sample.name))
+        durations[sample.name] = profile.tracer.durations()
+    wall = time.perf_counter() - start
+    return summarize("library", workers, wall, durations)
+
+
+def run_cli(sheet_path, workers, work_dir, typing_options):
+    trace_path = os.path.join(work_dir, "trace.jsonl")
+    out_path = os.path.join(work_dir, "results.txt")
+    if(os.path.exists(trace_path)):
+        os.remove(trace_path)
+
+    cmd = [sys.executable, os.path.join(REPO_DIR, "SalmonellaTypeFinder.py"),
+           "-b", sheet_path, "-w", str(workers), "-o", out_path,
+           "-t", os.path.join(work_dir, "tmp"),
+           "--trace_jsonl", trace_path,
+           "-p1", typing_options["cgemlst_path"],
+           "-d1", typing_options["cgemlstdb_path"],
+           "--python3", typing_options["python3"],
+           "--python2", typing_options["python2"],
+           "--seqsero", typing_options["seqsero"],
+           "--seqsero2", typing_options["seqsero2"],
+           "--seromethod", typing_options["seromethod"]]
+
+    start = time.perf_counter()
+    proc = subprocess.run(cmd, stdout=subprocess.DEVNULL,
+                          stderr=subprocess.PIPE, universal_newlines=True)
+    wall = time.perf_counter() - start
+    if(proc.returncode != 0):
+        eprint(proc.stderr)
+        sys.exit("! ERROR: SalmonellaTypeFinder.py exited with code {}"
+                 .format(proc.returncode))
+
+    durations = {}
+    with open(trace_path, "r", encoding="utf-8") as trace_fh:
+        for line in trace_fh:
+            span = json.loads(line)
+            if(span["sample"] is None or span["name"] == "output.write"):
+                continue
+            stages = durations.setdefault(span["sample"], {})
+            stages[span["name"]] = (stages.get(span["name"], 0)
+                                    + span["duration"])
+    return summarize("cli", workers, wall, durations)
+
+
+def print_table(results):
+    columns = [
+        ("mode", "{}"), ("samples", "{}"), ("workers", "{}"),
+        ("wall_s", "{:.2f}"), ("throughput", "{:.2f}"),
+        ("latency_p50_s", "{:.3f}"), ("latency_p95_s", "{:.3f}"),
+        ("overhead_p50_s", "{:.3f}"), ("overhead_p95_s", "{:.3f}"),
+        ("run_overhead_s", "{:.2f}")
+    ]
+    print("\t".join(name for name, fmt in columns))
+    for result in results:
+        print("\t".join(fmt.format(result[name]) for name, fmt in columns))
+
+
+def int_list(text):
+    return [int(value) for value in text.split(",") if value]
+
+
+if __name__ == '__main__':
+
+    #
+    # Handling arguments
+    #
+    parser = argparse.ArgumentParser(description="Benchmark SalmonellaType\
+        Finder with stub external tools.")
+    parser.add_argument("-n", "--samples",
+                        help="Comma separated sample counts. Default: 1,8,32",
+                        type=int_list,
+                        default=[1, 8, 32])
+    parser.add_argument("-w", "--workers",
+                        help="Comma separated worker counts. Default: 1,2,4",
+                        type=int_list,
+                        default=[1, 2, 4])
+    parser.add_argument("--mode",
+                        help="What to drive: library, cli or both.\
+                              Default: both",
+                        choices=["library", "cli", "both"],
+                        default="both")
+    parser.add_argument("--latency",
+                        help="Seconds each stub tool sleeps. Default: 0.1",
+                        type=float,
+                        default=0.1)
+    parser.add_argument("--cpu",
+                        help="Seconds of CPU each stub tool burns.\
+                              Default: 0",
+                        type=float,
+                        default=0)
+    parser.add_argument("--jitter",
+                        help="Random +/- fraction added to latency and CPU\
+                              time. Default: 0",
+                        type=float,
+                        default=0)
+    parser.add_argument("--seromethod",
+                        help="seqsero or seqsero2. Default: seqsero",
+                        choices=["seqsero", "seqsero2"],
+                        default="seqsero")
+    parser.add_argument("--json",
+                        help="Also write the results to this file as JSON.",
+                        metavar="JSON_OUT",
+                        default=None)
+    parser.add_argument("--keep",
+                        help="Keep the work dir with the generated data.",
+                        action="store_true",
+                        default=False)
+
+    args = parser.parse_args()
+
+    # The stubs are configured through the environment, which the tools
+    # inherit.
+    os.environ["STF_STUB_LATENCY"] = str(args.latency)
+    os.environ["STF_STUB_CPU"] = str(args.cpu)
+    os.environ["STF_STUB_JITTER"] = str(args.jitter)
+
+    typing_options = stub_typing_options(args.seromethod)
+    serotyper = MLST2Serotype(os.path.join(REPO_DIR, "data", "db.json"))
+
+    modes = ["library", "cli"] if(args.mode == "both") else [args.mode]
+    work_root = tempfile.mkdtemp(prefix="stf_bench_")
+    results = []
+    try:
+        for count in args.samples:
+            work_dir = os.path.join(work_root, "n{}".format(count))
+            sheet_path, samples = make_samples(work_dir, count)
+            for workers in args.workers:
+                for mode in modes:
+                    eprint("# {} samples={} workers={}"
+                           .format(mode, count, workers))
+                    run_dir = os.path.join(work_dir, "{}_w{}"
+                                           .format(mode, workers))
+                    os.makedirs(run_dir, exist_ok=True)
+                    if(mode == "library"):
+                        result = run_library(samples, workers, serotyper,
+                                             os.path.join(run_dir, "tmp"),
+                                             typing_options)
+                    else:
+                        result = run_cli(sheet_path, workers, run_dir,
+                                         typing_options)
+                    result.update({"latency_setting": args.latency,
+                                   "cpu_setting": args.cpu})
+                    results.append(result)
+    finally:
+        if(args.keep):
+            eprint("# Work dir kept: {}".format(work_root))
+        else:
+            shutil.rmtree(work_root, ignore_errors=True)
+
+    print_table(results)
+    if(args.json):
+        with open(args.json, "w", encoding="utf-8") as json_fh:
+            json.dump(results, json_fh, indent=2)
@@ -0,0 +1,135 @@
+#!/usr/bin/env python3
+''' Startup benchmark of SalmonellaTypeFinder. Each measurement runs in a
+    new interpreter and the best of several runs is reported, as the first
+    runs also measure the disk cache.
+
+    Reported:
+        python: Start of a bare interpreter.
+        import <module>: Import of the package and of the library API,
+                         on top of the bare interpreter.
+        first tool: From starting SalmonellaTypeFinder.py on one sample to
+                    the start of the first external tool (stub, see
+                    stubs/), minus the time the stub itself needs to start.
+'''
+
+import argparse
+import json
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+
+BENCH_DIR = os.path.dirname(os.path.realpath(__file__))
+REPO_DIR = os.path.dirname(BENCH_DIR)
+STUB_DIR = os.path.join(BENCH_DIR, "stubs")
+
+IMPORTS = [
+    "salmonellatypefinder",
+    "salmonellatypefinder.api",
+    "salmonellatypefinder.cli",
+    "salmonellatypefinder.typingprofile"
+]
+
+
+def eprint(*args, **kwargs):
+    print(*args, file=sys.stderr, **kwargs)
+
+
+def time_python(code, repeat):
+    ''' RETURN: Best wall time in seconds of running code in a new
+                interpreter.
+    '''
+    best = None
+    for i in range(repeat):
+        start = time.perf_counter()
+        subprocess.run([sys.executable, "-c", code], cwd=REPO_DIR,
+                       check=True)
+        elapsed = time.perf_counter() - start
+        if(best is None or elapsed < best):
+            best = elapsed
+    return best
+
+
+def time_launch(argv, launch_log, repeat, cwd):
+    ''' Runs argv and reads the start time of the first stub tool from
+        launch_log.
+        RETURN: Best time in seconds from starting argv to the first tool.
+    '''
+    env = dict(os.environ, STF_STUB_LATENCY="0",
+               STF_STUB_LAUNCH_LOG=launch_log)
+    best = None
+    for i in range(repeat):
+        if(os.path.exists(launch_log)):
+            os.remove(launch_log)
+        start = time.time()
+        subprocess.run(argv, cwd=cwd, env=env, check=True,
+                       stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+        with open(launch_log, "r") as log_fh:
+            first = min(float(line) for line in log_fh if line.strip())
+        elapsed = first - start
+        if(best is None or elapsed < best):
+            best = elapsed
+    return best
+
+
+if __name__ == '__main__':
+
+    #
+    # Handling arguments
+    #
+    parser = argparse.ArgumentParser(description="Measure the import time of\
+        SalmonellaTypeFinder and the time from start to the first external\
+        tool.")
+    parser.add_argument("-r", "--repeat",
+                        help="Runs of each measurement. Default: 10",
+                        type=int,
+                        default=10)
+    parser.add_argument("--json",
+                        help="Also write the results to this file as JSON.",
+                        metavar="JSON_OUT",
+                        default=None)
+
+    args = parser.parse_args()
+
+    results = {}
+    python = time_python("pass", args.repeat)
+    results["python_s"] = python
+    for module in IMPORTS:
+        elapsed = time_python("import " + module, args.repeat)
+        results["import {}_s".format(module)] = elapsed - python
+
+    work_dir = tempfile.mkdtemp(prefix="stf_startup_")
+    try:
+        files = []
+        for read in ("R1", "R2"):
+            filepath = os.path.join(work_dir, "sample_{}.fastq".format(read))
+            with open(filepath, "w") as fastq_fh:
+                fastq_fh.write("@sample\nACGT\n+\nIIII\n")
+            files.append(filepath)
+        launch_log = os.path.join(work_dir, "launch.log")
+        mlst_stub = os.path.join(STUB_DIR, "mlst.py")
+
+        stub = time_launch([sys.executable, mlst_stub, "-i"] + files,
+                           launch_log, args.repeat, work_dir)
+        run = time_launch(
+            [sys.executable, os.path.join(REPO_DIR, "SalmonellaTypeFinder.py"),
+             "-t", os.path.join(work_dir, "tmp"),
+             "-p1", mlst_stub, "-d1", STUB_DIR,
+             "--python2", sys.executable,
+             "--seqsero", os.path.join(STUB_DIR, "SeqSero.py")] + files,
+            launch_log, args.repeat, work_dir)
+        results["stub_start_s"] = stub
+        results["first_tool_s"] = run - stub
+    finally:
+        shutil.rmtree(work_dir)
+
+    for name, value in results.items():
+        print("{}\t{:.1f} ms".format(name[:-2], value * 1000))
+
+    if(args.json):
+        with open(args.json, "w", encoding="utf-8") as json_fh:
+            json.dump(results, json_fh, indent=2)
+
+    quit(0)
@@ -0,0 +1,10 @@
+#!/usr/bin/env python3
+''' Stand-in for SeqSero2_package.py. Accepts any arguments and prints
+    canned screen output, see stubtool.print_seqsero_output.
+'''
+
+from stubtool import simulate_work, print_seqsero_output
+
+
+simulate_work()
+print_seqsero_output()
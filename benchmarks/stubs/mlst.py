@@ -0,0 +1,32 @@
+#!/usr/bin/env python3
+''' Stand-in for CGE mlst.py. Accepts the same arguments and prints canned
+    JSON results. The ST is taken from STF_STUB_ST (default: 11).
+'''
+
+import argparse
+import json
+import os
+
+from stubtool import simulate_work
+
+
+parser = argparse.ArgumentParser()
+parser.add_argument("-i", "--infile", nargs="+")
+parser.add_argument("-o", "--outdir")
+parser.add_argument("-s", "--species")
+parser.add_argument("-p", "--databasePath")
+args, unknown = parser.parse_known_args()
+
+simulate_work()
+
+print(json.dumps({
+    "mlst": {
+        "user_input": {
+            "filename(s)": args.infile,
+            "organism": args.species
+        },
+        "results": {
+            "sequence_type": os.environ.get("STF_STUB_ST", "11")
+        }
+    }
+}))
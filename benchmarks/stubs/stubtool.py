@@ -0,0 +1,61 @@
+#!/usr/bin/env python3
+
+import os
+import random
+import time
+
+
+def env_float(name, default):
+    try:
+        return float(os.environ.get(name, default))
+    except ValueError:
+        return default
+
+
+def simulate_work():
+    ''' Simulates the run time of an external tool. Configured with the
+        environment variables:
+            STF_STUB_LATENCY: Seconds spent sleeping. Default: 0.1
+            STF_STUB_CPU: Seconds spent burning CPU. Default: 0
+            STF_STUB_JITTER: Random +/- fraction added to both. Default: 0
+            STF_STUB_FAIL: Fraction of calls that exit with an error.
+                           Default: 0
+            STF_STUB_LAUNCH_LOG: File to which the time the tool was
+                                 started is appended. Default: none
+    '''
+    launch_log = os.environ.get("STF_STUB_LAUNCH_LOG")
+    if(launch_log):
+        with open(launch_log, "a") as log_fh:
+            log_fh.write("{}\n".format(time.time()))
+
+    jitter = env_float("STF_STUB_JITTER", 0)
+    scale = 1 + random.uniform(-jitter, jitter)
+
+    cpu = env_float("STF_STUB_CPU", 0) * scale
+    end = time.process_time() + cpu
+    x = 0
+    while(time.process_time() < end):
+        x = (x * 31 + 7) % 1000003
+
+    time.sleep(max(env_float("STF_STUB_LATENCY", 0.1) * scale, 0))
+
+    if(random.random() < env_float("STF_STUB_FAIL", 0)):
+        raise SystemExit("Simulated tool failure")
+
+
+def print_seqsero_output():
+    ''' Prints canned SeqSero/SeqSero2 screen output. SeqSero writes its
+        result files in the current working directory, so the stub does too.
+        The serotype is taken from STF_STUB_SEROTYPE (default: Enteritidis).
+    '''
+    serotype = os.environ.get("STF_STUB_SEROTYPE", "Enteritidis")
+    with open("SeqSero_result.txt", "w") as result_fh:
+        result_fh.write("Predicted serotype(s):\t{}\n".format(serotype))
+
+    print("Output_directory:\t{}".format(os.getcwd()))
+    print("O antigen prediction:\t9")
+    print("H1 antigen prediction(fliC):\tg,m")
+    print("H2 antigen prediction(fljB):\t-")
+    print("Predicted antigenic profile:\t9:g,m:-")
+    print("Sdf prediction:\tSdf+")
+    print("Predicted serotype(s):\t{}".format(serotype))
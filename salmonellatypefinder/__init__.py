@@ -0,0 +1,41 @@
+''' SalmonellaTypeFinder predicts the serotype and MLST type of Salmonella
+    from raw reads or an assembly. See api.py for the library API:
+
+    from salmonellatypefinder import type_sample
+    profile = type_sample(["R1.fastq.gz", "R2.fastq.gz"],
+                          cgemlstdb_path="/path/to/mlst_db")
+
+    The names below are imported when first used, so importing the package
+    does no work.
+'''
+
+import importlib
+
+# Public name --> module it is imported from.
+_exports = {
+    "type_sample": ".api",
+    "type_batch": ".api",
+    "load_database": ".api",
+    "default_mlst_db": ".api",
+    "plan_resources": ".planner",
+    "Sample": ".batch",
+    "read_sample_sheet": ".batch",
+    "TypingProfile": ".typingprofile",
+    "ToolError": ".toolrunner",
+    "InputError": ".subsample"
+}
+
+__all__ = sorted(_exports)
+
+
+def __getattr__(name):
+    if(name not in _exports):
+        raise AttributeError("module {!r} has no attribute {!r}".format(
+            __name__, name))
+    value = getattr(importlib.import_module(_exports[name], __name__), name)
+    globals()[name] = value
+    return value
+
+
+def __dir__():
+    return sorted(set(globals()) | set(_exports))
@@ -0,0 +1,148 @@
+#!/usr/bin/env python3
+''' Library API of SalmonellaTypeFinder.
+
+    from salmonellatypefinder import type_sample, type_batch
+
+    profile = type_sample(["R1.fastq.gz", "R2.fastq.gz"],
+                          cgemlstdb_path="/path/to/mlst_db")
+    print(profile.serotype, profile.mlst.st)
+    print(profile.to_dict())
+
+    for sample, profile in type_batch("samples.tsv", workers=8,
+                                      cgemlstdb_path="/path/to/mlst_db"):
+        ...
+
+    The keyword arguments not named below are passed on to TypingProfile
+    and have the same defaults, ex. cgemlst_path, seqsero, seromethod,
+    mlstmethod, tool_threads (see plan_resources), cache, max_coverage, bait
+    and prescreen.
+    Nothing is loaded or run when the module is imported.
+'''
+
+import os.path
+import sys
+
+from .batch import Sample, read_sample_sheet
+from .workspace import WorkspaceManager
+
+
+DEFAULT_TMP_DIR = "SalmonellaTypeFinder_tmp_dir"
+
+# Databases loaded by load_database, by path and options.
+_databases = {}
+
+
+def eprint(*args, **kwargs):
+    print(*args, file=sys.stderr, **kwargs)
+
+
+def default_mlst_db():
+    ''' RETURN: Path of the database in the data dir: db.idx if it has been
+                compiled from db.json and db.json has not changed since,
+                otherwise db.json.
+    '''
+    data_dir = os.path.join(os.path.dirname(os.path.dirname(
+        os.path.realpath(__file__))), "data")
+    json_path = os.path.join(data_dir, "db.json")
+    index_path = os.path.join(data_dir, "db.idx")
+    if(os.path.isfile(index_path) and os.path.isfile(json_path)
+       and os.path.getmtime(index_path) >= os.path.getmtime(json_path)):
+        return index_path
+    return json_path
+
+
+def load_database(mlst_db=None, min_sero_count=3, min_frac=0.75,
+                  mask_low_count=2, tracer=None):
+    ''' Loads the MLST --> serotype database. A database is loaded once per
+        process for each path and set of options.
+        mlst_db: JSON database or compiled index. Default: default_mlst_db()
+        min_frac: Fraction of isolates that must agree to predict a
+                  serotype from the ST.
+        mask_low_count: Ignore serotypes with this number of isolates or
+                        fewer.
+        RETURN: MLST2Serotype
+    '''
+    from .mlst2serotype import MLST2Serotype
+
+    if(mlst_db is None):
+        mlst_db = default_mlst_db()
+    if(not os.path.isfile(mlst_db)):
+        raise FileNotFoundError("MLST database not found: {}".format(mlst_db))
+    key = (os.path.realpath(mlst_db), os.path.getmtime(mlst_db),
+           min_sero_count, min_frac, mask_low_count)
+    if(key not in _databases):
+        _databases[key] = MLST2Serotype(
+            json_file=mlst_db, min_sero_count=min_sero_count,
+            min_frac=min_frac, mask_low_count=mask_low_count, tracer=tracer)
+    return _databases[key]
+
+
+def get_database(database):
+    ''' database: MLST2Serotype, path to a database or None for the default
+                  database.
+    '''
+    if(database is None or isinstance(database, str)):
+        return load_database(database)
+    return database
+
+
+def type_sample(files, seqtype="paired", sample_name=None, mlst=None,
+                database=None, tmp_dir=DEFAULT_TMP_DIR, **typing_options):
+    ''' Types a single sample.
+        files: One FASTQ file for single-end data, two for paired-end data
+               or one FASTA file for an assembly. Can be gzip compressed.
+        seqtype: paired, single or assembled.
+        sample_name: Name of the sample. Default: name of the first file.
+        mlst: Known ST. If given, the ST is not searched for.
+        database: MLST2Serotype, path to a database or None for the default
+                  database, see load_database.
+        tmp_dir: Dir in which the sample gets its own workspace, which is
+                 removed unless the sample fails. Give workspaces=
+                 WorkspaceManager(...) to change this.
+        RETURN: TypingProfile.
+        Raises salmonellatypefinder.ToolError if an external tool fails or
+        times out, or its database is missing, and
+        salmonellatypefinder.InputError (a ValueError) if the input files
+        are malformed, ex. a truncated FASTQ file or paired files that are
+        out of sync, or the references of the read bait or pre-screen are
+        missing. FileNotFoundError is raised if the MLST database is not
+        found, see load_database.
+    '''
+    from .typingprofile import TypingProfile
+
+    if(typing_options.get("workspaces") is None):
+        typing_options["workspaces"] = WorkspaceManager(tmp_dir)
+    return TypingProfile(files=[os.path.abspath(path) for path in files],
+                         mlst2serotype=get_database(database),
+                         seqtype=seqtype, mlst=mlst,
+                         tmp_dir=os.path.abspath(tmp_dir),
+                         sample_name=sample_name, **typing_options)
+
+
+def type_batch(samples, database=None, tmp_dir=DEFAULT_TMP_DIR, workers=None,
+               **typing_options):
+    ''' Types several samples in a pool of worker processes.
+        samples: List of Sample objects or the path of a sample sheet, see
+                 read_sample_sheet.
+        workers: Max. number of samples typed at the same time. Default:
+                 number of CPUs
+        See type_sample for the other arguments.
+        RETURN: Iterator of (Sample, TypingProfile) tuples in the order the
+                samples finish. The profile is None if the sample failed
+                with one of the errors type_sample raises; the error is
+                printed to stderr. A malformed sample sheet exits with
+                SystemExit, see read_sample_sheet.
+    '''
+    from .batch import iter_batch
+
+    if(isinstance(samples, str)):
+        samples = read_sample_sheet(samples)
+    if(typing_options.get("workspaces") is None):
+        typing_options["workspaces"] = WorkspaceManager(tmp_dir)
+    return iter_batch(samples, get_database(database),
+                      tmp_dir=os.path.abspath(tmp_dir), workers=workers,
+                      **typing_options)
+
+
+__all__ = ["Sample", "default_mlst_db", "load_database", "read_sample_sheet",
+           "type_batch", "type_sample"]
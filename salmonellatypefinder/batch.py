@@ -0,0 +1,166 @@
+#!/usr/bin/env python3
+
+import os.path
+import sys
+
+
+def eprint(*args, **kwargs):
+    print(*args, file=sys.stderr, **kwargs)
+
+
+# MLST2Serotype object shared by all samples typed in a worker process. It is
+# set once per worker by init_worker().
+_serotyper = None
+
+
+class Sample():
+    ''' A single line of a sample sheet.
+    '''
+
+    def __init__(self, name, files, seqtype="paired", mlst=None):
+        ''' Constructor.
+            name: Sample name written in the output.
+            files: Tuple of input files. One file for single-end and assembled
+                   data, two files for paired-end data.
+            seqtype: Type of sequence: paired, single or assembled.
+            mlst: Known ST. If given, the MLST type will not be searched for.
+        '''
+        self.name = name
+        self.files = files
+        self.seqtype = seqtype
+        self.mlst = mlst
+
+
+def read_sample_sheet(sheet_path):
+    ''' Reads a tab separated sample sheet and returns a list of Sample
+        objects in the order they are found in the sheet.
+        Columns: sample name, R1, R2/assembly, seq type, optional known ST.
+        For single-end and assembled data the third column is left empty.
+        Relative paths are relative to the directory of the sample sheet.
+        Empty lines and lines starting with "#" are ignored.
+    '''
+    sheet_dir = os.path.dirname(os.path.abspath(sheet_path))
+    samples = []
+    names = set()
+
+    with open(sheet_path, "r", encoding="utf-8") as sheet_fh:
+        for line_no, line in enumerate(sheet_fh, start=1):
+            line = line.rstrip("\r\n")
+            if(not line.strip() or line.startswith("#")):
+                continue
+            entries = [entry.strip() for entry in line.split("\t")]
+            if(len(entries) < 4):
+                sys.exit("! ERROR: Sample sheet line {} has fewer than 4 "
+                         "columns: {}".format(line_no, sheet_path))
+
+            name, file1, file2, seqtype = entries[:4]
+            st = entries[4] if(len(entries) > 4) else ""
+
+            if(seqtype not in ("paired", "single", "assembled")):
+                sys.exit("! ERROR: Unknown seq type '{}' in sample sheet line"
+                         " {}".format(seqtype, line_no))
+            # The name is used as the name of the sample's tmp dir.
+            if(name in ("", ".", "..") or "/" in name):
+                sys.exit("! ERROR: Invalid sample name '{}' in sample sheet "
+                         "line {}. Names must not be empty, '.', '..' or "
+                         "contain '/'.".format(name, line_no))
+            if(name in names):
+                sys.exit("! ERROR: Sample name '{}' found more than once in "
+                         "sample sheet".format(name))
+            names.add(name)
+
+            files = [file1]
+            if(seqtype == "paired"):
+                if(not file2):
+                    sys.exit("! ERROR: Paired sample '{}' is missing the R2 "
+                             "file".format(name))
+                files.append(file2)
+
+            filepaths = []
+            for filepath in files:
+                filepath = os.path.join(sheet_dir, filepath)
+                if(not os.path.isfile(filepath)):
+                    sys.exit("! ERROR: Unable to locate input file: {}"
+                             .format(filepath))
+                filepaths.append(filepath)
+
+            if(st):
+                try:
+                    st = int(st)
+                except ValueError:
+                    sys.exit("! ERROR: ST must be an integer in sample sheet "
+                             "line {}: {}".format(line_no, st))
+            else:
+                st = None
+
+            samples.append(Sample(name, tuple(filepaths), seqtype=seqtype,
+                                  mlst=st))
+
+    return samples
+
+
+def init_worker(serotyper):
+    ''' Stores the MLST2Serotype object in the worker process, so that the
+        database is only sent to each worker once.
+    '''
+    global _serotyper
+    _serotyper = serotyper
+
+
+def type_sample(sample, tmp_dir, typing_options):
+    ''' Runs the typing of a single sample. Each sample gets its own tmp dir
+        inside tmp_dir.
+        RETURN: TypingProfile or None if one of the external tools failed
+                or the input is malformed.
+    '''
+    from .subsample import InputError
+    from .toolrunner import ToolError
+    from .typingprofile import TypingProfile
+
+    sample_tmp_dir = os.path.join(tmp_dir, sample.name)
+    try:
+        return TypingProfile(files=sample.files,
+                             mlst2serotype=_serotyper,
+                             seqtype=sample.seqtype,
+                             mlst=sample.mlst,
+                             tmp_dir=sample_tmp_dir,
+                             sample_name=sample.name,
+                             **typing_options)
+    except ToolError as e:
+        eprint(e.details())
+        return None
+    except InputError as e:
+        eprint("! ERROR: {}".format(e))
+        return None
+    except SystemExit as e:
+        eprint(e.code)
+        return None
+
+
+def iter_batch(samples, serotyper, tmp_dir, workers=None, **typing_options):
+    ''' Types all samples using a pool of at most "workers" processes and
+        yields (sample, profile) tuples as soon as each sample is done, in
+        the order they finish. profile is None if the sample could not be
+        typed.
+        The MLST2Serotype object is loaded once by the caller and shared by
+        all workers.
+    '''
+    from concurrent.futures import ProcessPoolExecutor, as_completed
+
+    if(not workers):
+        workers = os.cpu_count() or 1
+    workers = min(workers, max(len(samples), 1))
+
+    with ProcessPoolExecutor(max_workers=workers, initializer=init_worker,
+                             initargs=(serotyper,)) as executor:
+        futures = {executor.submit(type_sample, sample, tmp_dir,
+                                   typing_options): sample
+                   for sample in samples}
+        for future in as_completed(futures):
+            sample = futures.pop(future)
+            profile = future.result()
+            if(profile is None):
+                eprint("! ERROR: Typing failed for sample: {}"
+                       .format(sample.name))
+            yield (sample, profile)
+
@@ -0,0 +1,884 @@
+#!/usr/bin/env python3
+''' Command line interface of SalmonellaTypeFinder, run by
+    SalmonellaTypeFinder.py. A thin wrapper over the library API in api.py.
+    The modules of the optional steps are imported only when their options
+    are given, so the first tool is started as early as possible.
+'''
+
+import os.path
+import sys
+from contextlib import nullcontext
+
+from .api import (DEFAULT_TMP_DIR, default_mlst_db, load_database,
+                  read_sample_sheet, type_batch, type_sample)
+from .subsample import InputError
+from .toolrunner import ToolError
+from .tracing import Tracer
+
+
+def eprint(*args, **kwargs):
+    print(*args, file=sys.stderr, **kwargs)
+
+
+def expand_and_check_path(path, force_dir=False):
+    """ Returns path unaltered/unchecked if it doesn't contain a dir part.
+        If path contains a dir part it finds the absolute path, checks the path
+        and returns the absolute path if it exists.
+    """
+    dir_path = os.path.dirname(path)
+    if(dir_path or force_dir):
+        path = os.path.abspath(path)
+        if(not os.path.exists(path)):
+            sys.exit("Path not found: {}".format(path))
+    return path
+
+
+def options_signature(args):
+    ''' RETURN: The options that change the results, to check that a
+                resumed batch or a work queue is typed with the same options.
+    '''
+    return {name: getattr(args, name) for name in (
+        "mlst_db", "mask_low_count_mlst", "fraction", "seromethod",
+        "mlstmethod", "cgemlst_path", "cgemlstdb_path", "seqsero",
+        "seqsero2", "kma", "max_coverage", "genome_size", "bait",
+        "bait_fasta", "prescreen", "prescreen_fasta")}
+
+
+def make_parser():
+    import argparse
+
+    #
+    # Handling arguments
+    #
+    parser = argparse.ArgumentParser(description="Given raw data or an assembly\
+        files outputs the Serotype and MLST. Run 'SalmonellaTypeFinder.py\
+        query -h' for how to query a results database (--store).")
+    # Posotional arguments
+    parser.add_argument("input_files",
+                        help="Raw data in FASTQ format. Takes 1 (single-end) or 2\
+                              (paired-end) arguments. Omit when using --batch.",
+                        nargs='*',
+                        metavar='FAST(Q|A)')
+    parser.add_argument("-b", "--batch",
+                        help="Tab separated sample sheet with the columns: sample\
+                              name, R1, R2 (empty for single-end and assembled\
+                              data), seq type and an optional known ST. All\
+                              samples are typed in a pool of worker processes\
+                              and written to a single output table.",
+                        default=None,
+                        metavar='SAMPLE_SHEET')
+    parser.add_argument("-w", "--workers",
+                        help="Max. number of samples typed at the same time in\
+                              batch mode. Default: planned from the cores,\
+                              memory and number of samples",
+                        default=None,
+                        metavar="INT",
+                        type=int)
+    parser.add_argument("--tool_threads",
+                        help="Threads given to each tool that takes a thread\
+                              count (KMA and SeqSero2). Default: the cores\
+                              left over when fewer samples than cores are\
+                              typed at the same time",
+                        default=None,
+                        metavar="INT",
+                        type=int)
+    parser.add_argument("--cores",
+                        help="Cores to plan -w and --tool_threads for.\
+                              Default: CPUs available to the process",
+                        default=None,
+                        metavar="INT",
+                        type=int)
+    parser.add_argument("--memory",
+                        help="MB of memory to plan -w for.\
+                              Default: available memory",
+                        default=None,
+                        metavar="MB",
+                        type=int)
+    parser.add_argument("--sample_memory",
+                        help="Estimated MB of memory used by a sample, which\
+                              limits the samples typed at the same time.\
+                              Default: 1000",
+                        default=1000,
+                        metavar="MB",
+                        type=int)
+    parser.add_argument("--resource_plan",
+                        help="File of the splits between samples and tool\
+                              threads benchmarked with --benchmark_plan. The\
+                              best split is used when the cores and tools\
+                              match and there are enough samples.",
+                        metavar="JSON",
+                        default=None)
+    parser.add_argument("--benchmark_plan",
+                        help="Type the first samples of the sample sheet (-b)\
+                              with several splits of the cores between\
+                              samples and tool threads, record the results\
+                              and the fastest split in --resource_plan and\
+                              exit.",
+                        action="store_true",
+                        default=False)
+    parser.add_argument("--journal",
+                        help="Journal of a batch run, recording the result\
+                              of each sample as it finishes. Running the\
+                              same command again skips the samples in the\
+                              journal and types the failed and missing\
+                              ones. The output is written from the journal,\
+                              in the order of the sample sheet, when all\
+                              samples are done.\
+                              Default: <OUTPUT_TXT>.journal with -o",
+                        metavar="JOURNAL",
+                        default=None)
+    parser.add_argument("--restart",
+                        help="Discard the journal of an earlier batch run\
+                              and type all samples.",
+                        action="store_true",
+                        default=False)
+    parser.add_argument("--queue",
+                        help="Distributed mode. Type the samples of a work\
+                              queue in a dir on a filesystem shared by the\
+                              nodes. With -b the queue is made from the\
+                              sample sheet, unless it exists. Start workers\
+                              with the same command on any number of nodes,\
+                              each typing -w samples at a time, and merge\
+                              the results with --finalize.",
+                        metavar="QUEUE_DIR",
+                        default=None)
+    parser.add_argument("--finalize",
+                        help="Write the results of the work queue (--queue)\
+                              to the output in the order of the sample\
+                              sheet, and list the samples that failed or are\
+                              not done.",
+                        action="store_true",
+                        default=False)
+    parser.add_argument("--claim_timeout",
+                        help="Seconds a worker may go without a heartbeat\
+                              before its sample is given to another worker.\
+                              Default: 600",
+                        metavar="SECONDS",
+                        type=float,
+                        default=600)
+    parser.add_argument("--max_attempts",
+                        help="Times a sample in the work queue is tried\
+                              before it is failed. Default: 3",
+                        metavar="INT",
+                        type=int,
+                        default=3)
+    parser.add_argument("-s", "--seq_type",
+                        help="Type of sequence: paired, single or assembled",
+                        choices=["paired", "single", "assembled"],
+                        default="paired")
+    parser.add_argument("-o", "--output",
+                        help="Path to file in which the results will be stored.",
+                        default=None,
+                        metavar='OUTPUT_TXT')
+    parser.add_argument("--serve",
+                        help="Run as a server keeping the database and tool\
+                              configuration loaded, and accept typing jobs as\
+                              JSON over HTTP. ADDRESS is either\
+                              'unix:<socket path>' or '<host>:<port>'. Jobs are\
+                              run on -w workers. See README for the API.",
+                        default=None,
+                        metavar='ADDRESS')
+    parser.add_argument("--out_format",
+                        help="Output format. 'tsv' is a tab separated table,\
+                              'jsonl' is one JSON object per sample.\
+                              Default: tsv",
+                        choices=["tsv", "jsonl"],
+                        default="tsv")
+    parser.add_argument("--gzip",
+                        help="Write gzip compressed output. Requires -o.",
+                        action="store_true",
+                        default=False)
+    parser.add_argument("--shard_size",
+                        help="Start a new output file for every INT samples.\
+                              The files are named <OUTPUT_TXT>.<shard no.>.\
+                              Requires -o.",
+                        metavar="INT",
+                        type=int,
+                        default=None)
+    parser.add_argument("-t", "--tmp_dir",
+                        help="Temporary directory for storage of the results\
+                              from the external software.",
+                        default=DEFAULT_TMP_DIR)
+    parser.add_argument("--keep_tmp",
+                        help="Keep the files written by the external tools:\
+                              'failed' keeps them for samples that failed,\
+                              'always' and 'never' for all or no samples. Each\
+                              sample gets its own dir in the tmp dir.\
+                              Default: failed",
+                        choices=["failed", "always", "never"],
+                        default="failed")
+    parser.add_argument("--tmpfs_dir",
+                        help="Write the files of a sample to this dir, ex. in\
+                              /dev/shm, when it and the RAM have room for them.\
+                              Samples that are kept are moved to the tmp dir.\
+                              Default: always use the tmp dir",
+                        metavar="DIR",
+                        default=None)
+    parser.add_argument("--tmp_quota",
+                        help="Max. size in MB of the files of all samples in the\
+                              tmp dir and --tmpfs_dir. New samples wait while\
+                              the quota is used. Default: no limit",
+                        metavar="MB",
+                        type=int,
+                        default=None)
+    parser.add_argument("-d", "--mlst_db",
+                        help="JSON formatted database used to predict serotypes\
+                              from MLST type. This option defaults to a database\
+                              named 'db.json' located in the 'data' directory,\
+                              or 'db.idx' in the same directory if it has been\
+                              compiled from 'db.json' (see README). A compiled\
+                              index can also be given with this option.",
+                        metavar='JSON_MLST_DB',
+                        default=None)
+    parser.add_argument("-m", "--mask_low_count_mlst",
+                        help="In the mlst<-->serovar database, ignore entries with\
+                              this number of isolates or fewer. This influences\
+                              the detailed MLST serovar output, but also the\
+                              threshold calculation, because the ignored entries\
+                              will not be included in the total sum of isolates\
+                              with the given MLST type and serovar.\
+                              Default: 2",
+                        metavar="INT",
+                        type=int,
+                        default=2)
+    parser.add_argument("-f", "--fraction",
+                        help="Fraction of entries in mlst<-->serovar database that\
+                              needs to agree in order to call a serovar based on\
+                              a MLST type.\
+                              Default: 0.75",
+                        default=0.75,
+                        metavar="FRAC",
+                        type=float)
+    parser.add_argument("-st", "--mlst",
+                        help="Optional. MLST type written as an integer. If\
+                              given, the programme will not find an MLST type\
+                              but use the one provided.",
+                        default=None,
+                        metavar="ST",
+                        type=int)
+    parser.add_argument("--seromethod",
+                        help="Determines which version of SeqSero to use. Options\
+                              are 'seqsero' and 'seqsero2'. Note SeqSero2 is not\
+                              yet published and is currently still in the\
+                              development stage.\
+                              Default: seqsero",
+                        choices=["seqsero", "seqsero2"],
+                        default="seqsero")
+    parser.add_argument("--mlstmethod",
+                        help="Determines how the MLST type is found. 'cgemlst'\
+                              runs CGE MLST (-p1). 'kma' runs KMA directly on\
+                              the senterica scheme of the database (-d1), which\
+                              must be installed with kma_index, and looks up the\
+                              ST in its profile table, which is loaded once.\
+                              'default' runs CGE MLST on reads only.\
+                              Default: default",
+                        choices=["default", "cgemlst", "kma"],
+                        default="default")
+    parser.add_argument("--kma",
+                        help="Path to kma, used with --mlstmethod kma.\
+                              Default: kma",
+                        default="kma")
+    parser.add_argument("--kma_shm",
+                        help="With --mlstmethod kma, load the KMA index of the\
+                              senterica scheme into shared memory once, with\
+                              kma_shm next to kma, for the duration of the run.\
+                              The KMA calls of all samples attach to it. The\
+                              memory is released when the run ends or is\
+                              killed.",
+                        action="store_true",
+                        default=False)
+    parser.add_argument("-p1", "--cgemlst_path",
+                        help="Path to cge mlst tool. Default: mlst.py",
+                        metavar='CGEMLST',
+                        default="mlst.py")
+    parser.add_argument("-d1", "--cgemlstdb_path",
+                        help="Path to mlst database used for cge mlst tool.",
+                        metavar='CGEMLSTDB',
+                        default=None)
+    parser.add_argument("--python3",
+                        help="Path to python3.\
+                              Default: path to calling interpreter.",
+                        default=None)
+    parser.add_argument("--python2",
+                        help="Path to python2.7. Default: python2.7",
+                        default="python2.7")
+    parser.add_argument("--python2_env",
+                        help="Path to a list of commands that will be executed\
+                              just before executing SeqSero. On most systems this\
+                              won't be necessary. The commands to be executed can\
+                              set the environment needed for SeqSero to run (e.g.,\
+                              the python 2.7 environment).",
+                        metavar='TXT',
+                        default=None)
+    parser.add_argument("--seqsero",
+                        help="Path to SeqSero.py. Default: SeqSero.py",
+                        default="SeqSero.py")
+    parser.add_argument("--blastn",
+                        help="Path to blastn. Default: blastn",
+                        default="blastn")
+    parser.add_argument("--makeblastdb",
+                        help="Path to makeblastdb. Default: makeblastdb",
+                        default="makeblastdb")
+    parser.add_argument("--samtools",
+                        help="Path to samtools v. 0.18. Default: samtools",
+                        default="samtools")
+    parser.add_argument("--bwa",
+                        help="Path to bwa. Default: bwa",
+                        default="bwa")
+    parser.add_argument("--seqsero2",
+                        help="Path to SeqSero2_package.py.\
+                              Default: SeqSero2_package.py",
+                        default="SeqSero2_package.py")
+    parser.add_argument("--tool_timeout",
+                        help="Max. number of seconds each external tool may run\
+                              for a sample. Tools running longer are stopped\
+                              and the sample fails. Default: no limit",
+                        metavar="SECONDS",
+                        type=float,
+                        default=None)
+    parser.add_argument("--cache_dir",
+                        help="Directory in which the results of the external\
+                              tools are cached. Samples with identical input\
+                              files, tools, database and options are not run\
+                              again. The directory can be shared between\
+                              several processes and nodes. Default: no cache",
+                        metavar='DIR',
+                        default=None)
+    parser.add_argument("--cache_max_size",
+                        help="Max. size of the cache in MB. The least recently\
+                              used results are removed first. Default: no limit",
+                        metavar="MB",
+                        type=int,
+                        default=None)
+    parser.add_argument("--cache_max_age",
+                        help="Remove results from the cache that have not been\
+                              used for this number of days. Default: no limit",
+                        metavar="DAYS",
+                        type=float,
+                        default=None)
+    parser.add_argument("--input_staging",
+                        help="How gzipped input reaches the tools. 'stage'\
+                              decompresses it once, with pigz if found, to the\
+                              tmp dir of the sample. 'none' lets each tool read\
+                              it. 'auto' measures the decompression and write\
+                              speed on the first sample and picks the cheaper.\
+                              Default: auto",
+                        choices=["auto", "stage", "none"],
+                        default="auto")
+    parser.add_argument("--input_threads",
+                        help="Threads used by pigz to decompress the input.\
+                              Default: 2",
+                        metavar="INT",
+                        type=int,
+                        default=2)
+    parser.add_argument("--max_coverage",
+                        help="Subsample reads to this estimated depth before\
+                              MLST and SeqSero are run. Read pairs are kept\
+                              together. Default: no subsampling",
+                        metavar="DEPTH",
+                        type=float,
+                        default=None)
+    parser.add_argument("--genome_size",
+                        help="Genome size in bp used to estimate the depth for\
+                              --max_coverage. Default: 5000000",
+                        type=int,
+                        default=5000000)
+    parser.add_argument("--bait",
+                        help="Pass only the reads sharing k-mers with the MLST\
+                              alleles (-d1) or the SeqSero antigen references\
+                              to the tools. The k-mer index is built once and\
+                              cached.",
+                        action="store_true",
+                        default=False)
+    parser.add_argument("--bait_fasta",
+                        help="Extra reference FASTA file for --bait. Can be\
+                              given several times.",
+                        action="append",
+                        default=[],
+                        metavar="FASTA")
+    parser.add_argument("--bait_workers",
+                        help="Number of processes filtering reads for --bait.\
+                              Default: 1",
+                        type=int,
+                        default=1)
+    parser.add_argument("--prescreen",
+                        help="Check that each sample is Salmonella, using\
+                              k-mers of the MLST alleles (-d1), before the tools\
+                              are run. Samples failing the check are reported\
+                              as not Salmonella and flagged.",
+                        action="store_true",
+                        default=False)
+    parser.add_argument("--prescreen_fasta",
+                        help="Extra marker locus FASTA file for --prescreen.\
+                              Can be given several times.",
+                        action="append",
+                        default=[],
+                        metavar="FASTA")
+    parser.add_argument("--trace_jsonl",
+                        help="Append the timing of each stage of each sample to\
+                              this file as JSON Lines trace events (name, sample,\
+                              start, end, duration).",
+                        metavar="JSONL",
+                        default=None)
+    parser.add_argument("--trace_prom",
+                        help="Write the stage timings as histograms to this file\
+                              in the Prometheus text format, ex. for the node\
+                              exporter textfile collector.",
+                        metavar="PROM",
+                        default=None)
+    parser.add_argument("--store",
+                        help="Also store the results in this SQLite\
+                              database, together with the tool versions and\
+                              stage timings. Query it with\
+                              'SalmonellaTypeFinder.py query DB'.",
+                        metavar="DB",
+                        default=None)
+
+    return parser
+
+
+def run_queue(args, samples, serotyper, run_tracer, typing_options):
+    ''' Runs the workers of a work queue, or finalizes it.
+        RETURN: Exit code.
+    '''
+    from .workqueue import WorkQueue, run_workers
+
+    signature = options_signature(args)
+    if(samples and WorkQueue.create(args.queue, samples, signature)):
+        eprint("# Created work queue {} with {} samples".format(
+            args.queue, len(samples)))
+    queue = WorkQueue(args.queue, claim_timeout=args.claim_timeout,
+                      max_attempts=args.max_attempts)
+    if(queue.meta["signature"] != signature):
+        eprint("! WARNING: The work queue was created with other options.")
+
+    if(not args.finalize):
+        run_workers(queue, serotyper, tmp_dir=args.tmp_dir,
+                    workers=args.workers or os.cpu_count() or 1,
+                    **typing_options)
+        eprint("# Work queue: {}".format(", ".join(
+            "{} {}".format(count, state)
+            for state, count in queue.counts().items())))
+        return 0
+
+    from .resultwriter import ResultWriter
+
+    missing = []
+    with ResultWriter(path=args.output, out_format=args.out_format,
+                      compress=args.gzip, shard_size=args.shard_size,
+                      tracer=run_tracer) as writer:
+        for sample_name, done, failed in queue.results():
+            if(done):
+                writer.write_result(done["txt"], done["result"],
+                                    sample=sample_name)
+            elif(failed):
+                eprint("! ERROR: Typing failed for sample: {} ({}, {} "
+                       "attempts)".format(sample_name, failed["reason"],
+                                          failed["attempts"]))
+                missing.append(sample_name)
+            else:
+                eprint("! ERROR: Sample not typed yet: {}"
+                       .format(sample_name))
+                missing.append(sample_name)
+    if(not args.output and args.out_format == "tsv"):
+        print()
+
+    if(missing):
+        return 1
+    return 0
+
+
+def run_benchmark_plan(args, samples, serotyper, typing_options):
+    ''' Benchmarks the splits of the cores on the first samples of the batch
+        and records them in args.resource_plan.
+        RETURN: Exit code.
+    '''
+    from .planner import (available_cores, available_memory,
+                          benchmark_splits, record_benchmark, sample_tools)
+
+    cores = args.cores or available_cores()
+    memory = args.memory
+    if(memory is None):
+        memory = available_memory()
+    threaded, single = sample_tools(args.seromethod, args.mlstmethod)
+    if(len(samples) < cores):
+        eprint("! WARNING: Fewer samples ({}) than cores ({}). The splits "
+               "with many samples at a time are not filled."
+               .format(len(samples), cores))
+    results = benchmark_splits(samples[:cores], serotyper, args.tmp_dir,
+                               cores=cores, **typing_options)
+
+    print("workers\ttool_threads\tsamples\tfailed\twall_s\tthroughput")
+    for result in results:
+        print("{workers}\t{tool_threads}\t{samples}\t{failed}\t{wall_s:.2f}"
+              "\t{throughput:.3f}".format(**result))
+    best = record_benchmark(args.resource_plan, results, cores, memory,
+                            threaded)
+    if(best is None):
+        eprint("! ERROR: Samples failed with every split, nothing recorded.")
+        return 1
+    eprint("# Best: {} sample(s) at a time with {} thread(s) per tool, "
+           "recorded in {}".format(best["workers"], best["tool_threads"],
+                                   args.resource_plan))
+    return 0
+
+
+def main(argv=None):
+    ''' Runs SalmonellaTypeFinder with the command line arguments argv
+        (default: sys.argv[1:]).
+        RETURN: Exit code.
+    '''
+    if(argv is None):
+        argv = sys.argv[1:]
+    if(argv and argv[0] == "query"):
+        from .resultstore import query_main
+
+        return query_main(argv[1:])
+
+    args = make_parser().parse_args(argv)
+
+    if(args.finalize and not args.queue):
+        sys.exit("! ERROR: --finalize requires --queue.")
+    if(args.benchmark_plan and not (args.batch and args.resource_plan)):
+        sys.exit("! ERROR: --benchmark_plan requires -b and "
+                 "--resource_plan.")
+    # The server loads the database itself and serves jobs until stopped.
+    if(args.serve and (args.batch or args.queue or args.benchmark_plan)):
+        sys.exit("! ERROR: --serve cannot be given together with -b, --queue "
+                 "or --benchmark_plan.")
+
+    # Check input files
+    input_files = []
+    samples = []
+    if(args.batch):
+        if(args.input_files):
+            sys.exit("! ERROR: Input files cannot be given together with a "
+                     "sample sheet.")
+        if(not os.path.isfile(args.batch)):
+            sys.exit("! ERROR: Unable to locate sample sheet: {}"
+                     .format(args.batch))
+        samples = read_sample_sheet(args.batch)
+        if(not samples):
+            sys.exit("! ERROR: No samples found in sample sheet: {}"
+                     .format(args.batch))
+    elif(args.serve):
+        if(args.input_files):
+            sys.exit("! ERROR: Input files cannot be given together with "
+                     "--serve.")
+    elif(args.queue):
+        if(args.input_files):
+            sys.exit("! ERROR: Input files cannot be given together with "
+                     "--queue.")
+    elif(args.input_files):
+        if(len(args.input_files) > 2):
+            sys.exit("! ERROR: Too many input arguments.")
+
+        for filepath in args.input_files:
+            filepath = os.path.abspath(filepath)
+            if(not os.path.isfile(filepath)):
+                sys.exit("! ERROR: Unable to locate input file: {}"
+                         .format(filepath))
+            input_files.append(filepath)
+    else:
+        sys.exit("! ERROR: Too few input arguments.")
+
+    if((args.gzip or args.shard_size) and not args.output):
+        sys.exit("! ERROR: --gzip and --shard_size require an output file "
+                 "(-o).")
+
+    # Check tmp dir
+    args.tmp_dir = os.path.abspath(args.tmp_dir)
+    # Create tmp dir unless it already exists
+    os.makedirs(args.tmp_dir, exist_ok=True)
+
+    # Check JSON database.
+    if(not args.mlst_db):
+        args.mlst_db = default_mlst_db()
+    if(not os.path.isfile(args.mlst_db)):
+        print("JSON MLST database file not found:", args.mlst_db)
+        return 1
+
+    # Check programme paths
+
+    if(args.python3 is None):
+        args.python3 = sys.executable
+
+    args.cgemlst_path = expand_and_check_path(args.cgemlst_path)
+    args.cgemlstdb_path = expand_and_check_path(args.cgemlstdb_path,
+                                                force_dir=True)
+    args.python3 = expand_and_check_path(args.python3)
+    args.python2 = expand_and_check_path(args.python2)
+    args.seqsero = expand_and_check_path(args.seqsero)
+    args.seqsero2 = expand_and_check_path(args.seqsero2)
+    args.blastn = expand_and_check_path(args.blastn)
+    args.makeblastdb = expand_and_check_path(args.makeblastdb)
+    args.samtools = expand_and_check_path(args.samtools)
+    args.bwa = expand_and_check_path(args.bwa)
+    args.kma = expand_and_check_path(args.kma)
+
+    if(args.mlstmethod == "kma"):
+        from .kmamlst import find_scheme_files, load_scheme
+
+        if(not args.cgemlstdb_path):
+            sys.exit("! ERROR: --mlstmethod kma requires the MLST database "
+                     "(-d1).")
+        # Loads the ST profiles before worker processes are started, so they
+        # share them.
+        try:
+            kma_index, profile_path = find_scheme_files(args.cgemlstdb_path)
+            load_scheme(profile_path)
+            if(args.kma_shm):
+                import atexit
+                from .kmashm import KMASharedIndex
+
+                kma_shm_path = os.path.join(os.path.dirname(args.kma),
+                                            "kma_shm")
+                shared_index = KMASharedIndex(kma_index,
+                                              kma_shm=kma_shm_path)
+                shared_index.open()
+                atexit.register(shared_index.close)
+        except ToolError as e:
+            sys.exit("! ERROR: {}".format(e))
+    elif(args.kma_shm):
+        sys.exit("! ERROR: --kma_shm requires --mlstmethod kma.")
+
+    # Load database and create mlst2serotype object.
+    serotyper_options = {
+        "json_file": args.mlst_db,
+        "min_sero_count": 3,
+        "min_frac": args.fraction,
+        "mask_low_count": args.mask_low_count_mlst
+    }
+    # Timing of the stages that are not tied to a single sample.
+    run_tracer = Tracer()
+    if(not args.serve):
+        serotyper = load_database(args.mlst_db, min_sero_count=3,
+                                  min_frac=args.fraction,
+                                  mask_low_count=args.mask_low_count_mlst,
+                                  tracer=run_tracer)
+
+    # Result cache for the external tools.
+    cache = None
+    if(args.cache_dir):
+        from .resultcache import ResultCache
+
+        cache_max_size = None
+        if(args.cache_max_size is not None):
+            cache_max_size = args.cache_max_size * 1024 * 1024
+        cache_max_age = None
+        if(args.cache_max_age is not None):
+            cache_max_age = args.cache_max_age * 24 * 3600
+        cache = ResultCache(args.cache_dir, max_size=cache_max_size,
+                            max_age=cache_max_age)
+
+    # Each sample is run in its own workspace in the tmp dir.
+    from .workspace import WorkspaceManager
+    from .inputstage import InputStager
+
+    tmp_quota = None
+    if(args.tmp_quota is not None):
+        tmp_quota = args.tmp_quota * 1024 * 1024
+    workspaces = WorkspaceManager(args.tmp_dir, keep=args.keep_tmp,
+                                  tmpfs_dir=args.tmpfs_dir, quota=tmp_quota)
+
+    # SeqSero dependencies
+    seqsero_dependencies = {
+        "seqsero": args.seqsero,
+        "blastn": args.blastn,
+        "makeblastdb": args.makeblastdb,
+        "samtools": args.samtools,
+        "bwa": args.bwa,
+        "python2": args.python2
+    }
+
+    typing_options = {
+        "python2_env": args.python2_env,
+        "cgemlst_path": args.cgemlst_path,
+        "cgemlstdb_path": args.cgemlstdb_path,
+        "python3": args.python3,
+        "seqsero2": args.seqsero2,
+        "seromethod": args.seromethod,
+        "mlstmethod": args.mlstmethod,
+        "kma": args.kma,
+        "kma_shm_level": 1 if(args.kma_shm) else None,
+        "cache": cache,
+        "tool_timeout": args.tool_timeout,
+        "max_coverage": args.max_coverage,
+        "genome_size": args.genome_size,
+        "bait": args.bait,
+        "bait_fastas": args.bait_fasta,
+        "bait_workers": args.bait_workers,
+        "prescreen": args.prescreen,
+        "prescreen_fastas": args.prescreen_fasta,
+        "index_cache_dir": args.cache_dir or args.tmp_dir,
+        "workspaces": workspaces,
+        "input_stager": InputStager(strategy=args.input_staging,
+                                    threads=args.input_threads)
+    }
+    typing_options.update(seqsero_dependencies)
+
+    # Checks the references and builds the k-mer indexes once, before the
+    # samples are typed.
+    if(args.bait):
+        from .readbait import ReadBait
+
+        try:
+            ReadBait(cgemlstdb_path=args.cgemlstdb_path,
+                     seqsero_path=args.seqsero, seqsero2_path=args.seqsero2,
+                     bait_fastas=args.bait_fasta,
+                     cache_dir=typing_options["index_cache_dir"]
+                     ).ensure_index()
+        except InputError as e:
+            eprint("! ERROR: {}".format(e))
+            return 1
+    if(args.prescreen):
+        from .prescreen import PreScreen
+
+        try:
+            PreScreen(cgemlstdb_path=args.cgemlstdb_path,
+                      marker_fastas=args.prescreen_fasta,
+                      cache_dir=typing_options["index_cache_dir"]
+                      ).ensure_index()
+        except InputError as e:
+            eprint("! ERROR: {}".format(e))
+            return 1
+
+    if(args.benchmark_plan):
+        return run_benchmark_plan(args, samples, serotyper, typing_options)
+
+    # Splits the cores between the samples typed at the same time and the
+    # threads of the tools.
+    from .planner import load_benchmark, plan_resources
+
+    sample_count = None
+    if(samples):
+        sample_count = len(samples)
+    elif(input_files):
+        sample_count = 1
+    plan = plan_resources(samples=sample_count, cores=args.cores,
+                          memory=args.memory,
+                          sample_memory=args.sample_memory,
+                          seromethod=args.seromethod,
+                          mlstmethod=args.mlstmethod, mlst=args.mlst,
+                          workers=args.workers,
+                          tool_threads=args.tool_threads,
+                          benchmark=load_benchmark(args.resource_plan))
+    if(samples or args.serve or (args.queue and not args.finalize)):
+        eprint("# Resource plan: {}".format(plan))
+    args.workers = plan.workers
+    typing_options["tool_threads"] = plan.tool_threads
+
+    if(args.queue):
+        return run_queue(args, samples, serotyper, run_tracer,
+                         typing_options)
+
+    if(args.serve):
+        from .server import TypingServer, serve
+
+        typing_server = TypingServer(serotyper_options, tmp_dir=args.tmp_dir,
+                                     workers=args.workers, **typing_options)
+        serve(args.serve, typing_server)
+        return 0
+
+    from .resultwriter import ResultWriter
+    from .tracing import TraceExporter
+
+    # Each result is written as soon as the sample is done.
+    writer = ResultWriter(path=args.output, out_format=args.out_format,
+                          compress=args.gzip, shard_size=args.shard_size,
+                          tracer=run_tracer)
+    # Spans are exported as each sample finishes.
+    exporter = TraceExporter(jsonl_path=args.trace_jsonl,
+                             prom_path=args.trace_prom)
+    # Results are also stored in the database in batches.
+    store = None
+    if(args.store):
+        from .resultstore import ResultStore
+
+        store_tools = {"mlst_db": args.mlst_db}
+        if(args.mlstmethod == "kma"):
+            store_tools["kma"] = args.kma
+        else:
+            store_tools["cgemlst"] = args.cgemlst_path
+        if(args.seromethod == "seqsero2"):
+            store_tools["seqsero2"] = args.seqsero2
+        else:
+            store_tools["seqsero"] = args.seqsero
+        store = ResultStore(args.store, tools=store_tools,
+                            command=" ".join([sys.argv[0]] + argv),
+                            tracer=run_tracer)
+
+    # Batch runs writing to a file keep a journal, so a run that dies can
+    # be resumed.
+    journal = None
+    if(samples and (args.journal or args.output)):
+        from .journal import BatchJournal
+
+        journal = BatchJournal(args.journal or args.output + ".journal",
+                               options_signature(args), restart=args.restart)
+
+    failed = []
+    with writer, exporter, store or nullcontext(), journal or nullcontext():
+        if(samples):
+            todo = samples
+            if(journal):
+                todo = [sample for sample in samples
+                        if(not journal.is_done(sample))]
+                if(len(todo) < len(samples)):
+                    eprint("# Resuming from {}: {} of {} samples done"
+                           .format(journal.path, len(samples) - len(todo),
+                                   len(samples)))
+            if(todo):
+                for sample, profile in type_batch(todo, database=serotyper,
+                                                  tmp_dir=args.tmp_dir,
+                                                  workers=args.workers,
+                                                  **typing_options):
+                    if(profile is None):
+                        failed.append(sample)
+                        if(journal):
+                            journal.add_failed(sample)
+                    else:
+                        if(journal):
+                            journal.add(sample, profile)
+                        else:
+                            writer.write(profile)
+                        if(store):
+                            store.write(profile)
+                        exporter.add(profile.tracer.spans)
+                    exporter.add(run_tracer.pop())
+            # The output is assembled from the journal in the order of the
+            # sample sheet.
+            if(journal):
+                for sample in samples:
+                    result = journal.result(sample)
+                    if(result):
+                        writer.write_result(*result, sample=sample.name)
+        else:
+            try:
+                profile = type_sample(input_files, seqtype=args.seq_type,
+                                      mlst=args.mlst, database=serotyper,
+                                      tmp_dir=args.tmp_dir, **typing_options)
+            except ToolError as e:
+                eprint(e.details())
+                return 1
+            except InputError as e:
+                eprint("! ERROR: {}".format(e))
+                return 1
+            writer.write(profile)
+            if(store):
+                store.write(profile)
+            exporter.add(profile.tracer.spans)
+            exporter.add(run_tracer.pop())
+
+    # The table printed to stdout has always ended with an empty line.
+    if(not args.output and args.out_format == "tsv"):
+        print()
+
+    if(failed):
+        return 1
+
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,275 @@
+#!/usr/bin/env python3
+
+import gzip
+import re
+import sys
+import time
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+
+
+def eprint(*args, **kwargs):
+    print(*args, file=sys.stderr, **kwargs)
+
+
+# Regexp to detect serotypes written as ex. "Salmonella Typhi"
+re_serotype_w_salm = re.compile(r"^salmonella\s*(.+)", re.IGNORECASE)
+
+
+def open_tab_db(path):
+    ''' Opens a tab separated database export in binary mode. Gzip
+        compressed files are detected by their magic bytes.
+    '''
+    with open(path, "rb") as fh:
+        magic = fh.read(2)
+    if(magic == b"\x1f\x8b"):
+        return gzip.open(path, "rb")
+    return open(path, "rb")
+
+
+def decode_lines(data):
+    ''' Decodes a block of complete lines. Line endings are translated the
+        same way as when a file is read in text mode.
+    '''
+    text = data.decode("utf-8")
+    text = text.replace("\r\n", "\n").replace("\r", "\n")
+    lines = text.split("\n")
+    # The last entry is the (empty) rest after the final newline.
+    if(lines[-1]):
+        return [line + "\n" for line in lines[:-1]] + [lines[-1]]
+    return [line + "\n" for line in lines[:-1]]
+
+
+def parse_header(header_line):
+    ''' RETURN: Column indexes (st, ebg, serovar). Exits if a column is
+                missing.
+    '''
+    index_st = None
+    index_serotype = None
+    index_ebg = None
+
+    headers = header_line.strip().split("\t")
+    for i, header in enumerate(headers):
+        header = header.lower()
+
+        if(header == "st"):
+            index_st = i
+        if(header == "ebg"):
+            index_ebg = i
+        elif(header == "serovar"):
+            index_serotype = i
+
+    for name, index in (("ST", index_st), ("eBG", index_ebg),
+                        ("Serovar", index_serotype)):
+        if(index is None):
+            sys.exit("! ERROR: Column '{}' not found in the header of the "
+                     "database file.".format(name))
+
+    return (index_st, index_ebg, index_serotype)
+
+
+def normalize_serotype(serotype):
+    ''' RETURN: Serotype as stored in the database, or None if the row
+                should be skipped.
+    '''
+    serotype = serotype.lower().strip()
+
+    # If serotype is blank, skip.
+    if(not serotype):
+        return None
+
+    # Filtering out an error in the enterodatabase.
+    if(serotype == "shigella flexneri"):
+        return None
+
+    # If required removes "Salmonella" from serotype.
+    salm_match = re_serotype_w_salm.search(serotype)
+    if(salm_match):
+        serotype = salm_match.group(1)
+
+    # Ex.: changes saint-paul to saintpaul.
+    return serotype.replace("-", "")
+
+
+def count_block(data, indexes):
+    ''' Counts the serotypes of a block of rows.
+        RETURN: (st_counts, ebg_counts, rows, malformed rows). The counts are
+                dictionaries st/ebg --> {serotype: count}, in the order the
+                keys are first seen.
+    '''
+    index_st, index_ebg, index_serotype = indexes
+    st_counts = {}
+    ebg_counts = {}
+    rows = 0
+    malformed = 0
+
+    for line in decode_lines(data):
+        rows += 1
+        entries = line.split("\t")
+        try:
+            st = entries[index_st]
+            ebg = entries[index_ebg]
+            serotype = entries[index_serotype]
+        except IndexError:
+            malformed += 1
+            continue
+
+        serotype = normalize_serotype(serotype)
+        if(serotype is None):
+            continue
+
+        st_serotypes = st_counts.setdefault(st, {})
+        st_serotypes[serotype] = st_serotypes.get(serotype, 0) + 1
+        ebg_serotypes = ebg_counts.setdefault(ebg, {})
+        ebg_serotypes[serotype] = ebg_serotypes.get(serotype, 0) + 1
+
+    return (st_counts, ebg_counts, rows, malformed)
+
+
+def merge_counts(total, counts):
+    for key, serotypes in counts.items():
+        total_serotypes = total.setdefault(key, {})
+        for serotype, count in serotypes.items():
+            total_serotypes[serotype] = (total_serotypes.get(serotype, 0)
+                                         + count)
+
+
+def apply_counts(total, counts, sign=1):
+    ''' Adds (sign=1) or subtracts (sign=-1) counts from the counts in total.
+        Serotypes that reach zero are removed, and so are keys without
+        serotypes left. Counts never go below zero.
+        RETURN: (changed keys, serotypes that were subtracted below zero). The
+                latter is a list of (key, serotype, missing count).
+    '''
+    changed = set()
+    missing = []
+    for key, serotypes in counts.items():
+        total_serotypes = total.setdefault(key, {})
+        for serotype, count in serotypes.items():
+            new_count = total_serotypes.get(serotype, 0) + sign * count
+            if(new_count < 0):
+                missing.append((key, serotype, -new_count))
+                new_count = 0
+            if(new_count == total_serotypes.get(serotype, 0)):
+                continue
+            changed.add(key)
+            if(new_count):
+                total_serotypes[serotype] = new_count
+            else:
+                del total_serotypes[serotype]
+        if(not total_serotypes):
+            del total[key]
+    return (changed, missing)
+
+
+def read_blocks(fh, block_size):
+    ''' Reads the file in blocks of about block_size bytes that end at a line
+        break.
+    '''
+    rest = b""
+    while(True):
+        data = fh.read(block_size)
+        if(not data):
+            break
+        data = rest + data
+        end = data.rfind(b"\n") + 1
+        if(end == 0):
+            rest = data
+            continue
+        rest = data[end:]
+        yield data[:end]
+    if(rest):
+        yield rest
+
+
+class DBBuilder():
+    ''' Builds the ST --> serovar and eBG --> serovar counts of the JSON
+        database from a tab separated EnteroBase export. The file is read in
+        blocks, which are counted in a pool of processes and merged in file
+        order, so the output is identical to counting the rows one by one.
+    '''
+
+    def __init__(self, workers=1, block_size=8 * 1024 * 1024, progress=True):
+        ''' Constructor.
+            workers: Number of processes counting blocks. With 1 the blocks
+                     are counted in this process.
+            block_size: Bytes read per block.
+            progress: Print progress and rows/s to stderr.
+        '''
+        self.workers = max(workers or 1, 1)
+        self.block_size = block_size
+        self.progress = progress
+        self.rows = 0
+        self.malformed = 0
+        self.seconds = 0
+        self.last_report = 0
+
+    def build(self, tab_db_file):
+        ''' RETURN: Database dictionary as written to the JSON file.
+                    {"ebg": {ebg: {serotype: count}},
+                     st: {serotype: count}, ...}
+        '''
+        st_counts, ebg_counts = self.count(tab_db_file)
+        output_hash = {}
+        output_hash["ebg"] = ebg_counts  # stores eBG types.
+        merge_counts(output_hash, st_counts)
+        return output_hash
+
+    def count(self, tab_db_file):
+        ''' RETURN: (st_counts, ebg_counts), see count_block.
+        '''
+        start = time.perf_counter()
+        st_counts = {}
+        ebg_counts = {}
+        self.rows = 0
+        self.malformed = 0
+        self.last_report = start
+
+        with open_tab_db(tab_db_file) as tab_db_fh:
+            indexes = parse_header(tab_db_fh.readline().decode("utf-8"))
+            blocks = read_blocks(tab_db_fh, self.block_size)
+
+            for block_counts in self.count_blocks(blocks, indexes):
+                st_block, ebg_block, rows, malformed = block_counts
+                merge_counts(st_counts, st_block)
+                merge_counts(ebg_counts, ebg_block)
+                self.rows += rows
+                self.malformed += malformed
+                if(self.progress):
+                    self.report(start, time.perf_counter())
+
+        self.seconds = time.perf_counter() - start
+        if(self.progress):
+            eprint("# Read {} rows in {:.1f} s ({:.0f} rows/s), skipped {} "
+                   "malformed rows".format(self.rows, self.seconds,
+                                           self.rows / max(self.seconds, 1e-9),
+                                           self.malformed))
+
+        return (st_counts, ebg_counts)
+
+    def count_blocks(self, blocks, indexes):
+        ''' Yields the counts of each block in file order. At most two blocks
+            per worker are in flight, so memory use does not depend on the
+            file size.
+        '''
+        if(self.workers == 1):
+            for data in blocks:
+                yield count_block(data, indexes)
+            return
+
+        with ProcessPoolExecutor(max_workers=self.workers) as executor:
+            futures = deque()
+            for data in blocks:
+                futures.append(executor.submit(count_block, data, indexes))
+                if(len(futures) >= 2 * self.workers):
+                    yield futures.popleft().result()
+            while(futures):
+                yield futures.popleft().result()
+
+    def report(self, start, now):
+        # At most one progress line per second.
+        if(now - self.last_report < 1):
+            return
+        self.last_report = now
+        eprint("# {} rows, {:.0f} rows/s".format(
+            self.rows, self.rows / max(now - start, 1e-9)))
@@ -0,0 +1,221 @@
+#!/usr/bin/env python3
+
+import json
+import sys
+
+
+def eprint(*args, **kwargs):
+    print(*args, file=sys.stderr, **kwargs)
+
+
+# Written once at the top of a report. Rendered tables are plain <table>s,
+# so the page they are embedded in can style them.
+STYLE = '''<style>
+.stf-report .stf-controls { margin: 0.5em 0; }
+.stf-report .stf-controls input, .stf-report .stf-controls select,
+.stf-report .stf-controls button { margin-right: 0.5em; }
+.stf-report th { cursor: pointer; white-space: nowrap; }
+.stf-report th.stf-asc:after { content: " \\25B2"; }
+.stf-report th.stf-desc:after { content: " \\25BC"; }
+</style>
+'''
+
+# Renders each <script type="application/json" class="stf-data"> as a table
+# showing one page of rows, sorted on the clicked column and filtered on the
+# text in the filter box. Only the rows of the current page are in the DOM.
+SCRIPT = '''<script>
+(function() {
+  function cmp(a, b) {
+    var x = parseFloat(a), y = parseFloat(b);
+    if (!isNaN(x) && !isNaN(y) && String(x) === a && String(y) === b) {
+      return x - y;
+    }
+    return a < b ? -1 : (a > b ? 1 : 0);
+  }
+  function el(tag, text) {
+    var e = document.createElement(tag);
+    if (text !== undefined) { e.textContent = text; }
+    return e;
+  }
+  function render(data_el) {
+    var data = JSON.parse(data_el.textContent);
+    var rows = data.rows, shown = rows, page = 0;
+    var size = data.page_size, sort_col = -1, sort_dir = 1;
+    var box = data_el.parentNode;
+    var controls = el("div"), table = el("table"), info = el("span");
+    controls.className = "stf-controls";
+    var filter = el("input");
+    filter.placeholder = "Filter";
+    var sizes = el("select");
+    [25, 100, 500, 1000].concat([size]).sort(function(a, b) {
+      return a - b; }).forEach(function(n, i, all) {
+      if (i && all[i - 1] === n) { return; }
+      var option = el("option", n + " per page");
+      option.value = n;
+      option.selected = (n === size);
+      sizes.appendChild(option);
+    });
+    var prev = el("button", "Previous"), next = el("button", "Next");
+    [filter, sizes, prev, next, info].forEach(function(e) {
+      controls.appendChild(e); });
+    var thead = el("thead"), tbody = el("tbody"), head_row = el("tr");
+    data.headers.forEach(function(header, col) {
+      var th = el("th", header);
+      th.addEventListener("click", function() {
+        sort_dir = (sort_col === col) ? -sort_dir : 1;
+        sort_col = col;
+        Array.prototype.forEach.call(head_row.children, function(e) {
+          e.className = ""; });
+        th.className = sort_dir > 0 ? "stf-asc" : "stf-desc";
+        shown = shown.slice().sort(function(a, b) {
+          return sort_dir * cmp(a[col], b[col]); });
+        page = 0;
+        draw();
+      });
+      head_row.appendChild(th);
+    });
+    thead.appendChild(head_row);
+    table.appendChild(thead);
+    table.appendChild(tbody);
+    box.appendChild(controls);
+    box.appendChild(table);
+
+    function draw() {
+      var pages = Math.max(Math.ceil(shown.length / size), 1);
+      page = Math.min(page, pages - 1);
+      var body = el("tbody");
+      shown.slice(page * size, (page + 1) * size).forEach(function(row) {
+        var tr = el("tr");
+        for (var col = 0; col < data.headers.length; col++) {
+          tr.appendChild(el("td", row[col] === undefined ? "" : row[col]));
+        }
+        body.appendChild(tr);
+      });
+      table.replaceChild(body, tbody);
+      tbody = body;
+      info.textContent = "Page " + (page + 1) + " of " + pages + ", " +
+        shown.length + " of " + rows.length + " rows";
+      prev.disabled = (page === 0);
+      next.disabled = (page >= pages - 1);
+    }
+    function apply_filter() {
+      var text = filter.value.toLowerCase();
+      shown = rows.filter(function(row) {
+        return !text || row.join("\\t").toLowerCase().indexOf(text) >= 0;
+      });
+      if (sort_col >= 0) {
+        shown.sort(function(a, b) {
+          return sort_dir * cmp(a[sort_col], b[sort_col]); });
+      }
+      page = 0;
+      draw();
+    }
+    var timer = null;
+    filter.addEventListener("input", function() {
+      clearTimeout(timer);
+      timer = setTimeout(apply_filter, 200);
+    });
+    sizes.addEventListener("change", function() {
+      size = parseInt(sizes.value, 10);
+      page = 0;
+      draw();
+    });
+    prev.addEventListener("click", function() { page--; draw(); });
+    next.addEventListener("click", function() { page++; draw(); });
+    draw();
+  }
+  var data_els = document.querySelectorAll("script.stf-data");
+  Array.prototype.forEach.call(data_els, render);
+})();
+</script>
+'''
+
+
+def json_for_script(obj):
+    ''' Compact JSON that can be placed in a <script> element. "<" only
+        occurs in strings, where it is escaped, so the data cannot close the
+        element.
+    '''
+    return json.dumps(obj, separators=(",", ":")).replace("<", "\\u003c")
+
+
+class HTMLReport():
+    ''' Writes an HTML report to an open file, piece by piece, so memory use
+        does not grow with the number of samples. Each table is written as
+        compact JSON, one row at a time, and rendered in the browser as a
+        paginated table that can be sorted and filtered.
+        The report is an HTML fragment, as the output has always been, and
+        can be embedded in a page or opened directly.
+        Used as a context manager, which writes the end of the report.
+    '''
+
+    def __init__(self, out_fh, page_size=100):
+        ''' Constructor.
+            out_fh: File the report is written to.
+            page_size: Rows shown per page.
+        '''
+        self.out_fh = out_fh
+        self.page_size = page_size
+        self.tables = 0
+        self.out_fh.write('<div class="stf-report">\n')
+        self.out_fh.write(STYLE)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def html(self, html):
+        ''' Writes html as is.
+        '''
+        self.out_fh.write(html)
+
+    def table(self, headers, rows):
+        ''' Writes a table.
+            headers: Column names.
+            rows: Iterable of lists of strings. Rows are read one at a time.
+            RETURN: Number of rows written.
+        '''
+        self.tables += 1
+        self.out_fh.write('<div class="stf-table">\n'
+                          '<script type="application/json" class="stf-data"'
+                          ' id="stf-data-{}">'.format(self.tables))
+        self.out_fh.write('{{"headers":{},"page_size":{},"rows":['.format(
+            json_for_script(list(headers)), int(self.page_size)))
+        row_count = 0
+        for row in rows:
+            if(row_count):
+                self.out_fh.write(",\n")
+            self.out_fh.write(json_for_script(list(row)))
+            row_count += 1
+        self.out_fh.write("]}</script>\n"
+                          "<noscript>Enable JavaScript to view the table."
+                          "</noscript>\n"
+                          "</div>\n")
+        return row_count
+
+    def close(self):
+        if(self.out_fh is None):
+            return
+        self.out_fh.write(SCRIPT)
+        self.out_fh.write("</div>\n")
+        self.out_fh = None
+
+
+def read_tsv_rows(lines, columns=None, skip_header=None):
+    ''' Yields the fields of each non-empty tab separated line.
+        columns: Number of fields in each row. Shorter rows are padded with
+                 empty fields and longer rows are cut.
+        skip_header: Lines starting with this text are skipped.
+    '''
+    for line in lines:
+        line = line.rstrip("\r\n")
+        if(not line.strip()):
+            continue
+        if(skip_header and line.startswith(skip_header)):
+            continue
+        fields = [field.strip() for field in line.split("\t")]
+        if(columns is not None):
+            fields = (fields + [""] * columns)[:columns]
+        yield fields
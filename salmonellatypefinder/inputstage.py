@@ -0,0 +1,294 @@
+#!/usr/bin/env python3
+
+import os
+import shutil
+import subprocess
+import sys
+import time
+import zlib
+
+from .toolrunner import ToolError, cmd2string
+from .workspace import Workspace
+
+
+def eprint(*args, **kwargs):
+    print(*args, file=sys.stderr, **kwargs)
+
+
+# Number of times each consumer reads its input. SeqSero runs BWA on the
+# reads, which reads them once to align and again to write the SAM file.
+CONSUMER_PASSES = {
+    "cgemlst": 1,
+    "kma": 1,
+    "seqsero": 2,
+    "seqsero2": 2,
+    "subsample": 1,
+    "read_bait": 1
+}
+
+# Measured rates, see InputStager.calibrate. Kept per process, so worker
+# processes typing many samples measure once.
+_rates = {}
+
+
+def is_gzipped(path):
+    with open(path, "rb") as fh:
+        return fh.read(2) == b"\x1f\x8b"
+
+
+def staged_name(path, file_no):
+    ''' Name of the decompressed copy. The R<no> prefix keeps files with the
+        same name in different dirs apart.
+    '''
+    name = os.path.basename(path)
+    for ext in (".gz", ".gzip"):
+        if(name.endswith(ext)):
+            name = name[:-len(ext)]
+    return "R{}_{}".format(file_no, name)
+
+
+class InputStager():
+    ''' Decides how the consumers of a sample (the external tools, or the
+        subsampler or read bait in front of them) get the reads, and stages
+        them.
+        "none": Each consumer reads and decompresses the input itself, once
+                for every pass over it.
+        "stage": The input is decompressed once, with pigz when available,
+                 to a plain copy in the workspace that all consumers read.
+        "auto": The cheaper of the two, from the decompression and write
+                rates measured on the first sample.
+        Plain input is never staged.
+    '''
+
+    def __init__(self, strategy="auto", threads=2, calibrate_bytes=32000000,
+                 decompressor=None):
+        ''' Constructor.
+            threads: Threads used by pigz.
+            calibrate_bytes: Compressed bytes decompressed to measure the
+                             rates.
+            decompressor: Path to pigz or gzip. Default: pigz if found in
+                          PATH, else gzip. If neither is found, the input
+                          is not staged.
+        '''
+        if(strategy not in ("auto", "stage", "none")):
+            raise ValueError("Unknown input staging strategy: {}"
+                             .format(strategy))
+        self.strategy = strategy
+        self.threads = max(threads or 1, 1)
+        self.calibrate_bytes = calibrate_bytes
+        if(decompressor is None):
+            decompressor = shutil.which("pigz") or shutil.which("gzip")
+        self.decompressor = decompressor
+
+    def decompress_argv(self, path):
+        argv = [self.decompressor, "-dc"]
+        if(os.path.basename(self.decompressor).startswith("pigz")):
+            argv += ["-p", str(self.threads)]
+        return argv + [path]
+
+    def calibrate(self, path, stage_dir):
+        ''' Measures, on the start of path:
+            read_rate: Compressed bytes per second read and decompressed in
+                       a single thread, as the tools do.
+            decompress_rate: Compressed bytes per second read and
+                             decompressed by the decompressor.
+            write_rate: Decompressed bytes per second written to stage_dir.
+            ratio: Decompressed bytes per compressed byte.
+            RETURN: dict with the rates.
+        '''
+        key = (os.stat(path).st_dev, os.stat(stage_dir).st_dev,
+               self.decompressor, self.threads)
+        if(key in _rates):
+            return _rates[key]
+
+        with open(path, "rb") as fh:
+            start = time.perf_counter()
+            data = fh.read(self.calibrate_bytes)
+            decompressor = zlib.decompressobj(wbits=32 + zlib.MAX_WBITS)
+            plain = decompressor.decompress(data)
+            read_time = time.perf_counter() - start
+        compressed = len(data) - len(decompressor.unused_data)
+
+        decompress_time = read_time
+        if(self.decompressor):
+            # The truncated input makes the decompressor fail at the end,
+            # which does not matter here.
+            start = time.perf_counter()
+            subprocess.run(
+                self.decompress_argv("-"), input=data,
+                stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+            decompress_time = time.perf_counter() - start
+
+        test_path = os.path.join(stage_dir, ".write_test{}".format(
+            os.getpid()))
+        try:
+            start = time.perf_counter()
+            with open(test_path, "wb") as test_fh:
+                test_fh.write(plain)
+                test_fh.flush()
+                os.fsync(test_fh.fileno())
+            write_time = time.perf_counter() - start
+        finally:
+            os.remove(test_path)
+
+        rates = {
+            "read_rate": compressed / max(read_time, 1e-6),
+            "decompress_rate": compressed / max(decompress_time, 1e-6),
+            "write_rate": len(plain) / max(write_time, 1e-6),
+            "ratio": len(plain) / max(compressed, 1)
+        }
+        _rates[key] = rates
+        return rates
+
+    def costs(self, files, consumers, rates):
+        ''' Estimated seconds spent getting the reads to the consumers with
+            each strategy.
+        '''
+        size = sum(os.path.getsize(path) for path in files)
+        passes = sum(CONSUMER_PASSES.get(consumer, 1)
+                     for consumer in consumers)
+        costs = {"none": passes * size / rates["read_rate"]}
+        # Without pigz or gzip the input cannot be staged.
+        if(self.decompressor):
+            costs["stage"] = (size / rates["decompress_rate"]
+                              + size * rates["ratio"] / rates["write_rate"])
+        return costs
+
+    def stage(self, files, consumers, workspace):
+        ''' Stages the input files for the consumers.
+            consumers: Names of the consumers, see CONSUMER_PASSES.
+            workspace: Workspace of the sample.
+            RETURN: StagedInput. Raises ToolError if the decompressor
+                    fails.
+        '''
+        files = tuple(files)
+        if(self.strategy == "none"
+           or not any(is_gzipped(path) for path in files)):
+            return StagedInput("none", files)
+        if(not self.decompressor):
+            if(self.strategy == "stage"):
+                eprint("! WARNING: pigz or gzip not found, the input is not"
+                       " staged.")
+            return StagedInput("none", files)
+
+        stage_dir = workspace.stage_dir("input")
+        costs = None
+        strategy = self.strategy
+        if(strategy == "auto"):
+            rates = self.calibrate(files[0], stage_dir)
+            costs = self.costs(files, consumers, rates)
+            strategy = min(costs, key=costs.get)
+            size = sum(os.path.getsize(path) for path in files)
+            if(shutil.disk_usage(stage_dir).free < 1.1 * size
+               * rates["ratio"]):
+                strategy = "none"
+        if(strategy == "none"):
+            return StagedInput("none", files, costs=costs)
+
+        start = time.perf_counter()
+        staged_files = []
+        procs = []
+        try:
+            for file_no, path in enumerate(files, start=1):
+                if(not is_gzipped(path)):
+                    staged_files.append(path)
+                    continue
+                staged_path = os.path.join(stage_dir,
+                                           staged_name(path, file_no))
+                staged_files.append(staged_path)
+                with open(staged_path, "wb") as staged_fh:
+                    procs.append((subprocess.Popen(
+                        self.decompress_argv(path), stdout=staged_fh,
+                        stderr=subprocess.PIPE), path))
+            for proc, path in procs:
+                stderr = proc.communicate()[1]
+                if(proc.returncode):
+                    raise ToolError(
+                        "Unable to decompress {}".format(path),
+                        cmd=cmd2string(self.decompress_argv(path)),
+                        returncode=proc.returncode,
+                        stderr=stderr.decode("utf-8", "replace").strip())
+        finally:
+            for proc, path in procs:
+                if(proc.poll() is None):
+                    proc.kill()
+                    proc.wait()
+
+        return StagedInput("stage", tuple(staged_files), costs=costs,
+                           seconds=time.perf_counter() - start)
+
+
+class StagedInput():
+    ''' Result of InputStager.stage.
+        files: The files the consumers read.
+        costs: Estimated seconds of each strategy, if measured.
+        seconds: Time spent staging.
+    '''
+
+    def __init__(self, strategy, files, costs=None, seconds=0):
+        self.strategy = strategy
+        self.files = files
+        self.costs = costs
+        self.seconds = seconds
+
+    def to_dict(self):
+        return {
+            "strategy": self.strategy,
+            "costs": self.costs,
+            "seconds": self.seconds
+        }
+
+
+if __name__ == '__main__':
+
+    import argparse
+
+    #
+    # Handling arguments
+    #
+    parser = argparse.ArgumentParser(description="Measure the cost of reading\
+        gzipped input directly vs. decompressing it once to a staged copy.")
+    # Posotional arguments
+    parser.add_argument("input_files",
+                        help="Gzipped FASTQ file(s).",
+                        nargs='+',
+                        metavar='FASTQ')
+    parser.add_argument("-d", "--stage_dir",
+                        help="Dir the input would be staged in.",
+                        default=".")
+    parser.add_argument("-c", "--consumers",
+                        help="Comma separated consumers of the input.\
+                              Default: cgemlst,seqsero",
+                        default="cgemlst,seqsero")
+    parser.add_argument("--threads",
+                        help="Threads used by pigz. Default: 2",
+                        type=int,
+                        default=2)
+    parser.add_argument("--stage",
+                        help="Also stage the input with the cheaper\
+                              strategy.",
+                        action="store_true",
+                        default=False)
+
+    args = parser.parse_args()
+
+    stager = InputStager(threads=args.threads)
+    consumers = args.consumers.split(",")
+    os.makedirs(args.stage_dir, exist_ok=True)
+    rates = stager.calibrate(args.input_files[0], args.stage_dir)
+    print("decompressor\t{}".format(stager.decompressor))
+    for name, value in sorted(rates.items()):
+        print("{}\t{:.3f}".format(name, value))
+    for name, value in sorted(stager.costs(args.input_files, consumers,
+                                           rates).items()):
+        print("cost_{}\t{:.3f}".format(name, value))
+    if(args.stage):
+        try:
+            staged = stager.stage(args.input_files, consumers,
+                                  Workspace(args.stage_dir))
+        except ToolError as e:
+            sys.exit(e.details())
+        print("staged\t{}\t{}".format(staged.strategy,
+                                      " ".join(staged.files)))
+
+    quit(0)
@@ -0,0 +1,157 @@
+#!/usr/bin/env python3
+
+import fcntl
+import json
+import os
+import sys
+import time
+
+from .outputparser import Parser
+
+
+def eprint(*args, **kwargs):
+    print(*args, file=sys.stderr, **kwargs)
+
+
+JOURNAL_VERSION = 1
+
+
+def sample_key(sample):
+    ''' Identity of a sample's input: the files with their size and
+        modification time, the seq type and the known ST. A sample whose
+        input has changed is typed again.
+    '''
+    files = []
+    for filepath in sample.files:
+        stat = os.stat(filepath)
+        files.append([os.path.abspath(filepath), stat.st_size,
+                      stat.st_mtime_ns])
+    return [files, sample.seqtype, sample.mlst]
+
+
+class BatchJournal():
+    ''' Journal of a batch run, one JSON line per finished sample. Each
+        line is written with a single write and synced to disk before the
+        next sample is recorded, so a run that dies loses at most the
+        samples that were running. A line cut off by the crash is ignored.
+
+        The first line records the options of the run (signature). Running
+        the same batch again skips the samples recorded as done with the
+        same input, and types the failed and missing samples.
+        Used as a context manager.
+    '''
+
+    def __init__(self, path, signature, restart=False):
+        ''' Constructor.
+            path: Journal file, ex. <output>.journal.
+            signature: JSON serializable description of the options that
+                       change the results. A journal written with other
+                       options is not resumed.
+            restart: Discard an existing journal and start over.
+        '''
+        self.path = path
+        self.signature = signature
+        # Sample name --> last record of the sample.
+        self.records = {}
+
+        if(restart and os.path.exists(path)):
+            os.remove(path)
+        self.fd = os.open(path, os.O_WRONLY | os.O_APPEND | os.O_CREAT,
+                          0o644)
+        try:
+            fcntl.flock(self.fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except BlockingIOError:
+            os.close(self.fd)
+            sys.exit("! ERROR: The journal is used by another run: {}"
+                     .format(path))
+
+        if(os.fstat(self.fd).st_size == 0):
+            self.append({"journal": JOURNAL_VERSION,
+                         "signature": signature,
+                         "created": time.time()})
+        else:
+            self.load()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def load(self):
+        with open(self.path, "r", encoding="utf-8") as journal_fh:
+            data = journal_fh.read()
+        lines = data.split("\n")
+        try:
+            header = json.loads(lines[0])
+        except ValueError:
+            header = {}
+        if(header.get("journal") != JOURNAL_VERSION
+           or header.get("signature") != self.signature):
+            os.close(self.fd)
+            sys.exit("! ERROR: The journal {} was written by a run with other"
+                     " options. Run with the same options to resume, or with"
+                     " --restart to start over.".format(self.path))
+
+        for line in lines[1:]:
+            try:
+                record = json.loads(line)
+            except ValueError:
+                continue
+            self.records[record["sample"]] = record
+
+        # Ends a line cut off by a crash, so the next record starts on a
+        # line of its own.
+        if(not data.endswith("\n")):
+            os.write(self.fd, b"\n")
+
+    def append(self, record):
+        os.write(self.fd, (json.dumps(record, separators=(",", ":"))
+                           + "\n").encode("utf-8"))
+        os.fsync(self.fd)
+
+    def is_done(self, sample):
+        record = self.records.get(sample.name)
+        return (record is not None and record["status"] == "done"
+                and record["key"] == sample_key(sample))
+
+    def result(self, sample):
+        ''' RETURN: (output line, result dict) recorded for the sample, or
+                    None if it is not done.
+        '''
+        if(not self.is_done(sample)):
+            return None
+        record = self.records[sample.name]
+        return (record["txt"], record["result"])
+
+    def add(self, sample, profile):
+        ''' Records a sample as done.
+        '''
+        record = {
+            "sample": sample.name,
+            "key": sample_key(sample),
+            "status": "done",
+            "finished": time.time(),
+            "txt": Parser.profile2txt(profile),
+            "result": Parser.profile2dict(profile)
+        }
+        self.append(record)
+        self.records[sample.name] = record
+
+    def add_failed(self, sample):
+        ''' Records a sample as failed, so it is typed again on resume.
+        '''
+        record = {
+            "sample": sample.name,
+            "key": sample_key(sample),
+            "status": "failed",
+            "finished": time.time()
+        }
+        self.append(record)
+        self.records[sample.name] = record
+
+    def close(self):
+        if(self.fd is None):
+            return
+        os.close(self.fd)
+        self.fd = None
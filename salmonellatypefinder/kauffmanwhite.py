@@ -1,13 +1,13 @@
 #!/usr/bin/env python3
 
-import subprocess
 import re
-import argparse
 import os.path
-import json
 import sys
 import tempfile
 
+from .toolrunner import run_tool_async, cmd2string, ToolError
+from .tracing import span
+
 
 def eprint(*args, **kwargs):
     print(*args, file=sys.stderr, **kwargs)
@@ -21,14 +21,34 @@ class KauffmanWhite():
                  tmp_dir="tmp_dir", python2_env=None, seqsero="SeqSero.py",
                  blastn="blastn", makeblastdb="makeblastdb",
                  samtools="samtools", bwa="bwa", python2="python2.7",
-                 seqsero2="SeqSero2_package.py", python3="python3"):
+                 seqsero2="SeqSero2_package.py", python3="python3",
+                 cache=None, timeout=None, tracer=None, threads=1,
+                 cache_args=None, run=True):
         ''' Constructor.
             method: specifies what software to use in order to find the
                     Kauffman-White serotype profile. Only seqsero is currently
                     implemented.
             seqtype: of data can be either: paired, single, or assembled.
             files: Path to file(s) are given as a list.
+            cache: ResultCache object. If given, the SeqSero results found by
+                   an earlier identical call are reused. The key is built
+                   from the files given here, even if they are replaced by
+                   staged copies before SeqSero is run.
+            timeout: Max. seconds SeqSero may run.
+            tracer: Tracer object. If given, the time spent in each step is
+                    recorded.
+            threads: Number of threads used by SeqSero2. SeqSero does not
+                     take a thread count.
+            cache_args: Options of the steps that changed the files given
+                        to SeqSero, ex. subsampling. Part of the cache key.
+            run: If False, SeqSero is not run until run() or run_async() is
+                 called.
         '''
+        self.cache = cache
+        self.threads = threads
+        self.tracer = tracer
+        self.timeout = timeout
+
         # SeqSero dependencies
         self.seqsero_path = seqsero
         self.blastn = blastn
@@ -48,8 +68,15 @@ class KauffmanWhite():
         self.profile = ""
         self.serotypes = {}
         self.files = files
+        self.cache_files = files
+        self.cache_args = list(cache_args or [])
+        # True or False once looked up in the cache, see lookup_cache.
+        self.cached = None
         self.method = None
         self.cmd = None  # The exact cmd executed to run external software.
+        self.seqsero_done = False  # True when the serotype line is parsed.
+        self.seqtype = seqtype
+        self.tmp_dir = tmp_dir
 
         os.makedirs(tmp_dir, exist_ok=True)
 
@@ -66,12 +93,29 @@ class KauffmanWhite():
                         continue
                     self.pre_cmd += line + "\n"
 
-        if(method == "seqsero"):
-            self.method = "seqsero"
-            self.seqsero(tmp_dir, seqtype)
-        elif(method == "seqsero2"):
-            self.method = "seqsero2"
-            self.seqsero(tmp_dir, seqtype)
+        if(method in ("seqsero", "seqsero2")):
+            self.method = method
+
+        if(run):
+            self.run()
+
+    def run(self):
+        ''' Runs SeqSero in an event loop of its own.
+        '''
+        if(self.method is None):
+            return
+        import asyncio
+        asyncio.run(self.run_async())
+
+    async def run_async(self):
+        ''' Runs the SeqSero version chosen in the constructor, if any.
+        '''
+        if(self.cached):
+            return
+        if(self.method == "seqsero"):
+            await self.seqsero(self.tmp_dir, self.seqtype)
+        elif(self.method == "seqsero2"):
+            await self.seqsero2(self.tmp_dir, self.seqtype)
 
     def serotype2string(self):
         ''' returns a string with the serotype result.
@@ -99,127 +143,230 @@ class KauffmanWhite():
         else:
             return env_path
 
-    def seqsero2(self, working_dir, seqtype):
+    def seqsero_cache_key(self, seqtype):
         """
+        Returns the key used to store the results of the SeqSero method in
+        the cache.
         """
-        # A temp directory is created, in which SeqSero will run.
-        tmp_dir = tempfile.mkdtemp(prefix='seqsero2_tmp', dir=working_dir)
+        if(self.method == "seqsero2"):
+            tool_paths = [self.seqsero2_path, self.python3]
+        else:
+            tool_paths = [self.seqsero_path, self.python2, self.blastn,
+                          self.makeblastdb, self.samtools, self.bwa]
+        return self.cache.key(tool=self.method, tool_paths=tool_paths,
+                              db_path=None, files=self.cache_files,
+                              args=[seqtype, self.pre_cmd] + self.cache_args)
 
-        if(os.path.dirname(self.seqsero2_path)):
-            seqsero2_pre_cmd = ("{python3} {seqsero2}"
-                                .format(python3=self.python3,
-                                        seqsero2=self.seqsero2_path))
+    def lookup_cache(self):
+        """
+        Sets the SeqSero results from the cache, if found, so SeqSero is not
+        run. Returns True if SeqSero does not need to run.
+        """
+        if(self.method is None):
+            return True
+        if(not self.cache):
+            return False
+        self.cached = self.load_cached_result(
+            self.seqsero_cache_key(self.seqtype))
+        if(self.cached):
+            self.cmd = self.seqsero_cmd(self.seqsero_argv(self.seqtype))
+        return self.cached
+
+    def seqsero_argv(self, seqtype):
+        """
+        Returns the command line of the SeqSero version in use.
+        """
+        if(self.method == "seqsero2"):
+            if(os.path.dirname(self.seqsero2_path)):
+                argv = [self.python3, self.seqsero2_path]
+            else:
+                argv = [self.seqsero2_path]
+            mode_option = "-t"
         else:
-            seqsero2_pre_cmd = ("{seqsero2}"
-                                .format(python3=self.python3,
-                                        seqsero2=self.seqsero2_path))
+            if(os.path.dirname(self.seqsero_path)):
+                argv = [self.python2, self.seqsero_path, "-b", "sam"]
+            else:
+                argv = [self.seqsero_path, "-b", "sam"]
+            mode_option = "-m"
 
-        # Adding the paired-end specific options for SeqSero2
+        # Adding the seqtype specific options
         if(seqtype == "paired"):
-            seqsero2_post_cmd = ("-t 2 -i {} {}"
-                                 .format(self.files[0], self.files[1]))
-        # Adding the single-end specific options for SeqSero2
+            argv += [mode_option, "2", "-i", self.files[0], self.files[1]]
         elif(seqtype == "single"):
-            seqsero2_post_cmd = ("-t 3 -i {}".format(self.files[0]))
-        # Adding the assembled specific options for SeqSero2
+            argv += [mode_option, "3", "-i", self.files[0]]
         elif(seqtype == "assembled"):
-            seqsero2_post_cmd = ("-t 4 -i {}".format(self.files[0]))
+            argv += [mode_option, "4", "-i", self.files[0]]
+        if(self.method == "seqsero2" and self.threads > 1):
+            argv += ["-p", str(self.threads)]
+        return argv
 
-        seqsero2_cmd = ("{pre} {post}"
-                        .format(pre=seqsero2_pre_cmd,
-                                post=seqsero2_post_cmd))
+    def seqsero_cmd(self, argv):
+        """
+        Returns the SeqSero command line as a string, with the pre-SeqSero
+        commands of the python 2.7 environment file.
+        """
+        cmd = cmd2string(argv)
+        if(self.method == "seqsero" and self.pre_cmd):
+            cmd = self.pre_cmd + cmd
+        return cmd
 
-        self.cmd = seqsero2_cmd
+    def load_cached_result(self, cache_key):
+        """
+        Sets the SeqSero results from the cache. Returns False if the results
+        are not found.
+        """
+        with span(self.tracer, self.method + ".cache_lookup"):
+            cached_result = self.cache.get(cache_key)
+        if(cached_result is None):
+            return False
+        self.o_type = cached_result["o_type"]
+        self.h1_type = cached_result["h1_type"]
+        self.h2_type = cached_result["h2_type"]
+        self.sdf = cached_result["sdf"]
+        self.profile = cached_result["profile"]
+        self.serotypes = cached_result["serotypes"]
+        return True
+
+    def store_cached_result(self, cache_key):
+        """
+        Stores the parsed SeqSero results in the cache.
+        """
+        self.cache.put(cache_key, {
+            "o_type": self.o_type,
+            "h1_type": self.h1_type,
+            "h2_type": self.h2_type,
+            "sdf": self.sdf,
+            "profile": self.profile,
+            "serotypes": self.serotypes
+        })
+
+    async def seqsero2(self, working_dir, seqtype):
+        """
+        """
+        seqsero2_argv = self.seqsero_argv(seqtype)
+        self.cmd = self.seqsero_cmd(seqsero2_argv)
+
+        cache_key = None
+        if(self.cache):
+            cache_key = self.seqsero_cache_key(seqtype)
+            if(self.cached is None
+               and self.load_cached_result(cache_key)):
+                return
 
-        eprint(seqsero2_cmd)
+        eprint(self.cmd)
 
-        # SeqSero creates files in the current working directory, with no
-        # option to change output dir it is necessary to change the cwd.
-        working_dir = os.getcwd()
-        os.chdir(tmp_dir)
-        try:
-            result_raw = subprocess.run(seqsero2_cmd, capture_output=True,
-                                        text=True, check=True, shell=True)
-        except subprocess.CalledProcessError as e:
-            eprint("ERROR: SeqSero2 call failed")
-            eprint("CMD that failed: " + seqsero2_cmd)
-            eprint("ERROR MSG: " + str(e))
-            quit(1)
-        # Change working dir back
-        os.chdir(working_dir)
+        # A temp directory is created, in which SeqSero will run.
+        tmp_dir = tempfile.mkdtemp(prefix='seqsero2_tmp', dir=working_dir)
 
-        print("ERROR: " + result_raw.stderr)
-        print("OUT: " + result_raw.stdout)
+        await self.run_seqsero(seqsero2_argv, tmp_dir, env=None,
+                               name="SeqSero2")
 
-        self.load_seqsero_result(result_raw)
+        if(cache_key):
+            self.store_cached_result(cache_key)
+
+    async def run_seqsero(self, argv, tmp_dir, env, name):
+        """
+        Runs SeqSero or SeqSero2 and parses the screen output while it is
+        written. SeqSero creates files in the current working directory, with
+        no option to change output dir, so it is run with tmp_dir as its cwd.
+        If a python 2.7 environment file is given, its commands and SeqSero
+        are run in a shell.
+        """
+        if(self.pre_cmd):
+            argv = ["/bin/sh", "-c", self.pre_cmd + cmd2string(argv)]
+
+        try:
+            # The output is parsed while SeqSero runs, so the span includes
+            # the parsing.
+            with span(self.tracer, self.method + ".run"):
+                await run_tool_async(argv, cwd=tmp_dir, env=env,
+                                     timeout=self.timeout,
+                                     line_callback=self.parse_seqsero_line)
+        except ToolError as e:
+            raise ToolError("{} call failed. {}".format(name, e),
+                            cmd=self.cmd, returncode=e.returncode,
+                            stdout=e.stdout, stderr=e.stderr)
 
     def load_seqsero_result(self, result_raw):
         """
+        Parses the complete screen output of SeqSero.
         """
-        # Parse SeqSero results
-        re_o_type = re.compile(r"^O antigen prediction:	(.+)")
-        re_h1_type = re.compile(r"^H1 antigen prediction\(fliC\):\s+(.+)")
-        re_h2_type = re.compile(r"^H2 antigen prediction\(fljB\):\s+(.+)")
-        re_sdf_type = re.compile(r"^Sdf prediction:(.+)")
-        re_profile = re.compile(r"^Predicted antigenic profile:\s+(.+)")
-        re_serotype = re.compile(r"^Predicted serotype\(s\):\s+([^*]+)")
-        re_serotype_NA = re.compile(r"See comments below")
-        re_serotype_NA2 = re.compile(r"N\/A")
-        # It seems easiest to parse the screen output
         for line in result_raw.stdout.splitlines():
-            match_o = re_o_type.search(line)
-            if(match_o):
-                self.o_type = match_o.group(1)
-                continue
-            match_h1 = re_h1_type.search(line)
-            if(match_h1):
-                self.h1_type = match_h1.group(1)
-                continue
-            match_h2 = re_h2_type.search(line)
-            if(match_h2):
-                self.h2_type = match_h2.group(1)
-                continue
-            match_profile = re_profile.search(line)
-            if(match_profile):
-                self.profile = match_profile.group(1)
-                continue
-            match_sdf = re_sdf_type.search(line)
-            if(match_sdf):
-                self.sdf = match_sdf.group(1)
-                continue
-            match_serotype = re_serotype.search(line)
-            if(match_serotype):
-                match_serotype_NA = re_serotype_NA.search(line,
-                                                          re.IGNORECASE)
-                # No serotype found
-                if(match_serotype_NA):
-                    serotype = "NF*"
-                    self.serotypes[serotype] = 1
-                    return
-                match_serotype_NA2 = re_serotype_NA2.search(line,
-                                                            re.IGNORECASE)
-                # No serotype found
-                if(match_serotype_NA):
-                    serotype = self.profile
-                    self.serotypes[serotype] = 1
-                    return
-                # Serotype(s) found
-                serotypes = match_serotype.group(1).split(" ")
-                for serotype in serotypes:
-                    serotype = serotype.lower()
-                    serotype = serotype.strip()
-                    # serotype = serotype.casefold()
-                    if(serotype != "or"):
-                        self.serotypes[serotype] = 1
+            if(self.parse_seqsero_line(line)):
                 return
 
-    def seqsero(self, working_dir, seqtype):
+    # Parse SeqSero results
+    re_o_type = re.compile(r"^O antigen prediction:	(.+)")
+    re_h1_type = re.compile(r"^H1 antigen prediction\(fliC\):\s+(.+)")
+    re_h2_type = re.compile(r"^H2 antigen prediction\(fljB\):\s+(.+)")
+    re_sdf_type = re.compile(r"^Sdf prediction:(.+)")
+    re_profile = re.compile(r"^Predicted antigenic profile:\s+(.+)")
+    re_serotype = re.compile(r"^Predicted serotype\(s\):\s+([^*]+)")
+    re_serotype_NA = re.compile(r"See comments below")
+    re_serotype_NA2 = re.compile(r"N\/A")
+
+    def parse_seqsero_line(self, line):
         """
+        Parses a single line of the SeqSero screen output. Lines after the
+        predicted serotype line are ignored.
+        RETURN: True when the predicted serotype line has been parsed.
         """
-        # A temp directory is created, in which SeqSero will run.
-        tmp_dir = tempfile.mkdtemp(prefix='seqsero_tmp', dir=working_dir)
+        # It seems easiest to parse the screen output
+        if(self.seqsero_done):
+            return True
+        match_o = self.re_o_type.search(line)
+        if(match_o):
+            self.o_type = match_o.group(1)
+            return False
+        match_h1 = self.re_h1_type.search(line)
+        if(match_h1):
+            self.h1_type = match_h1.group(1)
+            return False
+        match_h2 = self.re_h2_type.search(line)
+        if(match_h2):
+            self.h2_type = match_h2.group(1)
+            return False
+        match_profile = self.re_profile.search(line)
+        if(match_profile):
+            self.profile = match_profile.group(1)
+            return False
+        match_sdf = self.re_sdf_type.search(line)
+        if(match_sdf):
+            self.sdf = match_sdf.group(1)
+            return False
+        match_serotype = self.re_serotype.search(line)
+        if(match_serotype):
+            self.seqsero_done = True
+            match_serotype_NA = self.re_serotype_NA.search(line,
+                                                           re.IGNORECASE)
+            # No serotype found
+            if(match_serotype_NA):
+                serotype = "NF*"
+                self.serotypes[serotype] = 1
+                return True
+            match_serotype_NA2 = self.re_serotype_NA2.search(line,
+                                                             re.IGNORECASE)
+            # No serotype found
+            if(match_serotype_NA):
+                serotype = self.profile
+                self.serotypes[serotype] = 1
+                return True
+            # Serotype(s) found
+            serotypes = match_serotype.group(1).split(" ")
+            for serotype in serotypes:
+                serotype = serotype.lower()
+                serotype = serotype.strip()
+                # serotype = serotype.casefold()
+                if(serotype != "or"):
+                    self.serotypes[serotype] = 1
+            return True
+        return False
 
-        # Create environment for SeqSero
+    async def seqsero(self, working_dir, seqtype):
+        """
+        """
+        # Create environment for SeqSero. Only the environment of the SeqSero
+        # process is altered, not the environment of this process.
         new_path_env = os.environ["PATH"]
         new_path_env = self.add_prgdir_to_envpath(new_path_env,
                                                   self.blastn)
@@ -231,64 +378,36 @@ class KauffmanWhite():
                                                   self.bwa)
         new_path_env = self.add_prgdir_to_envpath(new_path_env,
                                                   self.python2)
-        os.environ["PATH"] = new_path_env
+        seqsero_env = dict(os.environ)
+        seqsero_env["PATH"] = new_path_env
 
         # Create SeqSero command.
-        if(os.path.dirname(self.seqsero_path)):
-            seqsero_pre_cmd = ("{python2} {seqsero} -b sam"
-                               .format(python2=self.python2,
-                                       seqsero=self.seqsero_path))
-        else:
-            seqsero_pre_cmd = ("{seqsero} -b sam"
-                               .format(python2=self.python2,
-                                       seqsero=self.seqsero_path))
-
-        # Adding the paired-end specific options for SeqSero
-        if(seqtype == "paired"):
-            seqsero_post_cmd = ("-m 2 -i {} {}"
-                                .format(self.files[0], self.files[1]))
-        # Adding the single-end specific options for SeqSero
-        elif(seqtype == "single"):
-            seqsero_post_cmd = ("-m 3 -i {}".format(self.files[0]))
-        # Adding the assembled specific options for SeqSero
-        elif(seqtype == "assembled"):
-            seqsero_post_cmd = ("-m 4 -i {}".format(self.files[0]))
-
-        seqsero_cmd = ("{pre} {post}"
-                       .format(pre=seqsero_pre_cmd,
-                               post=seqsero_post_cmd))
-
-        # Add pre-SeqSero command if necessary
-        if(self.pre_cmd):
-            seqsero_cmd = self.pre_cmd + seqsero_cmd
-
-        self.cmd = seqsero_cmd
+        seqsero_argv = self.seqsero_argv(seqtype)
+        self.cmd = self.seqsero_cmd(seqsero_argv)
+
+        cache_key = None
+        if(self.cache):
+            cache_key = self.seqsero_cache_key(seqtype)
+            if(self.cached is None
+               and self.load_cached_result(cache_key)):
+                return
 
-        eprint(seqsero_cmd)
+        eprint(self.cmd)
 
-        # SeqSero creates files in the current working directory, with no
-        # option to change output dir it is necessary to change the cwd.
-        working_dir = os.getcwd()
-        os.chdir(tmp_dir)
+        # A temp directory is created, in which SeqSero will run.
+        tmp_dir = tempfile.mkdtemp(prefix='seqsero_tmp', dir=working_dir)
 
-        try:
-            result_raw = subprocess.run(seqsero_cmd, capture_output=True,
-                                        text=True, check=True, shell=True)
-        except subprocess.CalledProcessError as e:
-            eprint("ERROR: SeqSero call failed")
-            eprint("CMD that failed: " + seqsero_cmd)
-            eprint("ERROR MSG: " + str(e))
-            eprint("ERROR STDOUT: " + e.stdout)
-            eprint("ERROR STDERR: " + e.stderr)
-            quit(1)
-        # Change working dir back
-        os.chdir(working_dir)
+        await self.run_seqsero(seqsero_argv, tmp_dir, env=seqsero_env,
+                               name="SeqSero")
 
-        self.load_seqsero_result(result_raw)
+        if(cache_key):
+            self.store_cached_result(cache_key)
 
 
 if __name__ == '__main__':
 
+    import argparse
+
     #
     # Handling arguments
     #
@@ -0,0 +1,222 @@
+#!/usr/bin/env python3
+
+import os
+import re
+import sys
+
+from .toolrunner import run_tool_async, cmd2string, ToolError
+
+
+def eprint(*args, **kwargs):
+    print(*args, file=sys.stderr, **kwargs)
+
+
+# Profile tables loaded in this process, see load_scheme.
+_schemes = {}
+
+# Template names in the allele database: <locus>_<allele no.>
+re_template = re.compile(r"^(.+)[_-](\d+)$")
+
+
+def find_scheme_files(cgemlstdb_path, scheme="senterica"):
+    ''' Finds the KMA index and the ST profile table of a scheme in a CGE
+        MLST database (mlst_db) installed with kma_index.
+        RETURN: (KMA index prefix, profile table path). Raises ToolError if
+                either is missing.
+    '''
+    scheme_dir = os.path.join(cgemlstdb_path, scheme)
+    index = os.path.join(scheme_dir, scheme)
+    if(not any(os.path.isfile(index + ext) for ext in (".name", ".comp.b"))):
+        raise ToolError("No KMA index of the {} scheme found in: {}. "
+                        "Install the MLST database with kma_index."
+                        .format(scheme, scheme_dir))
+    for name in (scheme + ".tsv", "profiles.tsv", "profiles_csv"):
+        profile_path = os.path.join(scheme_dir, name)
+        if(os.path.isfile(profile_path)):
+            return (index, profile_path)
+    raise ToolError("No ST profile table of the {} scheme found in: {}"
+                    .format(scheme, scheme_dir))
+
+
+def load_scheme(profile_path):
+    ''' Loads an ST profile table, kept per process. The loci are the
+        columns after ST that hold allele numbers in every row.
+        RETURN: MLSTScheme
+    '''
+    stat = os.stat(profile_path)
+    key = (profile_path, stat.st_size, stat.st_mtime_ns)
+    if(key not in _schemes):
+        _schemes.clear()
+        _schemes[key] = MLSTScheme(profile_path)
+    return _schemes[key]
+
+
+def parse_kma_res(res_path):
+    ''' Parses the .res file written by KMA.
+        RETURN: dict locus --> (allele, exact) of the best scoring allele of
+                each locus. exact is True if the allele is covered fully and
+                with 100% identity.
+    '''
+    best = {}
+    with open(res_path, "r", encoding="utf-8") as res_fh:
+        for line in res_fh:
+            if(line.startswith("#") or not line.strip()):
+                continue
+            entries = line.rstrip("\n").split("\t")
+            match = re_template.match(entries[0].strip())
+            if(not match):
+                continue
+            locus, allele = match.groups()
+            score = float(entries[1])
+            exact = (float(entries[4]) >= 100 and float(entries[5]) >= 100)
+            if(locus not in best or score > best[locus][0]):
+                best[locus] = (score, allele, exact)
+    return {locus: (allele, exact)
+            for locus, (score, allele, exact) in best.items()}
+
+
+class MLSTScheme():
+    ''' ST profile table hashed on the allele numbers of the loci.
+    '''
+
+    def __init__(self, profile_path):
+        self.path = profile_path
+        with open(profile_path, "r", encoding="utf-8") as profile_fh:
+            header = profile_fh.readline().rstrip("\r\n")
+            sep = "\t" if("\t" in header) else ","
+            header = header.split(sep)
+            rows = [line.rstrip("\r\n").split(sep) for line in profile_fh
+                    if(line.strip())]
+
+        locus_cols = []
+        for col in range(1, len(header)):
+            if(all(len(row) > col and row[col].strip().isdigit()
+                   for row in rows)):
+                locus_cols.append(col)
+            else:
+                break
+        if(not rows or not locus_cols):
+            raise ToolError("No ST profiles found in: {}"
+                            .format(profile_path))
+        self.loci = tuple(header[col].strip() for col in locus_cols)
+
+        self.profiles = {}
+        for row in rows:
+            alleles = tuple(row[col].strip() for col in locus_cols)
+            self.profiles[alleles] = row[0].strip()
+
+    def st(self, alleles):
+        ''' RETURN: ST of the allele numbers (dict locus --> allele), or None
+                    if the profile is not in the table.
+        '''
+        try:
+            key = tuple(alleles[locus] for locus in self.loci)
+        except KeyError:
+            return None
+        return self.profiles.get(key)
+
+
+async def kma_mlst(files, seqtype, out_dir, kma_path="kma",
+                   cgemlstdb_path=None, scheme="senterica", timeout=None,
+                   shm_level=None, threads=1):
+    ''' Maps the reads (or assembly) to the alleles of the scheme with KMA
+        and looks up the ST of the best alleles.
+        shm_level: If given, KMA attaches to the index loaded into shared
+                   memory by KMASharedIndex instead of loading it.
+        threads: Number of threads KMA uses.
+        RETURN: (ST or "unknown", dict locus --> allele, cmd). Alleles that
+                are not exact matches are marked with "*", as CGE MLST does.
+    '''
+    index, profile_path = find_scheme_files(cgemlstdb_path, scheme)
+    scheme_table = load_scheme(profile_path)
+
+    out_prefix = os.path.join(out_dir, "kma_" + scheme)
+    argv = [kma_path]
+    if(seqtype == "paired"):
+        argv += ["-ipe"] + list(files[:2])
+    else:
+        argv += ["-i", files[0]]
+    argv += ["-o", out_prefix, "-t_db", index, "-1t1", "-nf", "-na", "-nc"]
+    if(shm_level):
+        argv += ["-shm", str(shm_level)]
+    if(threads > 1):
+        argv += ["-t", str(threads)]
+    cmd = cmd2string(argv)
+
+    try:
+        await run_tool_async(argv, timeout=timeout)
+    except ToolError as e:
+        raise ToolError("KMA call failed. " + str(e), cmd=e.cmd,
+                        returncode=e.returncode, stdout=e.stdout,
+                        stderr=e.stderr)
+
+    try:
+        hits = parse_kma_res(out_prefix + ".res")
+    except (OSError, ValueError, IndexError):
+        raise ToolError("Unable to parse KMA output", cmd=cmd)
+
+    alleles = {}
+    exact = {}
+    for locus in scheme_table.loci:
+        if(locus in hits):
+            alleles[locus], exact[locus] = hits[locus]
+    st = None
+    if(len(exact) == len(scheme_table.loci) and all(exact.values())):
+        st = scheme_table.st(alleles)
+    for locus in alleles:
+        if(not exact[locus]):
+            alleles[locus] += "*"
+
+    if(st is None):
+        return ("unknown", alleles, cmd)
+    try:
+        return (int(st), alleles, cmd)
+    except ValueError:
+        return ("unknown", alleles, cmd)
+
+
+if __name__ == '__main__':
+
+    import argparse
+    import asyncio
+
+    #
+    # Handling arguments
+    #
+    parser = argparse.ArgumentParser(description="Find the MLST type with\
+        KMA and the ST profiles of a CGE MLST database.")
+    # Posotional arguments
+    parser.add_argument("input_files",
+                        help="Raw data in FASTQ format or an assembly in FASTA\
+                              format.",
+                        nargs='+',
+                        metavar='FAST(Q|A)')
+    parser.add_argument("-s", "--seq_type",
+                        help="Type of sequence: paired, single or assembled",
+                        choices=["paired", "single", "assembled"],
+                        default="paired")
+    parser.add_argument("-d1", "--cgemlstdb_path",
+                        help="CGE MLST database dir.",
+                        required=True)
+    parser.add_argument("--kma",
+                        help="Path to kma. Default: kma",
+                        default="kma")
+    parser.add_argument("-t", "--tmp_dir",
+                        help="Dir of the KMA output.",
+                        default="KMA_tmp_dir")
+
+    args = parser.parse_args()
+
+    os.makedirs(args.tmp_dir, exist_ok=True)
+    try:
+        st, alleles, cmd = asyncio.run(kma_mlst(
+            args.input_files, args.seq_type, args.tmp_dir, kma_path=args.kma,
+            cgemlstdb_path=args.cgemlstdb_path))
+    except ToolError as e:
+        sys.exit(e.details())
+    eprint(cmd)
+    print("ST " + str(st))
+    print(" ".join("{}_{}".format(locus, allele)
+                   for locus, allele in alleles.items()))
+
+    quit(0)
@@ -0,0 +1,213 @@
+#!/usr/bin/env python3
+
+import fcntl
+import hashlib
+import os
+import select
+import signal
+import subprocess
+import sys
+import tempfile
+
+# This module is also run as a script, as the guardian process, so it only
+# imports from the package in code the guardian does not run.
+
+
+def eprint(*args, **kwargs):
+    print(*args, file=sys.stderr, **kwargs)
+
+
+def lock_paths(index):
+    ''' Lock files of an index, on the local host. The mutex serializes
+        loading and destroying the segment. Every process using the segment
+        holds a shared lock on the users file.
+        RETURN: (mutex path, users path)
+    '''
+    name = hashlib.sha256(os.path.realpath(index).encode("utf-8")).hexdigest()
+    base = os.path.join(tempfile.gettempdir(),
+                        "stf_kma_shm_{}".format(name[:16]))
+    return (base + ".mutex", base + ".users")
+
+
+def run_kma_shm(kma_shm, index, level, destroy=False):
+    argv = [kma_shm, "-t_db", index, "-shmLvl", str(level)]
+    if(destroy):
+        argv.append("-destroy")
+    return subprocess.run(argv, stdout=subprocess.PIPE,
+                          stderr=subprocess.PIPE)
+
+
+def attach(index, kma_shm, level, mutex_fh, users_fh):
+    ''' Takes a shared lock on the users file, and loads the index into
+        shared memory if no other process uses it. A segment left by a
+        process that was killed is destroyed and loaded again.
+    '''
+    fcntl.flock(mutex_fh, fcntl.LOCK_EX)
+    try:
+        try:
+            fcntl.flock(users_fh, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            first = True
+        except BlockingIOError:
+            first = False
+        if(first):
+            run_kma_shm(kma_shm, index, level, destroy=True)
+            result = run_kma_shm(kma_shm, index, level)
+            if(result.returncode):
+                fcntl.flock(users_fh, fcntl.LOCK_UN)
+                raise OSError("kma_shm failed with exit code {}: {}".format(
+                    result.returncode,
+                    result.stderr.decode("utf-8", "replace").strip()))
+        fcntl.flock(users_fh, fcntl.LOCK_SH)
+    finally:
+        fcntl.flock(mutex_fh, fcntl.LOCK_UN)
+
+
+def detach(index, kma_shm, level, mutex_fh, users_fh):
+    ''' Releases the shared lock, and destroys the segment if no other
+        process uses it.
+    '''
+    fcntl.flock(mutex_fh, fcntl.LOCK_EX)
+    try:
+        fcntl.flock(users_fh, fcntl.LOCK_UN)
+        try:
+            fcntl.flock(users_fh, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except BlockingIOError:
+            return
+        run_kma_shm(kma_shm, index, level, destroy=True)
+        fcntl.flock(users_fh, fcntl.LOCK_UN)
+    finally:
+        fcntl.flock(mutex_fh, fcntl.LOCK_UN)
+
+
+def wait_for_parent(parent_pid, poll=1):
+    ''' Waits until stdin is closed or the parent has died. Processes forked
+        from the parent inherit the write end of stdin, so the parent's pid
+        is also checked.
+    '''
+    while(os.getppid() == parent_pid):
+        readable, writable, errors = select.select([sys.stdin], [], [], poll)
+        if(readable and not os.read(sys.stdin.fileno(), 4096)):
+            return
+
+
+def guard(index, kma_shm, level):
+    ''' Runs in the guardian process: attaches, reports "ready" on stdout
+        and waits until the parent closes stdin or dies, however it dies, so
+        the segment is always released.
+    '''
+    def stop(signum, frame):
+        raise SystemExit(1)
+
+    signal.signal(signal.SIGTERM, stop)
+    signal.signal(signal.SIGHUP, stop)
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+
+    parent_pid = os.getppid()
+    mutex_path, users_path = lock_paths(index)
+    with open(mutex_path, "a") as mutex_fh, open(users_path, "a") as users_fh:
+        try:
+            attach(index, kma_shm, level, mutex_fh, users_fh)
+        except OSError as e:
+            print("error {}".format(e), flush=True)
+            return 1
+        try:
+            print("ready", flush=True)
+            wait_for_parent(parent_pid)
+        finally:
+            detach(index, kma_shm, level, mutex_fh, users_fh)
+    return 0
+
+
+class KMASharedIndex():
+    ''' Keeps a KMA index in shared memory (kma_shm) while it is open, so
+        the KMA calls of all samples attach to one copy instead of each
+        loading the index. Runs on the local host only.
+        The segment is owned by a guardian process in its own session. The
+        guardian destroys the segment when the index is closed, or when this
+        process exits or is killed, unless other runs on the host still use
+        the same index.
+        Used as a context manager.
+    '''
+
+    def __init__(self, index, kma_shm="kma_shm", level=1):
+        ''' Constructor.
+            index: Prefix of the KMA index, ex. mlst_db/senterica/senterica.
+            kma_shm: Path to kma_shm.
+            level: Shared memory level, -shmLvl of kma_shm and -shm of kma.
+        '''
+        self.index = index
+        self.kma_shm = kma_shm
+        self.level = level
+        self.guardian = None
+
+    def __enter__(self):
+        self.open()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def open(self):
+        self.guardian = subprocess.Popen(
+            [sys.executable, os.path.abspath(__file__), "--guard",
+             "-t_db", self.index, "--kma_shm", self.kma_shm, "--level",
+             str(self.level)],
+            stdin=subprocess.PIPE, stdout=subprocess.PIPE,
+            start_new_session=True)
+        status = self.guardian.stdout.readline().decode("utf-8").strip()
+        if(status != "ready"):
+            from .toolrunner import ToolError
+
+            self.close()
+            raise ToolError("Unable to load the KMA index into shared "
+                            "memory: {}".format(status or "guardian exited"))
+
+    def close(self):
+        if(self.guardian is None):
+            return
+        self.guardian.stdin.close()
+        self.guardian.wait()
+        self.guardian.stdout.close()
+        self.guardian = None
+
+
+if __name__ == '__main__':
+
+    import argparse
+
+    #
+    # Handling arguments
+    #
+    parser = argparse.ArgumentParser(description="Load a KMA index into\
+        shared memory until stdin is closed (--guard), or destroy a segment\
+        left behind (--destroy).")
+    parser.add_argument("-t_db", "--index",
+                        help="Prefix of the KMA index.",
+                        required=True)
+    parser.add_argument("--kma_shm",
+                        help="Path to kma_shm. Default: kma_shm",
+                        default="kma_shm")
+    parser.add_argument("--level",
+                        help="Shared memory level. Default: 1",
+                        type=int,
+                        default=1)
+    parser.add_argument("--guard",
+                        help="Run as the guardian process.",
+                        action="store_true",
+                        default=False)
+    parser.add_argument("--destroy",
+                        help="Destroy the segment, ex. one left by a run\
+                              that was killed together with its guardian.",
+                        action="store_true",
+                        default=False)
+
+    args = parser.parse_args()
+
+    if(args.guard):
+        quit(guard(args.index, args.kma_shm, args.level))
+    if(args.destroy):
+        result = run_kma_shm(args.kma_shm, args.index, args.level,
+                             destroy=True)
+        quit(result.returncode)
+    parser.print_help()
+    quit(1)
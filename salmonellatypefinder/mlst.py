@@ -1,13 +1,13 @@
 #!/usr/bin/env python3
 
-import subprocess
-import re
-import argparse
 import os
 import json
-import gzip
 import sys
 
+from .kmamlst import kma_mlst
+from .toolrunner import run_tool_async, cmd2string, ToolError
+from .tracing import span
+
 
 def eprint(*args, **kwargs):
     print(*args, file=sys.stderr, **kwargs)
@@ -19,24 +19,58 @@ class MLST():
 
     def __init__(self, files, method="default", seqtype="paired", mlst=None,
                  tmp_dir="tmp_dir", cgemlst_path="mlst.py",
-                 cgemlstdb_path=None, python3_path="python3"):
+                 cgemlstdb_path=None, python3_path="python3", cache=None,
+                 timeout=None, tracer=None, kma_path="kma",
+                 kma_shm_level=None, threads=1, cache_args=None, run=True):
         ''' Constructor.
             method: specifies what software to use in order to find the MLST
                     type. "default" is to employ SRST2 to reads and CGEMLST to
                     assembled genomes.
-                    Other options are: cgemlst or srst2.
+                    Other options are: cgemlst, srst2 or kma. kma maps the
+                    data to the alleles with KMA directly and looks up the
+                    ST in the profile table of the database, which is kept
+                    loaded in the process.
             seqtype: of data can be either: paired, single, or assembled.
             files: Path to file(s) are given as a list.
+            cache: ResultCache object. If given, the ST found by an earlier
+                   identical call of the external software is reused. The
+                   key is built from the files given here, even if they are
+                   replaced by staged copies before the software is run.
+            timeout: Max. seconds the external software may run.
+            tracer: Tracer object. If given, the time spent in each step is
+                    recorded.
+            kma_path: Path to kma, used by the kma method.
+            kma_shm_level: If given, the kma method uses the index in shared
+                           memory, see KMASharedIndex.
+            threads: Number of threads used by the kma method. CGE MLST
+                     does not take a thread count.
+            cache_args: Options of the steps that changed the files given
+                        to the software, ex. subsampling. Part of the cache
+                        key.
+            run: If False, the external software is not run until run() or
+                 run_async() is called.
         '''
+        self.kma_path = kma_path
+        self.threads = threads
+        self.kma_shm_level = kma_shm_level
         self.cgemlst_path = cgemlst_path
+        self.tracer = tracer
+        self.cache = cache
+        self.timeout = timeout
         self.cgemlstdb = cgemlstdb_path
         self.python3 = python3_path
         self.alleles = {}
         self.st = None
         self.files = files
+        self.cache_files = files
+        self.cache_args = list(cache_args or [])
+        # True or False once looked up in the cache, see lookup_cache.
+        self.cached = None
         self.method = None
         self.score = None  # Score depends on the method.
         self.cmd = None  # The exact cmd executed to run external software.
+        self.seqtype = seqtype
+        self.tmp_dir = tmp_dir
 
         os.makedirs(tmp_dir, exist_ok=True)
 
@@ -45,33 +79,122 @@ class MLST():
         elif(method == "default"):
             if(seqtype == "paired" or seqtype == "single"):
                 self.method = "CGE MLST"
-                self.cgemlst(tmp_dir)
         elif(method == "cgemlst"):
             self.method = "CGE MLST"
-            self.cgemlst(tmp_dir)
+        elif(method == "kma"):
+            self.method = "KMA"
+
+        if(run):
+            self.run()
+
+    def run(self):
+        ''' Runs the external software in an event loop of its own.
+        '''
+        if(self.method is None):
+            return
+        import asyncio
+        asyncio.run(self.run_async())
+
+    async def run_async(self):
+        ''' Runs the external software chosen in the constructor, if any.
+        '''
+        if(self.cached):
+            return
+        if(self.method == "CGE MLST"):
+            await self.cgemlst(self.tmp_dir)
+        elif(self.method == "KMA"):
+            await self.kma(self.tmp_dir, self.seqtype)
 
-    def cgemlst(self, output):
+    def lookup_cache(self):
+        ''' Sets the ST from the cache, if found, so the external software
+            is not run.
+            RETURN: True if the software does not need to run.
         '''
+        if(self.method is None):
+            return True
+        if(not self.cache or (self.method == "KMA" and not self.cgemlstdb)):
+            return False
+        self.cached = self.load_cached_result(self.cache_key())
+        if(self.cached and self.method == "CGE MLST"):
+            self.cmd = cmd2string(self.cgemlst_argv(self.tmp_dir))
+        return self.cached
+
+    def cache_key(self):
+        ''' Returns the key used to store the results of the method in the
+            cache.
+        '''
+        if(self.method == "KMA"):
+            return self.cache.key(
+                tool="kma", tool_paths=[self.kma_path],
+                db_path=os.path.join(self.cgemlstdb, "senterica"),
+                files=self.cache_files,
+                args=[self.seqtype, "senterica"] + self.cache_args)
+        # Only the senterica scheme is used from the database.
+        db_path = self.cgemlstdb
+        if(db_path and os.path.isdir(os.path.join(db_path, "senterica"))):
+            db_path = os.path.join(db_path, "senterica")
+        return self.cache.key(
+            tool="cgemlst", tool_paths=[self.cgemlst_path, self.python3],
+            db_path=db_path, files=self.cache_files,
+            args=["-s", "senterica"] + self.cache_args)
+
+    def load_cached_result(self, cache_key):
+        ''' Sets the results from the cache. Returns False if the results
+            are not found.
+        '''
+        tool = "kma" if(self.method == "KMA") else "cgemlst"
+        with span(self.tracer, tool + ".cache_lookup"):
+            cached_result = self.cache.get(cache_key)
+        if(cached_result is None):
+            return False
+        self.st = cached_result["st"]
+        if(self.method == "KMA"):
+            self.alleles = cached_result["alleles"]
+            self.cmd = cached_result["cmd"]
+        return True
+
+    def cgemlst_argv(self, output):
+        ''' Returns the command line of CGE MLST.
         '''
-        files = " ".join(self.files)
         if(os.path.dirname(self.cgemlst_path)):
-            cmd = ("{python3} {mlst} -i {files} -o {out} -s senterica -p {db}"
-                   .format(python3=self.python3, mlst=self.cgemlst_path,
-                           files=files, out=output, db=self.cgemlstdb))
+            argv = [self.python3, self.cgemlst_path]
         else:
-            cmd = ("{mlst} -i {files} -o {out} -s senterica -p {db}"
-                   .format(mlst=self.cgemlst_path, files=files, out=output,
-                           db=self.cgemlstdb))
+            argv = [self.cgemlst_path]
+        argv += ["-i"] + list(self.files)
+        argv += ["-o", output, "-s", "senterica"]
+        if(self.cgemlstdb):
+            argv += ["-p", self.cgemlstdb]
+        return argv
+
+    async def cgemlst(self, output):
+        '''
+        '''
+        argv = self.cgemlst_argv(output)
+        cmd = cmd2string(argv)
+
+        cache_key = None
+        if(self.cache):
+            cache_key = self.cache_key()
+            if(self.cached is None
+               and self.load_cached_result(cache_key)):
+                self.cmd = cmd
+                return
+
         try:
-            result_json = subprocess.run(cmd, capture_output=True, text=True,
-                                         check=True, shell=True)
-        except subprocess.CalledProcessError:
-            eprint("ERROR: CGE MLST call failed")
-            eprint("CMD that failed: " + cmd)
-            quit(1)
+            with span(self.tracer, "cgemlst.run"):
+                result = await run_tool_async(argv, timeout=self.timeout)
+        except ToolError as e:
+            raise ToolError("CGE MLST call failed. " + str(e), cmd=e.cmd,
+                            returncode=e.returncode, stdout=e.stdout,
+                            stderr=e.stderr)
 
-        result_dict = json.loads(result_json.stdout)
-        st = result_dict["mlst"]["results"]["sequence_type"]
+        try:
+            with span(self.tracer, "cgemlst.parse"):
+                result_dict = json.loads(result.stdout)
+                st = result_dict["mlst"]["results"]["sequence_type"]
+        except (ValueError, KeyError, TypeError):
+            raise ToolError("Unable to parse CGE MLST output", cmd=cmd,
+                            stdout=result.stdout, stderr=result.stderr)
 
         try:
             st = int(st)
@@ -81,9 +204,39 @@ class MLST():
         self.st = st
         self.cmd = cmd
 
+        if(cache_key):
+            self.cache.put(cache_key, {"st": st})
+
+    async def kma(self, output, seqtype):
+        ''' Runs KMA against the alleles of the senterica scheme, see
+            kma_mlst.
+        '''
+        if(not self.cgemlstdb):
+            raise ToolError("The kma MLST method requires the MLST database "
+                            "(cgemlstdb_path).")
+
+        cache_key = None
+        if(self.cache):
+            cache_key = self.cache_key()
+            if(self.cached is None
+               and self.load_cached_result(cache_key)):
+                return
+
+        with span(self.tracer, "kma.run"):
+            self.st, self.alleles, self.cmd = await kma_mlst(
+                self.files, seqtype, output, kma_path=self.kma_path,
+                cgemlstdb_path=self.cgemlstdb, timeout=self.timeout,
+                shm_level=self.kma_shm_level, threads=self.threads)
+
+        if(cache_key):
+            self.cache.put(cache_key, {"st": self.st, "alleles": self.alleles,
+                                       "cmd": self.cmd})
+
 
 if __name__ == '__main__':
 
+    import argparse
+
     #
     # Handling arguments
     #
@@ -1,14 +1,10 @@
 #!/usr/bin/env python3
 
-import subprocess
-import re
-import argparse
-import os.path
-import hashlib
 import json
-import textwrap
-import gzip
-from itertools import groupby
+import sys
+
+from .stindex import STIndex
+from .tracing import span
 
 
 class PredictedSerotype(dict):
@@ -33,7 +29,6 @@ class PredictedSerotype(dict):
             out_list.append(partial)
 
         output_txt = " | ".join(out_list)
-        print("JOIN VAR: " + output_txt)
 
         return output_txt
 
@@ -43,9 +38,11 @@ class MLST2Serotype():
     '''
 
     def __init__(self, json_file, min_sero_count=3, min_frac=0.75,
-                 mask_low_count=0):
+                 mask_low_count=0, tracer=None):
 
         ''' Constructor
+            tracer: Tracer object. If given, the time spent loading the
+                    database is recorded.
         '''
         # Checking validity of options.
         if(min_sero_count <= mask_low_count):
@@ -60,9 +57,17 @@ class MLST2Serotype():
         self.min_sero_count = min_sero_count
         self.min_frac = min_frac
         self.mask_low_count = mask_low_count
+        self.data = None
+        self.index = None
+        self.packed = None  # Arrays used by bulk_mlst2serotype.
         try:
-            with open(json_file, "r", encoding="utf-8") as json_fh:
-                self.data = json.load(json_fh)
+            with span(tracer, "mlst2serotype.load", db=json_file):
+                # Compiled index (see STIndex.compile), memory mapped.
+                if(STIndex.is_index_file(json_file)):
+                    self.index = STIndex(json_file)
+                else:
+                    with open(json_file, "r", encoding="utf-8") as json_fh:
+                        self.data = json.load(json_fh)
         except FileNotFoundError:
             print("The JSON file {} was not found\n".format(json_file))
             quit(1)
@@ -82,9 +87,11 @@ class MLST2Serotype():
                   encounter an ST type that should yield 2 serovars. The
                   function will only output the first encountered as a result.
         '''
+        if(self.index):
+            return self.mlst2serotype_index(st)
+
         out_result = PredictedSerotype()
 
-        # TODO: Convert json datase to store integers and not strings.
         st = str(st)
 
         if(st in self.data):
@@ -142,9 +149,336 @@ class MLST2Serotype():
 
         return out_result
 
+    def mlst2serotype_index(self, st):
+        ''' Same as mlst2serotype, but using the compiled index. The totals
+            and max counts stored in the index are used if the index was
+            compiled with the same mask_low_count.
+        '''
+        out_result = PredictedSerotype()
+
+        # STs are stored as integers. Anything not written as an integer is
+        # not found, as in the JSON database.
+        if(not isinstance(st, int)):
+            if(not STIndex.is_st_key(str(st))):
+                return out_result
+            st = int(st)
+
+        i = self.index.find(st)
+        if(i is None):
+            return out_result
+
+        entries = self.index.entries(i)
+
+        if(self.index.mask_low_count == self.mask_low_count):
+            total_isolate_count = self.index.totals[i]
+            max_count = self.index.max_counts[i]
+            predicted_serotype = None
+            if(self.index.argmax[i] >= 0):
+                predicted_serotype = self.index.serovars[self.index.argmax[i]]
+        else:
+            total_isolate_count = 0
+            max_count = 0
+            predicted_serotype = None
+            for serovar, isolate_count in entries:
+                if(isolate_count <= self.mask_low_count):
+                    continue
+                total_isolate_count += isolate_count
+                if(isolate_count > max_count):
+                    max_count = isolate_count
+                    predicted_serotype = serovar
+
+        if(total_isolate_count <= self.mask_low_count):
+            return out_result
+
+        # If more than one serotype is found
+        if(len(entries) > 1):
+            for serovar, isolate_count in entries:
+                # Ignore serovars below the mask threshold.
+                if(isolate_count <= self.mask_low_count):
+                    continue
+                out_result[serovar] = (isolate_count, total_isolate_count,
+                                       isolate_count / total_isolate_count)
+            max_frac = max_count / total_isolate_count
+            # Check if results are above thresholds
+            if(max_count >= self.min_sero_count and max_frac >= self.min_frac):
+                out_result.result = predicted_serotype
+
+        # At least "min_sero_count" isolates with one serotype
+        elif(total_isolate_count >= self.min_sero_count):
+            predicted_serotype = entries[0][0]
+            out_result.result = predicted_serotype
+            out_result[predicted_serotype] = \
+                (total_isolate_count, total_isolate_count, 1.0)
+        # No prediction due to too few isolates found.
+        else:
+            low_count_serotype = entries[0][0]
+            out_result[low_count_serotype] = \
+                (total_isolate_count, total_isolate_count, 1.0)
+
+        return out_result
+
+    def pack(self):
+        ''' Packs the database into NumPy arrays with one value per ST for
+            each column returned by bulk_mlst2serotype, calculated with the
+            thresholds of this object. An extra last value holds the result
+            of STs not found. STs are found through a direct address table
+            when the STs span a small range, otherwise by binary search.
+            The aggregated counts are taken directly from the memory mapped
+            index when it was compiled with the same mask_low_count.
+        '''
+        np = import_numpy()
+
+        if(self.index and self.index.mask_low_count == self.mask_low_count):
+            st_keys = np.frombuffer(self.index.st_keys, dtype=np.int32)
+            entry_start = np.frombuffer(self.index.entry_start,
+                                        dtype=np.int32)
+            totals = np.frombuffer(self.index.totals, dtype=np.int32)
+            max_counts = np.frombuffer(self.index.max_counts, dtype=np.int32)
+            argmax = np.frombuffer(self.index.argmax, dtype=np.int32)
+            serovars = self.index.serovars
+            n_serovars = np.diff(entry_start)
+        else:
+            if(self.index):
+                st_hashes = {st: self.index.entries(i)
+                             for i, st in enumerate(self.index.st_keys)}
+            else:
+                st_hashes = {int(key): list(st_hash.items())
+                             for key, st_hash in self.data.items()
+                             if STIndex.is_st_key(key)}
+            serovar_ids = {}
+            st_keys = sorted(st_hashes)
+            totals = []
+            max_counts = []
+            argmax = []
+            n_serovars = []
+            for st in st_keys:
+                total = 0
+                max_count = 0
+                max_serovar = -1
+                for serovar, count in st_hashes[st]:
+                    serovar_id = serovar_ids.setdefault(serovar,
+                                                        len(serovar_ids))
+                    if(count <= self.mask_low_count):
+                        continue
+                    total += count
+                    if(count > max_count):
+                        max_count = count
+                        max_serovar = serovar_id
+                totals.append(total)
+                max_counts.append(max_count)
+                argmax.append(max_serovar)
+                n_serovars.append(len(st_hashes[st]))
+            serovars = list(serovar_ids)
+
+        # Append the row used for STs not found.
+        st_keys = np.asarray(st_keys, dtype=np.int64)
+        totals = np.append(np.asarray(totals, dtype=np.int64), 0)
+        max_counts = np.append(np.asarray(max_counts, dtype=np.int64), 0)
+        argmax = np.append(np.asarray(argmax, dtype=np.int64), -1)
+        n_serovars = np.append(np.asarray(n_serovars, dtype=np.int64), 0)
+
+        # STs with all serovars masked get no result.
+        has_result = totals > self.mask_low_count
+        totals = np.where(has_result, totals, 0)
+        max_counts = np.where(has_result, max_counts, 0)
+        with np.errstate(divide="ignore", invalid="ignore"):
+            fractions = np.where(has_result, max_counts / totals, 0.0)
+        pass_count = has_result & (max_counts >= self.min_sero_count)
+        pass_frac = has_result & (fractions >= self.min_frac)
+        # An ST with a single serovar is predicted on the count alone.
+        predicted = pass_count & (pass_frac | (n_serovars == 1))
+
+        # The empty string is used where no serovar is found.
+        serovar_names = np.array(list(serovars) + [""], dtype=object)
+        argmax = np.where(has_result, argmax, len(serovar_names) - 1)
+        top_serotypes = serovar_names[argmax]
+
+        # The numeric columns are kept in one record array, so that a single
+        # take looks up all of them.
+        numbers = np.zeros(len(totals), dtype=[
+            ("found", bool), ("max_count", np.int64), ("total", np.int64),
+            ("fraction", np.float64), ("pass_count", bool),
+            ("pass_frac", bool), ("predicted", bool)])
+        numbers["found"][:-1] = True
+        numbers["max_count"] = max_counts
+        numbers["total"] = totals
+        numbers["fraction"] = fractions
+        numbers["pass_count"] = pass_count
+        numbers["pass_frac"] = pass_frac
+        numbers["predicted"] = predicted
+
+        self.packed = {
+            "st_keys": st_keys,
+            "numbers": numbers,
+            "serotype": np.where(predicted, top_serotypes, ""),
+            "top_serotype": top_serotypes,
+            "table": None,
+            "table_min": 0
+        }
+
+        # Direct address table from ST to position. The first and last slots
+        # point to the row of STs not found, so values outside the table are
+        # clipped to them.
+        if(len(st_keys) and st_keys[-1] - st_keys[0] < 10000000):
+            table_min = st_keys[0] - 1
+            table = np.full(st_keys[-1] - table_min + 2, len(st_keys),
+                            dtype=np.intp)
+            table[st_keys - table_min] = np.arange(len(st_keys))
+            self.packed["table"] = table
+            self.packed["table_min"] = table_min
+
+        return self.packed
+
+    def bulk_mlst2serotype(self, sts):
+        ''' Vectorized version of mlst2serotype for many STs at once.
+            sts: Array-like of STs. Values that are not integers are treated
+                 as STs not found in the database.
+            RETURN: Dictionary of NumPy arrays, one value per ST:
+                    st: The STs as integers (0 where not an integer).
+                    found: True if the ST is in the database.
+                    serotype: Predicted serotype or "" (same as
+                              PredictedSerotype.result).
+                    top_serotype: Serovar with the max count or "".
+                    max_count: Isolates found with top_serotype.
+                    total: Total isolates with the ST above the mask.
+                    fraction: max_count / total.
+                    pass_count: True if max_count >= min_sero_count.
+                    pass_frac: True if fraction >= min_frac.
+                    predicted: True if a serotype is predicted.
+                    The values are 0, "" or False where the ST is not found
+                    or masked, as for an empty PredictedSerotype.
+        '''
+        np = import_numpy()
+        packed = self.packed
+        if(packed is None):
+            packed = self.pack()
+
+        if(isinstance(sts, (list, tuple)) and sts
+           and isinstance(sts[0], str)):
+            # Faster than letting NumPy find the longest string. Longer
+            # strings are cut, which parse_sts rejects.
+            sts = np.fromiter(sts, dtype="U{}".format(ST_TEXT_WIDTH),
+                              count=len(sts))
+        else:
+            sts = np.asarray(sts)
+        if(sts.dtype.kind in "iu"):
+            st_values = sts.astype(np.int64)
+            valid = None
+        else:
+            st_values, valid = parse_sts(np, sts)
+
+        st_keys = packed["st_keys"]
+        not_found = len(st_keys)
+        table = packed["table"]
+        if(table is not None):
+            # Values far outside the table may wrap around, but still end
+            # up outside it.
+            positions = table.take(st_values - packed["table_min"],
+                                   mode="clip")
+        else:
+            positions = np.searchsorted(st_keys, st_values)
+            positions[positions == not_found] = 0
+            positions[st_keys[positions] != st_values] = not_found
+        if(valid is not None):
+            positions[~valid] = not_found
+
+        numbers = packed["numbers"].take(positions)
+        results = {"st": st_values}
+        for column in ("found", "max_count", "total", "fraction",
+                       "pass_count", "pass_frac", "predicted"):
+            results[column] = numbers[column]
+        results["serotype"] = packed["serotype"].take(positions)
+        results["top_serotype"] = packed["top_serotype"].take(positions)
+        return results
+
+# Characters kept of STs given as text. Longer strings are not STs, as an ST
+# has at most 18 digits and a sign.
+ST_TEXT_WIDTH = 20
+
+
+def import_numpy():
+    ''' NumPy is only needed for the bulk lookups.
+    '''
+    try:
+        import numpy
+    except ImportError:
+        raise ImportError("NumPy is required for bulk ST lookups. Install it"
+                          " with: pip3 install numpy")
+    return numpy
+
+
+def parse_sts(np, sts):
+    ''' Parses an array of STs written as text, ex. read by read_st_chunks,
+        without a loop in Python. Valid STs are written as STIndex.is_st_key
+        expects, the way str() writes integers: an optional "-", digits and
+        no leading zeros. At most 18 digits.
+        RETURN: (int64 array of the STs, 0 where invalid, bool array valid)
+    '''
+    # The strings are read as a 2D array of character codes, padded with 0
+    # at the end, and parsed one character position at a time, up to the
+    # longest string.
+    strs = np.ascontiguousarray(sts.astype(str, copy=False))
+    width = max(strs.itemsize // 4, 1)
+    codes = strs.view(np.uint32).reshape(strs.shape + (width,))
+    negative = codes[..., 0] == 45
+    st_values = np.zeros(strs.shape, dtype=np.int64)
+    lengths = np.zeros(strs.shape, dtype=np.intp)
+    valid = np.ones(strs.shape, dtype=bool)
+    ended = np.zeros(strs.shape, dtype=bool)
+    for column in range(min(width, ST_TEXT_WIDTH)):
+        code = np.ascontiguousarray(codes[..., column])
+        in_string = code != 0
+        if(not in_string.any()):
+            break
+        # Codes below "0" wrap around and are not digits either.
+        digit = code - 48
+        is_digit = digit <= 9
+        if(column == 0):
+            valid &= is_digit | negative
+        else:
+            # A 0 code inside a string is not a digit either.
+            valid &= ~in_string | (is_digit & ~ended)
+        ended |= ~in_string
+        np.multiply(st_values, 10, out=st_values, where=is_digit)
+        np.add(st_values, digit, out=st_values, where=is_digit)
+        lengths += in_string
+    digits = lengths - negative
+    # Up to 18 digits always fit in an int64. Strings of ST_TEXT_WIDTH or
+    # more characters have more.
+    valid &= (digits > 0) & (digits <= 18)
+    if(width > 1):
+        first = np.where(negative, codes[..., 1], codes[..., 0])
+    else:
+        first = codes[..., 0]
+    valid &= (digits == 1) | (first != 48)
+    # "-0" is not written by str().
+    valid &= ~negative | (st_values != 0)
+    np.negative(st_values, out=st_values, where=negative)
+    st_values[~valid] = 0
+    return (st_values, valid)
+
+def read_st_chunks(st_fh, chunk_size=100000):
+    ''' Reads STs, one per line (first column if tab separated), and yields
+        them in lists of chunk_size. Empty lines and lines starting with "#"
+        are skipped.
+    '''
+    chunk = []
+    for line in st_fh:
+        line = line.strip()
+        if(not line or line.startswith("#")):
+            continue
+        chunk.append(line.split("\t")[0])
+        if(len(chunk) >= chunk_size):
+            yield chunk
+            chunk = []
+    if(chunk):
+        yield chunk
+
 
 if __name__ == '__main__':
 
+    import argparse
+
     #
     # Handling arguments
     #
@@ -155,12 +489,77 @@ if __name__ == '__main__':
                         metavar='ST',
                         type=int)
     parser.add_argument("-d", "--json_db",
-                        help="",
+                        help="JSON database or an index compiled with\
+                              --compile.",
                         metavar='JSON_DB')
+    parser.add_argument("-m", "--mask_low_count_mlst",
+                        help="Ignore entries with this number of isolates or\
+                              fewer. The index is compiled with this value.\
+                              Default: 2",
+                        metavar="INT",
+                        type=int,
+                        default=2)
+    parser.add_argument("--compile",
+                        help="Compile the JSON database into a memory\
+                              mappable index written to this file. The index\
+                              can be used anywhere the JSON database is\
+                              used.",
+                        metavar='INDEX_OUT',
+                        default=None)
+    parser.add_argument("--bulk",
+                        help="File with one ST per line (first column if tab\
+                              separated). Use '-' to read from stdin. The\
+                              predictions are written as a tab separated\
+                              table to stdout. Requires NumPy.",
+                        metavar='ST_FILE',
+                        default=None)
+    parser.add_argument("-f", "--fraction",
+                        help="Fraction of isolates that needs to agree in\
+                              order to call a serovar. Default: 0.75",
+                        metavar="FRAC",
+                        type=float,
+                        default=0.75)
 
     args = parser.parse_args()
 
-    serotyper = MLST2Serotype(json_file=args.json_db)
+    if(args.compile):
+        st_count = STIndex.compile(args.json_db, args.compile,
+                                   mask_low_count=args.mask_low_count_mlst)
+        print("# Wrote index with {} STs to: {}".format(st_count,
+                                                       args.compile))
+        quit(0)
+
+    serotyper = MLST2Serotype(json_file=args.json_db,
+                              min_frac=args.fraction,
+                              mask_low_count=args.mask_low_count_mlst)
+
+    if(args.bulk):
+        if(args.bulk == "-"):
+            st_fh = sys.stdin
+        else:
+            st_fh = open(args.bulk, "r", encoding="utf-8")
+
+        print("ST\tPredicted serotype\tTop serotype\tCount\tTotal\tFrac\t"
+              "Pass count\tPass frac")
+        for st_chunk in read_st_chunks(st_fh):
+            results = serotyper.bulk_mlst2serotype(st_chunk)
+            rows = zip(st_chunk, results["serotype"],
+                       results["top_serotype"], results["max_count"].tolist(),
+                       results["total"].tolist(),
+                       results["fraction"].tolist(),
+                       results["pass_count"].tolist(),
+                       results["pass_frac"].tolist())
+            sys.stdout.write("".join(
+                "{}\t{}\t{}\t{:d}\t{:d}\t{:.2f}\t{}\t{}\n"
+                .format(st, sero, top, count, total, frac, int(p_count),
+                        int(p_frac))
+                for (st, sero, top, count, total, frac, p_count, p_frac)
+                in rows))
+
+        if(st_fh is not sys.stdin):
+            st_fh.close()
+        quit(0)
+
     results = serotyper.mlst2serotype(args.mlst)
     if(results.result):
         print("Predicted serotype: " + results.result)
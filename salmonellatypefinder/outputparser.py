@@ -1,13 +1,11 @@
 #!/usr/bin/env python3
 
-import argparse
+import io
 import os.path
-import gzip
 import sys
 
-from .kauffmanwhite import KauffmanWhite
-from .mlst import MLST
-from .mlst2serotype import MLST2Serotype, PredictedSerotype
+from .htmlreport import HTMLReport, read_tsv_rows
+from .tracing import span
 
 
 def eprint(*args, **kwargs):
@@ -18,141 +16,143 @@ class Parser():
     '''
     '''
 
+    HEADERS = ["Sample", "Predicted Serotype", "ST", "ST mismatches",
+               "ST sero prediction", "SeqSero prediction", "O-type",
+               "H1-type", "H2-type", "MLST serotype details", "Flagged"]
+
+    @staticmethod
+    def header_txt():
+        return "\t".join(Parser.HEADERS) + "\n"
+
     @staticmethod
-    def output_txt(typing_profiles, headers=True):
-        if(headers):
-            output_txt = "Sample\tPredicted Serotype\tST\tST mismatches\t"
-            output_txt += "ST sero prediction\tSeqSero prediction\tO-type\t"
-            output_txt += "H1-type\tH2-type\tMLST serotype details\tFlagged\n"
+    def profile2txt(profile):
+        ''' Returns the tab separated output line of a TypingProfile.
+        '''
+        # Sample
+        fields = [profile.sample_name]
+        # Predicted Serotype
+        if(profile.serotype):
+            fields.append(profile.serotype)
+        else:
+            fields.append("Unable to predict")
+        # ST
+        if(isinstance(profile.mlst.st, str)):  # Is it a string?
+            fields.append(profile.mlst.st)
+        elif(profile.mlst.st is None):
+            fields.append("None")
+        elif(profile.mlst.st):
+            fields.append(str(profile.mlst.st))
         else:
-            output_txt = ""
-
-        for profile in typing_profiles:
-            # Sample
-            filename = os.path.basename(profile.files[0])
-            output_txt += filename
-            # Predicted Serotype
-            if(profile.serotype):
-                output_txt += "\t" + profile.serotype
-            else:
-                output_txt += "\t" + "Unable to predict"
-            # ST
-            if(isinstance(profile.mlst.st, str)):  # Is it a string?
-                output_txt += "\t" + profile.mlst.st
-            elif(profile.mlst.st is None):
-                output_txt += "\tNone"
-            elif(profile.mlst.st):
-                output_txt += "\t" + str(profile.mlst.st)
-            else:
-                output_txt += "\tNone"
-            # ST mismatches
-            output_txt += "\t"  # + profile.mlst.score
-            # output_txt += str(profile.mlst.score, encoding='utf-8')
-            # ST sero prediction
-            if(profile.mlst_serotype.result):
-                output_txt += "\t" + profile.mlst_serotype.result
-            else:
-                output_txt += "\tUnable to predict"
-            # SeqSero prediction
-            output_txt += "\t" + profile.kauffmanwhite.serotype2string()
-            # O-type
-            output_txt += "\t" + profile.kauffmanwhite.o_type
-            # H1-type
-            output_txt += "\t" + profile.kauffmanwhite.h1_type
-            # H2-type
-            output_txt += "\t" + profile.kauffmanwhite.h2_type
-            # MLST serotype details
-            mlst_serotype_details = profile.mlst_serotype.serotype2string()
-            eprint("DETAILS: \"" + mlst_serotype_details + "\"")
-            if(mlst_serotype_details):
-                output_txt += "\t" + mlst_serotype_details
-            else:
-                output_txt += "\tNo serotypes"
-            # Flagged
-            if(profile.uncertain_sero):
-                output_txt += "\t*"
-
-            output_txt += "\n"
-
-        return output_txt
+            fields.append("None")
+        # ST mismatches
+        fields.append("")  # profile.mlst.score
+        # ST sero prediction
+        if(profile.mlst_serotype.result):
+            fields.append(profile.mlst_serotype.result)
+        else:
+            fields.append("Unable to predict")
+        # SeqSero prediction
+        fields.append(profile.kauffmanwhite.serotype2string())
+        # O-type
+        fields.append(profile.kauffmanwhite.o_type)
+        # H1-type
+        fields.append(profile.kauffmanwhite.h1_type)
+        # H2-type
+        fields.append(profile.kauffmanwhite.h2_type)
+        # MLST serotype details
+        mlst_serotype_details = profile.mlst_serotype.serotype2string()
+        if(mlst_serotype_details):
+            fields.append(mlst_serotype_details)
+        else:
+            fields.append("No serotypes")
+        # Flagged
+        if(profile.uncertain_sero):
+            fields.append("*")
+
+        return "\t".join(fields) + "\n"
+
+    @staticmethod
+    def profile2dict(profile):
+        ''' Returns the results of a TypingProfile as a JSON serializable
+            dictionary. Missing results are None.
+        '''
+        mlst_serotype_details = []
+        for serotype, isolate_data in profile.mlst_serotype.items():
+            mlst_serotype_details.append({
+                "serotype": serotype,
+                "count": isolate_data[0],
+                "total": isolate_data[1],
+                "frac": isolate_data[2]
+            })
+
+        return {
+            "sample": profile.sample_name,
+            "files": list(profile.files),
+            "predicted_serotype": profile.serotype or None,
+            "st": profile.mlst.st,
+            "st_sero_prediction": profile.mlst_serotype.result,
+            "seqsero_prediction":
+                profile.kauffmanwhite.serotype2string() or None,
+            "o_type": profile.kauffmanwhite.o_type,
+            "h1_type": profile.kauffmanwhite.h1_type,
+            "h2_type": profile.kauffmanwhite.h2_type,
+            "mlst_serotype_details": mlst_serotype_details,
+            "flagged": profile.uncertain_sero,
+            "mlst_cmd": profile.mlst.cmd,
+            "seqsero_cmd": profile.kauffmanwhite.cmd,
+            "subsample": (profile.subsampler.to_dict()
+                          if(profile.subsampler) else None),
+            "read_bait": (profile.read_bait.to_dict()
+                          if(profile.read_bait) else None),
+            "prescreen": (profile.prescreen.to_dict()
+                          if(profile.prescreen) else None),
+            "input_stage": (profile.staged_input.to_dict()
+                            if(profile.staged_input) else None),
+            "workspace": (profile.workspace.to_dict()
+                          if(profile.workspace) else None),
+            "timings": profile.tracer.durations()
+        }
+
+    @staticmethod
+    def output_txt(typing_profiles, headers=True, tracer=None):
+        output_lines = []
+        with span(tracer, "output.txt"):
+            if(headers):
+                output_lines.append(Parser.header_txt())
+
+            for profile in typing_profiles:
+                output_lines.append(Parser.profile2txt(profile))
+
+        return "".join(output_lines)
 
     @staticmethod
-    def output_html(output_txt):
-        start_output = \
-            '''
-            <table style="width:100%">
-            <tr>
-                <th>Sample</th>
-                <th>Predicted Serotype</th>
-                <th>ST</th>
-                <th>ST mismatches</th>
-                <th>ST sero prediction</th>
-                <th>SeqSero prediction</th>
-                <th>O-type</th>
-                <th>H1-type</th>
-                <th>H2-type</th>
-            </tr>
-            '''
-
-        lines = output_txt.split("\n")
-        table_rows = []
-
-        for line in lines:
-            entries = line.split()
-
-            row_str = "<tr>\n"
-
-            # Sample name
-            row_str += "\t<td>"
-            row_str += entries[0]
-            row_str += "</td>\n"
-            # Predicted Serotype
-            row_str += "\t<td>"
-            row_str += entries[1]
-            row_str += "</td>\n"
-            # ST
-            row_str += "\t<td>"
-            row_str += entries[2]
-            row_str += "</td>\n"
-            # ST mismatches
-            row_str += "\t<td>"
-            row_str += entries[3]
-            row_str += "</td>\n"
-            # ST sero prediction
-            row_str += "\t<td>"
-            row_str += entries[4]
-            row_str += "</td>\n"
-            # SeqSero prediction
-            row_str += "\t<td>"
-            row_str += entries[5]
-            row_str += "</td>\n"
-            # O-type
-            row_str += "\t<td>"
-            row_str += entries[6]
-            row_str += "</td>\n"
-            # H1-type
-            row_str += "\t<td>"
-            row_str += entries[7]
-            row_str += "</td>\n"
-            # H2-type
-            row_str += "\t<td>"
-            row_str += entries[8]
-            row_str += "</td>\n"
-
-            row_str += "</tr>\n"
-
-            table_rows.append(row_str)
-
-        end_output = \
-            '''
-            </table>
-            '''
-
-        return start_output + "\n".join(table_rows) + end_output
+    def output_html(output_txt, out_fh=None, page_size=100):
+        ''' Writes the results as an HTML report, see HTMLReport.
+            output_txt: Output lines of output_txt, without headers, as a
+                        string or an iterable of lines, ex. an open file.
+                        Lines are read one at a time.
+            out_fh: File the report is written to. If None, the report is
+                    returned as a string.
+        '''
+        if(isinstance(output_txt, str)):
+            output_txt = output_txt.split("\n")
+        headers = Parser.HEADERS[:9]
+        rows = read_tsv_rows(output_txt, columns=len(headers),
+                             skip_header=Parser.HEADERS[0] + "\t")
+
+        return_str = (out_fh is None)
+        if(return_str):
+            out_fh = io.StringIO()
+        with HTMLReport(out_fh, page_size=page_size) as report:
+            report.table(headers, rows)
+        if(return_str):
+            return out_fh.getvalue()
 
 
 if __name__ == '__main__':
 
+    import argparse
+
     #
     # Handling arguments
     #
@@ -169,23 +169,34 @@ if __name__ == '__main__':
                         choices=["html"],
                         default="html")
     parser.add_argument("-o", "--output",
-                        help="Path to output file.")
+                        help="Path to output file. Default: stdout")
+    parser.add_argument("--page_size",
+                        help="Rows shown per page of the table.\
+                              Default: 100",
+                        type=int,
+                        default=100)
 
     args = parser.parse_args()
-    args.output = os.path.abspath(args.output)
-
-    conc_txt = ""
 
     for file_txt in args.input_files:
         if(not os.path.isfile(file_txt)):
             eprint("Input file not found:", file_txt)
             quit(1)
 
-        with open(file_txt, "r", encoding="utf-8") as fh:
-            for line in fh:
-                conc_txt += line
+    def read_lines(paths):
+        for file_txt in paths:
+            with open(file_txt, "r", encoding="utf-8") as fh:
+                for line in fh:
+                    yield line
 
     if(args.out_format == "html"):
-        print(Parser.output_html(conc_txt))
+        if(args.output):
+            with open(os.path.abspath(args.output), "w",
+                      encoding="utf-8") as out_fh:
+                Parser.output_html(read_lines(args.input_files),
+                                   out_fh=out_fh, page_size=args.page_size)
+        else:
+            Parser.output_html(read_lines(args.input_files),
+                               out_fh=sys.stdout, page_size=args.page_size)
 
     quit(0)
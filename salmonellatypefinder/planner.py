@@ -0,0 +1,337 @@
+#!/usr/bin/env python3
+
+import json
+import os
+import shutil
+import sys
+import time
+
+
+def eprint(*args, **kwargs):
+    print(*args, file=sys.stderr, **kwargs)
+
+
+PLAN_VERSION = 1
+
+# Threads beyond this gain little on a single bacterial sample, as much of
+# the run time of KMA and SeqSero2 is spent in single threaded steps.
+MAX_TOOL_THREADS = 8
+
+# Estimated peak memory in MB of one sample, with MLST and SeqSero running.
+DEFAULT_SAMPLE_MEMORY = 1000
+
+
+def available_cores():
+    ''' RETURN: Number of CPUs this process may use, limited by the CPU
+                affinity and a cgroup v2 CPU quota, ex. docker --cpus.
+    '''
+    try:
+        cores = len(os.sched_getaffinity(0))
+    except AttributeError:
+        cores = os.cpu_count() or 1
+    try:
+        with open("/sys/fs/cgroup/cpu.max", "r") as cpu_fh:
+            quota, period = cpu_fh.read().split()[:2]
+        if(quota != "max"):
+            cores = min(cores, max(int(int(quota) / int(period)), 1))
+    except (OSError, ValueError):
+        pass
+    return cores
+
+
+def available_memory():
+    ''' RETURN: Memory in MB available to new processes, limited by a cgroup
+                v2 memory limit, or None if it is not known.
+    '''
+    memory = None
+    try:
+        with open("/proc/meminfo", "r") as meminfo_fh:
+            for line in meminfo_fh:
+                if(line.startswith("MemAvailable:")):
+                    memory = int(line.split()[1]) // 1024
+                    break
+    except (OSError, ValueError, IndexError):
+        pass
+    try:
+        with open("/sys/fs/cgroup/memory.max", "r") as max_fh:
+            limit = max_fh.read().strip()
+        with open("/sys/fs/cgroup/memory.current", "r") as current_fh:
+            used = int(current_fh.read().strip())
+        if(limit != "max"):
+            cgroup_memory = (int(limit) - used) // (1024 * 1024)
+            if(memory is None or cgroup_memory < memory):
+                memory = cgroup_memory
+    except (OSError, ValueError):
+        pass
+    return memory
+
+
+def sample_tools(seromethod="seqsero", mlstmethod="default", mlst=None):
+    ''' RETURN: (tools that take a thread count, tools that do not), of the
+                tools run at the same time for each sample.
+    '''
+    threaded = []
+    single = []
+    if(mlst is None):
+        if(mlstmethod == "kma"):
+            threaded.append("kma")
+        else:
+            single.append("cgemlst")
+    if(seromethod == "seqsero2"):
+        threaded.append("seqsero2")
+    else:
+        single.append("seqsero")
+    return (threaded, single)
+
+
+def split_threads(cores, workers, threaded, single):
+    ''' RETURN: Threads of each threaded tool when the cores are shared by
+                "workers" samples. The tools of a sample run at the same
+                time, and the tools without threads use a core each.
+    '''
+    if(not threaded):
+        return 1
+    budget = cores // max(workers, 1) - len(single)
+    return min(max(budget // len(threaded), 1), MAX_TOOL_THREADS)
+
+
+class ResourcePlan():
+    ''' Split of the cores between samples typed at the same time (workers)
+        and the threads of each external tool of a sample (tool_threads).
+    '''
+
+    def __init__(self, workers, tool_threads, cores, memory=None,
+                 reason=""):
+        self.workers = workers
+        self.tool_threads = tool_threads
+        self.cores = cores
+        self.memory = memory
+        self.reason = reason
+
+    def __str__(self):
+        return ("{} sample(s) at a time, {} thread(s) per tool ({})"
+                .format(self.workers, self.tool_threads, self.reason))
+
+    def to_dict(self):
+        return {
+            "workers": self.workers,
+            "tool_threads": self.tool_threads,
+            "cores": self.cores,
+            "memory": self.memory,
+            "reason": self.reason
+        }
+
+
+def load_benchmark(path):
+    ''' RETURN: Benchmark recorded by record_benchmark, or None if the file
+                does not exist.
+    '''
+    if(not path or not os.path.isfile(path)):
+        return None
+    with open(path, "r", encoding="utf-8") as plan_fh:
+        benchmark = json.load(plan_fh)
+    if(benchmark.get("version") != PLAN_VERSION):
+        eprint("! WARNING: Ignoring resource plan of another version: {}"
+               .format(path))
+        return None
+    return benchmark
+
+
+def plan_resources(samples=None, cores=None, memory=None,
+                   sample_memory=DEFAULT_SAMPLE_MEMORY, seromethod="seqsero",
+                   mlstmethod="default", mlst=None, workers=None,
+                   tool_threads=None, benchmark=None):
+    ''' Decides how many samples are typed at the same time and how many
+        threads each tool that takes a thread count (KMA and SeqSero2) gets.
+        Samples are run in parallel first, as the tools scale better over
+        samples than over threads. The cores left over when there are fewer
+        samples than cores, or too little memory for more samples, are
+        given to the tools as threads.
+        samples: Number of samples. None if not known, ex. in server mode.
+        cores: Default: available_cores()
+        memory: MB of memory available. Default: available_memory()
+        sample_memory: Estimated MB used by a sample.
+        workers, tool_threads: Fixed by the user, ex. -w. The other is
+                               planned around it.
+        benchmark: Benchmark recorded by record_benchmark. Its best split is
+                   used when it was measured with the same cores and tools
+                   and there are enough samples to fill it.
+        RETURN: ResourcePlan
+    '''
+    if(cores is None):
+        cores = available_cores()
+    if(memory is None):
+        memory = available_memory()
+    threaded, single = sample_tools(seromethod, mlstmethod, mlst)
+
+    if(workers is None and benchmark
+       and benchmark["cores"] == cores and benchmark["tools"] == threaded
+       and (samples is None or samples >= benchmark["best"]["workers"])):
+        best = benchmark["best"]
+        if(tool_threads is None):
+            tool_threads = best["tool_threads"]
+        return ResourcePlan(best["workers"], tool_threads, cores, memory,
+                            reason="benchmarked")
+
+    if(workers is None):
+        workers = cores
+        reason = "one sample per core"
+        if(tool_threads is not None and threaded):
+            # Each sample uses the given threads for each threaded tool.
+            sample_cores = len(threaded) * tool_threads + len(single)
+            workers = max(cores // sample_cores, 1)
+            reason = "one sample per {} cores".format(sample_cores)
+        if(samples is not None and samples < workers):
+            workers = max(samples, 1)
+            reason = "{} sample(s) on {} cores".format(samples, cores)
+        if(memory is not None and sample_memory):
+            memory_workers = max(memory // sample_memory, 1)
+            if(memory_workers < workers):
+                workers = memory_workers
+                reason = "{} MB memory for {} MB per sample".format(
+                    memory, sample_memory)
+    else:
+        reason = "workers given"
+    if(tool_threads is None):
+        tool_threads = split_threads(cores, workers, threaded, single)
+    else:
+        reason += ", threads given"
+    return ResourcePlan(workers, tool_threads, cores, memory, reason=reason)
+
+
+def candidate_splits(cores, threaded, single):
+    ''' RETURN: (workers, tool_threads) splits of the cores to benchmark:
+                one sample per core, and fewer samples with more threads.
+    '''
+    splits = []
+    workers = cores
+    while(workers >= 1):
+        split = (workers, split_threads(cores, workers, threaded, single))
+        if(split not in splits):
+            splits.append(split)
+        if(split[1] >= MAX_TOOL_THREADS):
+            break
+        workers //= 2
+    return splits
+
+
+def benchmark_splits(samples, serotyper, tmp_dir, cores=None, splits=None,
+                     seromethod="seqsero", mlstmethod="default",
+                     **typing_options):
+    ''' Types the same samples with each split of the cores and measures the
+        throughput. Results are not cached, so every split runs the tools.
+        samples: Sample objects. Use at least as many as cores, so every
+                 split is filled.
+        splits: (workers, tool_threads) to try. Default: candidate_splits
+        RETURN: List of dicts with the workers, tool_threads, wall_s,
+                throughput and failed samples of each split.
+    '''
+    from .batch import iter_batch
+
+    if(cores is None):
+        cores = available_cores()
+    if(splits is None):
+        threaded, single = sample_tools(seromethod, mlstmethod)
+        splits = candidate_splits(cores, threaded, single)
+    typing_options["cache"] = None
+    typing_options.pop("tool_threads", None)
+
+    results = []
+    for workers, tool_threads in splits:
+        eprint("# Benchmarking {} sample(s) at a time with {} thread(s) per"
+               " tool".format(workers, tool_threads))
+        split_dir = os.path.join(tmp_dir, "plan_w{}_t{}".format(
+            workers, tool_threads))
+        failed = 0
+        start = time.perf_counter()
+        for sample, profile in iter_batch(samples, serotyper, split_dir,
+                                          workers=workers,
+                                          seromethod=seromethod,
+                                          mlstmethod=mlstmethod,
+                                          tool_threads=tool_threads,
+                                          **typing_options):
+            if(profile is None):
+                failed += 1
+        wall = time.perf_counter() - start
+        shutil.rmtree(split_dir, ignore_errors=True)
+        results.append({
+            "workers": workers,
+            "tool_threads": tool_threads,
+            "samples": len(samples),
+            "failed": failed,
+            "wall_s": wall,
+            "throughput": len(samples) / wall if(wall) else 0
+        })
+    return results
+
+
+def record_benchmark(path, results, cores, memory, threaded):
+    ''' Writes the benchmark results and the split with the highest
+        throughput without failed samples to path, see load_benchmark.
+        RETURN: The best split, or None if all splits had failed samples.
+    '''
+    passed = [result for result in results if(not result["failed"])]
+    if(not passed):
+        return None
+    best = max(passed, key=lambda result: result["throughput"])
+    with open(path, "w", encoding="utf-8") as plan_fh:
+        json.dump({
+            "version": PLAN_VERSION,
+            "created": time.time(),
+            "cores": cores,
+            "memory": memory,
+            "tools": threaded,
+            "splits": results,
+            "best": best
+        }, plan_fh, indent=2)
+    return best
+
+
+if __name__ == '__main__':
+
+    import argparse
+
+    #
+    # Handling arguments
+    #
+    parser = argparse.ArgumentParser(description="Show how the cores would\
+        be split between samples and tool threads.")
+    parser.add_argument("-n", "--samples",
+                        help="Number of samples. Default: unknown",
+                        type=int,
+                        default=None)
+    parser.add_argument("--cores",
+                        help="Default: CPUs available to this process",
+                        type=int,
+                        default=None)
+    parser.add_argument("--memory",
+                        help="MB of memory. Default: available memory",
+                        type=int,
+                        default=None)
+    parser.add_argument("--sample_memory",
+                        help="Estimated MB used by a sample. Default: {}"
+                             .format(DEFAULT_SAMPLE_MEMORY),
+                        type=int,
+                        default=DEFAULT_SAMPLE_MEMORY)
+    parser.add_argument("--seromethod",
+                        choices=["seqsero", "seqsero2"],
+                        default="seqsero")
+    parser.add_argument("--mlstmethod",
+                        choices=["default", "cgemlst", "kma"],
+                        default="default")
+    parser.add_argument("--resource_plan",
+                        help="Benchmark recorded with --benchmark_plan.",
+                        metavar="JSON",
+                        default=None)
+
+    args = parser.parse_args()
+
+    plan = plan_resources(samples=args.samples, cores=args.cores,
+                          memory=args.memory,
+                          sample_memory=args.sample_memory,
+                          seromethod=args.seromethod,
+                          mlstmethod=args.mlstmethod,
+                          benchmark=load_benchmark(args.resource_plan))
+    print(plan)
+
+    quit(0)
@@ -0,0 +1,260 @@
+#!/usr/bin/env python3
+
+import hashlib
+import os
+import struct
+import sys
+
+from .readbait import find_bait_fastas, read_fasta, reverse_complement
+from .subsample import InputError, open_fastq
+
+
+def eprint(*args, **kwargs):
+    print(*args, file=sys.stderr, **kwargs)
+
+
+MAGIC = b"STFPSCR1"
+
+# Marker k-mers used in this process, see load_marker_index.
+_markers = {}
+
+
+def marker_index_path(loci, kmer_size, cache_dir):
+    ''' Name of the cached marker index. Changes when a marker file or the
+        k-mer size changes.
+    '''
+    sha256 = hashlib.sha256(str(kmer_size).encode("utf-8"))
+    for name, path in loci:
+        stat = os.stat(path)
+        sha256.update("{}\0{}\0{}\0{}\0".format(name, os.path.realpath(path),
+                                               stat.st_size,
+                                               stat.st_mtime_ns)
+                      .encode("utf-8"))
+    return os.path.join(cache_dir, "prescreen_{}.idx".format(
+        sha256.hexdigest()[:16]))
+
+
+def build_marker_index(loci, kmer_size, out_path):
+    ''' Writes the k-mers of each marker locus to out_path. All alleles of a
+        locus are included, in both orientations. The size of a locus is the
+        number of k-mers in its median allele.
+        Format: MAGIC, k-mer size, no. of loci, and for each locus: name,
+        size, no. of k-mers and the k-mers.
+    '''
+    os.makedirs(os.path.dirname(out_path) or ".", exist_ok=True)
+    tmp_path = "{}.tmp{}".format(out_path, os.getpid())
+    with open(tmp_path, "wb") as index_fh:
+        index_fh.write(MAGIC + struct.pack("=BI", kmer_size, len(loci)))
+        for name, path in loci:
+            kmers = set()
+            lengths = []
+            for seq in read_fasta(path):
+                lengths.append(len(seq))
+                for strand in (seq, reverse_complement(seq)):
+                    for i in range(len(strand) - kmer_size + 1):
+                        kmer = strand[i:i + kmer_size]
+                        if(not kmer.strip(b"ACGT")):
+                            kmers.add(kmer)
+            size = 0
+            if(lengths):
+                lengths.sort()
+                median = (lengths[(len(lengths) - 1) // 2]
+                          + lengths[len(lengths) // 2]) // 2
+                size = max(median - kmer_size + 1, 0)
+            name = name.encode("utf-8")
+            index_fh.write(struct.pack("=H", len(name)) + name)
+            index_fh.write(struct.pack("=II", size, len(kmers)))
+            index_fh.write(b"".join(sorted(kmers)))
+    os.replace(tmp_path, out_path)
+
+
+def load_marker_index(path):
+    ''' RETURN: (k-mer size, list of (locus name, locus size), dictionary
+                k-mer --> locus no.). Kept per process.
+    '''
+    if(path in _markers):
+        return _markers[path]
+    with open(path, "rb") as index_fh:
+        data = index_fh.read()
+    if(data[:len(MAGIC)] != MAGIC):
+        raise InputError("Not a pre-screen index: {}".format(path))
+    pos = len(MAGIC)
+    kmer_size, locus_count = struct.unpack_from("=BI", data, pos)
+    pos += struct.calcsize("=BI")
+    loci = []
+    kmers = {}
+    for locus_no in range(locus_count):
+        name_len, = struct.unpack_from("=H", data, pos)
+        pos += 2
+        name = data[pos:pos + name_len].decode("utf-8")
+        pos += name_len
+        size, kmer_count = struct.unpack_from("=II", data, pos)
+        pos += 8
+        for i in range(kmer_count):
+            kmers[data[pos:pos + kmer_size]] = locus_no
+            pos += kmer_size
+        loci.append((name, size))
+    _markers.clear()
+    _markers[path] = (kmer_size, loci, kmers)
+    return _markers[path]
+
+
+class PreScreen():
+    ''' Checks that a sample is Salmonella before the external tools are run.
+        The reads (or contigs) at the start of the input are searched for
+        k-mers of marker loci, by default the alleles of the senterica MLST
+        scheme. A locus is found if the k-mers seen cover at least
+        min_locus_fraction of it, and the sample passes if at least min_loci
+        loci are found. Other species share too few exact k-mers with the
+        Salmonella alleles to cover the loci.
+    '''
+
+    def __init__(self, cgemlstdb_path=None, marker_fastas=None,
+                 cache_dir=".", kmer_size=25, sample_bases=30000000,
+                 min_locus_fraction=0.8, min_loci=5, stride=8):
+        ''' Constructor.
+            marker_fastas: Extra marker FASTA files, one locus per file.
+            cache_dir: Directory of the cached marker index.
+            sample_bases: Max. bases read from the input. The default is
+                          about 6x of a Salmonella genome.
+            min_locus_fraction: Fraction of a locus that must be covered.
+            min_loci: Number of loci that must be found. Default: 5 of the
+                      7 MLST loci.
+            stride: Reads are first checked for marker k-mers at every
+                    stride'th position, and only reads with a hit are
+                    searched at every position.
+        '''
+        mlst_fastas, seqsero_fastas = find_bait_fastas(cgemlstdb_path)
+        loci = [(os.path.splitext(os.path.basename(path))[0], path)
+                for path in mlst_fastas + list(marker_fastas or [])]
+        if(not loci):
+            raise InputError("The Salmonella pre-screen needs the MLST "
+                             "allele files, but none were found in: {}"
+                             .format(cgemlstdb_path))
+        self.loci = loci
+        self.kmer_size = kmer_size
+        self.sample_bases = sample_bases
+        self.min_locus_fraction = min_locus_fraction
+        self.min_loci = min(min_loci, len(loci))
+        self.stride = stride
+        self.index = marker_index_path(loci, kmer_size, cache_dir)
+
+        self.passed = None
+        self.bases = 0
+        self.locus_fractions = {}
+
+    def to_dict(self):
+        return {
+            "passed": self.passed,
+            "bases": self.bases,
+            "loci_found": self.loci_found(),
+            "locus_fractions": self.locus_fractions
+        }
+
+    def ensure_index(self):
+        if(not os.path.isfile(self.index)):
+            build_marker_index(self.loci, self.kmer_size, self.index)
+
+    def loci_found(self):
+        return sorted(name for name, fraction in self.locus_fractions.items()
+                      if(fraction >= self.min_locus_fraction))
+
+    def screen(self, files, seqtype="paired"):
+        ''' RETURN: True if the sample looks like Salmonella.
+        '''
+        self.ensure_index()
+        kmer_size, loci, kmers = load_marker_index(self.index)
+        found = [set() for locus in loci]
+        self.bases = 0
+
+        bases_per_file = self.sample_bases // len(files)
+        for path in files:
+            if(seqtype == "assembled"):
+                seqs = read_fasta(path)
+                stride = 1
+            else:
+                seqs = self.read_seqs(path)
+                stride = self.stride
+            file_bases = 0
+            for seq in seqs:
+                file_bases += len(seq)
+                self.search(seq, kmer_size, kmers, found, stride)
+                if(file_bases >= bases_per_file):
+                    break
+            self.bases += file_bases
+
+        self.locus_fractions = {}
+        for (name, size), locus_kmers in zip(loci, found):
+            fraction = len(locus_kmers) / size if(size) else 0
+            self.locus_fractions[name] = round(min(fraction, 1), 3)
+        self.passed = len(self.loci_found()) >= self.min_loci
+        return self.passed
+
+    @staticmethod
+    def read_seqs(path):
+        with open_fastq(path) as fastq_fh:
+            for i, line in enumerate(fastq_fh):
+                if(i % 4 == 1):
+                    yield line.rstrip().upper()
+
+    @staticmethod
+    def search(seq, kmer_size, kmers, found, stride):
+        last = len(seq) - kmer_size
+        if(last < 0):
+            return
+        if(stride > 1):
+            for i in range(0, last + 1, stride):
+                if(seq[i:i + kmer_size] in kmers):
+                    break
+            else:
+                if(seq[last:] not in kmers):
+                    return
+        for i in range(last + 1):
+            kmer = seq[i:i + kmer_size]
+            locus_no = kmers.get(kmer)
+            if(locus_no is not None):
+                # Both orientations are counted as one k-mer.
+                found[locus_no].add(min(kmer, reverse_complement(kmer)))
+
+
+if __name__ == '__main__':
+
+    import argparse
+
+    #
+    # Handling arguments
+    #
+    parser = argparse.ArgumentParser(description="Check that a sample is\
+        Salmonella using k-mers of the MLST loci.")
+    # Posotional arguments
+    parser.add_argument("input_files",
+                        help="FASTQ file(s) or an assembly in FASTA format.\
+                              Can be gzip compressed.",
+                        nargs='+',
+                        metavar='FAST(Q|A)')
+    parser.add_argument("-s", "--seq_type",
+                        help="Type of sequence: paired, single or assembled",
+                        choices=["paired", "single", "assembled"],
+                        default="paired")
+    parser.add_argument("-d1", "--cgemlstdb_path",
+                        help="CGE MLST database dir.")
+    parser.add_argument("--marker_fasta",
+                        help="Extra marker locus FASTA file. Can be given\
+                              several times.",
+                        action="append",
+                        default=[])
+    parser.add_argument("-c", "--cache_dir",
+                        help="Directory of the cached marker index.",
+                        default=".")
+
+    args = parser.parse_args()
+
+    try:
+        prescreen = PreScreen(cgemlstdb_path=args.cgemlstdb_path,
+                              marker_fastas=args.marker_fasta,
+                              cache_dir=args.cache_dir)
+        passed = prescreen.screen(args.input_files, seqtype=args.seq_type)
+    except InputError as e:
+        sys.exit("! ERROR: {}".format(e))
+    print(prescreen.to_dict())
+    quit(0 if(passed) else 1)
@@ -0,0 +1,404 @@
+#!/usr/bin/env python3
+
+import atexit
+import glob
+import hashlib
+import os
+import sys
+from itertools import islice
+
+from .subsample import InputError, open_fastq, read_name
+
+
+def eprint(*args, **kwargs):
+    print(*args, file=sys.stderr, **kwargs)
+
+
+MAGIC = b"STFBAIT1"
+
+COMPLEMENT = bytes.maketrans(b"ACGT", b"TGCA")
+
+# Bait k-mers of the index used in this process, see load_bait_index.
+_bait_kmers = {}
+
+# Pool of processes filtering reads, see bait_pool.
+_bait_pools = {}
+
+
+def find_bait_fastas(cgemlstdb_path=None, seqsero_path=None,
+                     seqsero2_path=None):
+    ''' Finds the reference sequences the tools look for: the allele files of
+        the senterica MLST scheme and the antigen gene references shipped
+        with SeqSero/SeqSero2.
+        RETURN: (MLST files, SeqSero files)
+    '''
+    mlst_fastas = []
+    if(cgemlstdb_path):
+        mlst_fastas = sorted(glob.glob(os.path.join(cgemlstdb_path,
+                                                    "senterica", "*.tfa")))
+        if(not mlst_fastas):
+            mlst_fastas = sorted(glob.glob(os.path.join(cgemlstdb_path,
+                                                        "*.tfa")))
+
+    seqsero_fastas = []
+    for path in (seqsero_path, seqsero2_path):
+        if(not path):
+            continue
+        prg_dir = os.path.dirname(os.path.realpath(path))
+        for db_dir in ("database", "seqsero2_db"):
+            for base_dir in (prg_dir, os.path.dirname(prg_dir)):
+                for ext in ("*.fasta", "*.fa", "*.fna"):
+                    seqsero_fastas += glob.glob(os.path.join(base_dir, db_dir,
+                                                             ext))
+    seqsero_fastas = sorted(set(seqsero_fastas))
+
+    return (mlst_fastas, seqsero_fastas)
+
+
+def read_fasta(path):
+    ''' Yields the sequences of a (gzipped) FASTA file in upper case.
+    '''
+    seq = []
+    with open_fastq(path) as fasta_fh:
+        for line in fasta_fh:
+            line = line.strip()
+            if(line.startswith(b">")):
+                if(seq):
+                    yield b"".join(seq).upper()
+                seq = []
+            elif(line):
+                seq.append(line)
+    if(seq):
+        yield b"".join(seq).upper()
+
+
+def reverse_complement(seq):
+    return seq.translate(COMPLEMENT)[::-1]
+
+
+def index_path(fastas, kmer_size, cache_dir):
+    ''' Name of the cached index. Changes when a reference file or the k-mer
+        size changes.
+    '''
+    sha256 = hashlib.sha256(str(kmer_size).encode("utf-8"))
+    for path in sorted(fastas):
+        stat = os.stat(path)
+        sha256.update("{}\0{}\0{}\0".format(os.path.realpath(path),
+                                           stat.st_size,
+                                           stat.st_mtime_ns).encode("utf-8"))
+    return os.path.join(cache_dir, "bait_{}.idx".format(
+        sha256.hexdigest()[:16]))
+
+
+def build_bait_index(fastas, kmer_size, out_path):
+    ''' Writes all k-mers of the references, in both orientations, to
+        out_path. K-mers with other bases than ACGT are left out.
+        Format: MAGIC, k-mer size (1 byte), k-mers of kmer_size bytes each.
+    '''
+    kmers = set()
+    for path in fastas:
+        for seq in read_fasta(path):
+            for strand in (seq, reverse_complement(seq)):
+                for i in range(len(strand) - kmer_size + 1):
+                    kmer = strand[i:i + kmer_size]
+                    if(not kmer.strip(b"ACGT")):
+                        kmers.add(kmer)
+
+    os.makedirs(os.path.dirname(out_path) or ".", exist_ok=True)
+    tmp_path = "{}.tmp{}".format(out_path, os.getpid())
+    with open(tmp_path, "wb") as index_fh:
+        index_fh.write(MAGIC + bytes([kmer_size]))
+        index_fh.write(b"".join(sorted(kmers)))
+    os.replace(tmp_path, out_path)
+    return len(kmers)
+
+
+def load_bait_index(path):
+    ''' Loads the k-mers of an index written by build_bait_index. The set is
+        kept per process, so workers typing many samples load it once.
+        RETURN: (k-mer size, set of k-mers)
+    '''
+    if(path in _bait_kmers):
+        return _bait_kmers[path]
+    with open(path, "rb") as index_fh:
+        data = index_fh.read()
+    if(data[:len(MAGIC)] != MAGIC):
+        raise InputError("Not a bait index: {}".format(path))
+    kmer_size = data[len(MAGIC)]
+    start = len(MAGIC) + 1
+    kmers = frozenset(data[i:i + kmer_size]
+                      for i in range(start, len(data), kmer_size))
+    _bait_kmers.clear()
+    _bait_kmers[path] = (kmer_size, kmers)
+    return _bait_kmers[path]
+
+
+def has_bait(seq, kmer_size, kmers, stride):
+    ''' True if one of the k-mers starting at every stride'th position of seq
+        is a bait k-mer. A read sharing at least kmer_size + stride - 1
+        bases with a reference is always found.
+    '''
+    seq = seq.upper()
+    last = len(seq) - kmer_size
+    if(last < 0):
+        return False
+    for i in range(0, last + 1, stride):
+        if(seq[i:i + kmer_size] in kmers):
+            return True
+    # The k-mer at the end of the read.
+    return seq[last:] in kmers
+
+
+def bait_pool(index, workers):
+    ''' RETURN: ProcessPoolExecutor with "workers" processes, each of which
+                loads the k-mers of index when it starts. The pool is kept
+                per process, so a worker typing many samples starts it and
+                loads the index once.
+    '''
+    key = (index, workers)
+    if(key not in _bait_pools):
+        from concurrent.futures import ProcessPoolExecutor
+        close_bait_pools()
+        _bait_pools[key] = ProcessPoolExecutor(
+            max_workers=workers, initializer=load_bait_index,
+            initargs=(index,))
+    return _bait_pools[key]
+
+
+def close_bait_pools():
+    for executor in _bait_pools.values():
+        executor.shutdown(cancel_futures=True)
+    _bait_pools.clear()
+
+
+atexit.register(close_bait_pools)
+
+
+def filter_block(index, stride, blocks):
+    ''' Filters a block of records. blocks holds the records of each input
+        file as a list of lines, 4 lines per record. A record (pair) is kept
+        if any of its reads has a bait k-mer.
+        RETURN: (list with the kept records of each file as bytes, records
+                read, records kept)
+    '''
+    kmer_size, kmers = load_bait_index(index)
+    kept = [[] for block in blocks]
+    records = len(blocks[0]) // 4
+    records_kept = 0
+    for i in range(0, len(blocks[0]), 4):
+        if(any(has_bait(block[i + 1].rstrip(), kmer_size, kmers, stride)
+               for block in blocks)):
+            records_kept += 1
+            for block, kept_lines in zip(blocks, kept):
+                kept_lines.extend(block[i:i + 4])
+    return ([b"".join(kept_lines) for kept_lines in kept], records,
+            records_kept)
+
+
+class ReadBait():
+    ''' Pre-filter that passes on only the reads (pairs) sharing k-mers with
+        the MLST alleles or the SeqSero antigen gene references. The k-mer
+        index is built once and cached on disk.
+    '''
+
+    def __init__(self, cgemlstdb_path=None, seqsero_path=None,
+                 seqsero2_path=None, bait_fastas=None, cache_dir=".",
+                 kmer_size=25, stride=4, workers=1, block_records=20000):
+        ''' Constructor.
+            bait_fastas: Extra reference FASTA files.
+            cache_dir: Directory of the cached k-mer index.
+            kmer_size: Length of the bait k-mers, max. 255.
+            stride: Distance between the read k-mers that are looked up.
+            workers: Number of processes filtering reads. The processes
+                     are kept for the next ReadBait with the same index,
+                     see bait_pool.
+            block_records: Records (pairs) sent to a process at a time.
+        '''
+        mlst_fastas, seqsero_fastas = find_bait_fastas(
+            cgemlstdb_path, seqsero_path, seqsero2_path)
+        if(not mlst_fastas and not bait_fastas):
+            raise InputError("Read baiting needs the MLST allele files, but "
+                             "none were found in: {}".format(cgemlstdb_path))
+        if(not seqsero_fastas and not bait_fastas):
+            raise InputError(
+                "Read baiting needs the SeqSero antigen references, but no "
+                "database dir was found next to: {}".format(
+                    ", ".join(str(path) for path in
+                              (seqsero_path, seqsero2_path) if path)))
+        self.fastas = mlst_fastas + seqsero_fastas + list(bait_fastas or [])
+        self.kmer_size = kmer_size
+        self.stride = stride
+        self.workers = max(workers or 1, 1)
+        self.block_records = block_records
+        self.index = index_path(self.fastas, kmer_size, cache_dir)
+
+        self.reads_in = 0
+        self.reads_out = 0
+
+    def to_dict(self):
+        return {
+            "index": self.index,
+            "reads_in": self.reads_in,
+            "reads_out": self.reads_out
+        }
+
+    def cache_args(self):
+        ''' RETURN: The options that change the baited reads, part of the
+                    cache keys of the tools given the reads. The name of the
+                    index changes with the references and the k-mer size.
+        '''
+        return ["read_bait", self.kmer_size, self.stride,
+                os.path.basename(self.index)]
+
+    def ensure_index(self):
+        if(not os.path.isfile(self.index)):
+            kmer_count = build_bait_index(self.fastas, self.kmer_size,
+                                          self.index)
+            eprint("# Built bait index with {} k-mers: {}"
+                   .format(kmer_count, self.index))
+        # Checked here, as the pool processes load the index in their
+        # initializer, where an error only breaks the pool.
+        with open(self.index, "rb") as index_fh:
+            if(index_fh.read(len(MAGIC)) != MAGIC):
+                raise InputError("Not a bait index: {}".format(self.index))
+
+    def filter(self, files, out_dir):
+        ''' Filters one (single-end) or two (paired-end) FASTQ files.
+            RETURN: Tuple with the paths of the filtered files. Raises
+                    InputError if the files are malformed.
+        '''
+        self.ensure_index()
+        os.makedirs(out_dir, exist_ok=True)
+
+        paths = list(files)
+        out_paths = [os.path.join(out_dir, "bait_R{}.fastq".format(i))
+                     for i in range(1, len(paths) + 1)]
+        fastq_fhs = [open_fastq(path) for path in paths]
+        out_fhs = [open(path, "wb") for path in out_paths]
+        self.reads_in = 0
+        self.reads_out = 0
+        try:
+            for kept, records, records_kept in self.filter_blocks(fastq_fhs,
+                                                                  paths):
+                for out_fh, data in zip(out_fhs, kept):
+                    out_fh.write(data)
+                self.reads_in += records
+                self.reads_out += records_kept
+        finally:
+            for fh in fastq_fhs + out_fhs:
+                fh.close()
+
+        return tuple(out_paths)
+
+    def read_blocks(self, fastq_fhs, paths):
+        lines_per_block = 4 * self.block_records
+        while(True):
+            blocks = [list(islice(fastq_fh, lines_per_block))
+                      for fastq_fh in fastq_fhs]
+            if(not blocks[0]):
+                if(any(blocks)):
+                    raise InputError("Paired FASTQ files have a different "
+                                     "number of reads: {}"
+                                     .format(", ".join(paths)))
+                return
+            for block, path in zip(blocks, paths):
+                if(len(block) != len(blocks[0]) or len(block) % 4):
+                    raise InputError("Truncated FASTQ file or paired files "
+                                     "with a different number of reads: {}"
+                                     .format(path))
+            if(len(blocks) > 1):
+                for header1, header2 in zip(blocks[0][::4], blocks[1][::4]):
+                    if(read_name(header1) != read_name(header2)):
+                        raise InputError(
+                            "Paired FASTQ files are out of sync at read {} "
+                            "and {}".format(
+                                header1.decode("utf-8", "replace").strip(),
+                                header2.decode("utf-8", "replace").strip()))
+            yield blocks
+
+    def filter_blocks(self, fastq_fhs, paths):
+        ''' Yields the filtered blocks in file order.
+        '''
+        blocks = self.read_blocks(fastq_fhs, paths)
+        if(self.workers == 1):
+            for block in blocks:
+                yield filter_block(self.index, self.stride, block)
+            return
+
+        from concurrent.futures.process import BrokenProcessPool
+        executor = bait_pool(self.index, self.workers)
+        futures = []
+        try:
+            for block in blocks:
+                futures.append(executor.submit(filter_block, self.index,
+                                               self.stride, block))
+                if(len(futures) >= 2 * self.workers):
+                    yield futures.pop(0).result()
+            while(futures):
+                yield futures.pop(0).result()
+        except BrokenProcessPool:
+            close_bait_pools()
+            raise
+        finally:
+            # The pool is kept for the next sample, so blocks of a sample
+            # that failed are not filtered.
+            for future in futures:
+                future.cancel()
+
+
+if __name__ == '__main__':
+
+    import argparse
+
+    #
+    # Handling arguments
+    #
+    parser = argparse.ArgumentParser(description="Keep only the reads that\
+        share k-mers with the MLST alleles or the SeqSero antigen gene\
+        references.")
+    # Posotional arguments
+    parser.add_argument("input_files",
+                        help="FASTQ file(s), one for single-end and two for\
+                              paired-end data. Can be gzip compressed.",
+                        nargs='+',
+                        metavar='FASTQ')
+    parser.add_argument("-o", "--out_dir",
+                        help="Output directory.",
+                        default=".")
+    parser.add_argument("-d1", "--cgemlstdb_path",
+                        help="CGE MLST database dir.")
+    parser.add_argument("--seqsero",
+                        help="Path to SeqSero.py.")
+    parser.add_argument("--seqsero2",
+                        help="Path to SeqSero2_package.py.")
+    parser.add_argument("-b", "--bait_fasta",
+                        help="Extra reference FASTA file. Can be given\
+                              several times.",
+                        action="append",
+                        default=[])
+    parser.add_argument("-c", "--cache_dir",
+                        help="Directory of the cached k-mer index.",
+                        default=".")
+    parser.add_argument("-k", "--kmer_size",
+                        help="Default: 25",
+                        type=int,
+                        default=25)
+    parser.add_argument("-w", "--workers",
+                        help="Default: number of CPUs",
+                        type=int,
+                        default=os.cpu_count() or 1)
+
+    args = parser.parse_args()
+
+    try:
+        bait = ReadBait(cgemlstdb_path=args.cgemlstdb_path,
+                        seqsero_path=args.seqsero,
+                        seqsero2_path=args.seqsero2,
+                        bait_fastas=args.bait_fasta,
+                        cache_dir=args.cache_dir,
+                        kmer_size=args.kmer_size, workers=args.workers)
+        out_files = bait.filter(args.input_files, args.out_dir)
+    except InputError as e:
+        sys.exit("! ERROR: {}".format(e))
+    eprint(bait.to_dict())
+    print("\n".join(out_files))
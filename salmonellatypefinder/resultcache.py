@@ -0,0 +1,338 @@
+#!/usr/bin/env python3
+
+import hashlib
+import json
+import os
+import shutil
+import socket
+import sys
+import tempfile
+import threading
+import time
+
+
+def eprint(*args, **kwargs):
+    print(*args, file=sys.stderr, **kwargs)
+
+
+class CacheLock():
+    ''' Lock file that is safe to use from several processes and nodes
+        sharing the same filesystem. The lock is taken by creating the lock
+        file with O_CREAT | O_EXCL, which is atomic on local filesystems and
+        on NFS v3 and later. The lock file is touched every stale_after / 4
+        seconds while the lock is held, so one older than stale_after
+        seconds is regarded as left behind by a crashed process and removed.
+    '''
+
+    def __init__(self, path, timeout=600, stale_after=3600):
+        self.path = path
+        self.timeout = timeout
+        self.stale_after = stale_after
+        self.released = threading.Event()
+        self.toucher = None
+
+    def __enter__(self):
+        start = time.time()
+        while(True):
+            try:
+                fd = os.open(self.path, os.O_CREAT | os.O_EXCL | os.O_WRONLY,
+                             0o644)
+            except FileExistsError:
+                self.remove_if_stale()
+                if(time.time() - start > self.timeout):
+                    raise TimeoutError("Unable to acquire cache lock: {}"
+                                       .format(self.path))
+                time.sleep(0.1)
+                continue
+            with os.fdopen(fd, "w") as lock_fh:
+                lock_fh.write("{}:{}\n".format(socket.gethostname(),
+                                               os.getpid()))
+            self.released.clear()
+            self.toucher = threading.Thread(target=self.touch, daemon=True)
+            self.toucher.start()
+            return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.released.set()
+        self.toucher.join()
+        try:
+            os.remove(self.path)
+        except FileNotFoundError:
+            pass
+
+    def touch(self):
+        ''' Keeps the lock file fresh until the lock is released.
+        '''
+        while(not self.released.wait(self.stale_after / 4)):
+            try:
+                os.utime(self.path)
+            except FileNotFoundError:
+                return
+
+    def remove_if_stale(self):
+        ''' Removes a stale lock file. The lock file is first renamed to a
+            name of its own, so when several processes find the lock stale,
+            only one of them removes it. The age is checked again after the
+            rename, as the lock may have been broken and taken by another
+            process in between, in which case it is put back.
+        '''
+        try:
+            age = time.time() - os.path.getmtime(self.path)
+        except FileNotFoundError:
+            return
+        if(age <= self.stale_after):
+            return
+        stale_path = "{}.stale.{}.{}".format(self.path, socket.gethostname(),
+                                             os.getpid())
+        try:
+            os.rename(self.path, stale_path)
+        except FileNotFoundError:
+            # Released, or removed by another process.
+            return
+        try:
+            if(time.time() - os.path.getmtime(stale_path) > self.stale_after):
+                eprint("Removing stale cache lock: {}".format(self.path))
+            else:
+                # Unlike a rename, a link does not replace a lock taken
+                # since.
+                os.link(stale_path, self.path)
+        except FileExistsError:
+            pass
+        finally:
+            os.remove(stale_path)
+
+
+class ResultCache():
+    ''' On-disk cache of parsed results from the external tools.
+        Entries are keyed by a fingerprint of the input file contents, the
+        tool path and version, the database identity and the arguments. A
+        cache hit means the external tool is not run at all.
+
+        Entries are written to a tmp file and renamed into place, so readers
+        never see partial entries and need no lock. Writers take a lock while
+        evicting, so only one process prunes the cache at a time.
+    '''
+
+    def __init__(self, cache_dir, max_size=None, max_age=None,
+                 evict_interval=60):
+        ''' Constructor.
+            cache_dir: Directory storing the cache. Can be shared by several
+                       processes and nodes.
+            max_size: Max. total size of the cache entries in bytes. The
+                      least recently used entries are removed first.
+            max_age: Entries not used for max_age seconds are removed.
+            evict_interval: Min. number of seconds between evictions.
+        '''
+        self.cache_dir = os.path.abspath(cache_dir)
+        self.entry_dir = os.path.join(self.cache_dir, "entries")
+        self.fingerprint_dir = os.path.join(self.cache_dir, "fingerprints")
+        self.max_size = max_size
+        self.max_age = max_age
+        self.evict_interval = evict_interval
+
+        os.makedirs(self.entry_dir, exist_ok=True)
+        os.makedirs(self.fingerprint_dir, exist_ok=True)
+
+    def key(self, tool, tool_paths, db_path, files, args):
+        ''' Returns the cache key for a tool call.
+            tool: Name of the tool, ex. "cgemlst".
+            tool_paths: List of paths to the tool and the programs it
+                        depends on. The content of each program is part of
+                        the key, so an upgrade gives new keys.
+            db_path: Database file or directory used by the tool or None.
+            files: Input files. The content of each file is part of the key.
+            args: List of the arguments that change the result of the tool.
+        '''
+        key_data = {
+            "tool": tool,
+            "tool_paths": [self.tool_fingerprint(path)
+                           for path in tool_paths],
+            "db": self.db_fingerprint(db_path),
+            "files": [self.file_fingerprint(path) for path in files],
+            "args": [str(arg) for arg in args]
+        }
+        key_json = json.dumps(key_data, sort_keys=True)
+        return hashlib.sha256(key_json.encode("utf-8")).hexdigest()
+
+    def get(self, key):
+        ''' Returns the cached result stored with key or None if the key is
+            not found.
+        '''
+        entry_path = self.entry_path(key)
+        try:
+            with open(entry_path, "r", encoding="utf-8") as entry_fh:
+                entry = json.load(entry_fh)
+        except (FileNotFoundError, ValueError):
+            return None
+        # The modification time marks the last use of the entry.
+        try:
+            os.utime(entry_path)
+        except OSError:
+            pass
+        if(not isinstance(entry, dict) or "result" not in entry):
+            return None
+        return entry["result"]
+
+    def put(self, key, result):
+        ''' Stores the JSON serializable result with key.
+        '''
+        entry_path = self.entry_path(key)
+        entry = {
+            "created": time.time(),
+            "result": result
+        }
+        self.write_atomic(entry_path, json.dumps(entry))
+        self.evict()
+
+    def entry_path(self, key):
+        return os.path.join(self.entry_dir, key[:2], key + ".json")
+
+    @staticmethod
+    def write_atomic(path, txt):
+        ''' Writes txt to path by renaming a tmp file into place.
+        '''
+        dir_path = os.path.dirname(path)
+        os.makedirs(dir_path, exist_ok=True)
+        fd, tmp_path = tempfile.mkstemp(dir=dir_path, prefix=".tmp_")
+        try:
+            with os.fdopen(fd, "w", encoding="utf-8") as tmp_fh:
+                tmp_fh.write(txt)
+            os.replace(tmp_path, path)
+        except BaseException:
+            os.remove(tmp_path)
+            raise
+
+    def evict(self, force=False):
+        ''' Removes entries older than max_age and, if the cache is larger
+            than max_size, the least recently used entries until the cache
+            fits. Unless forced, eviction is skipped if another process
+            evicted less than evict_interval seconds ago.
+        '''
+        if(self.max_size is None and self.max_age is None):
+            return
+
+        stamp_path = os.path.join(self.cache_dir, "last_eviction")
+        if(not force):
+            try:
+                last_eviction = os.path.getmtime(stamp_path)
+                if(time.time() - last_eviction < self.evict_interval):
+                    return
+            except FileNotFoundError:
+                pass
+
+        lock_path = os.path.join(self.cache_dir, "evict.lock")
+        try:
+            with CacheLock(lock_path, timeout=0):
+                with open(stamp_path, "w") as stamp_fh:
+                    stamp_fh.write("{}\n".format(time.time()))
+                self._evict()
+        except TimeoutError:
+            # Another process is evicting.
+            return
+
+    def _evict(self):
+        now = time.time()
+        entries = []
+        # The stored file checksums are evicted along with the results.
+        for cache_subdir in (self.entry_dir, self.fingerprint_dir):
+            for dir_path, dir_names, file_names in os.walk(cache_subdir):
+                for file_name in file_names:
+                    # Skip tmp files being written by other processes.
+                    if(file_name.startswith(".tmp_")):
+                        continue
+                    path = os.path.join(dir_path, file_name)
+                    try:
+                        stat = os.stat(path)
+                    except FileNotFoundError:
+                        continue
+                    entries.append((stat.st_mtime, stat.st_size, path))
+
+        entries.sort()
+        total_size = sum(size for mtime, size, path in entries)
+
+        for mtime, size, path in entries:
+            too_old = (self.max_age is not None
+                       and now - mtime > self.max_age)
+            too_big = (self.max_size is not None
+                       and total_size > self.max_size)
+            if(not too_old and not too_big):
+                continue
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+            total_size -= size
+
+    def file_fingerprint(self, path):
+        ''' Returns the SHA-256 of the content of the file at path.
+            The checksum is stored in the cache together with the size, mtime
+            and inode of the file, so an unchanged file is only read once.
+        '''
+        path = os.path.realpath(path)
+        stat = os.stat(path)
+        stat_key = "{}\t{}\t{}\t{}".format(path, stat.st_size,
+                                           stat.st_mtime_ns, stat.st_ino)
+        stat_hash = hashlib.sha256(stat_key.encode("utf-8")).hexdigest()
+        memo_path = os.path.join(self.fingerprint_dir, stat_hash[:2],
+                                 stat_hash)
+        try:
+            with open(memo_path, "r") as memo_fh:
+                checksum = memo_fh.read().strip()
+            if(checksum):
+                return checksum
+        except FileNotFoundError:
+            pass
+
+        sha256 = hashlib.sha256()
+        with open(path, "rb") as file_fh:
+            for chunk in iter(lambda: file_fh.read(1024 * 1024), b""):
+                sha256.update(chunk)
+        checksum = sha256.hexdigest()
+        self.write_atomic(memo_path, checksum + "\n")
+        return checksum
+
+    def tool_fingerprint(self, path):
+        ''' Returns a fingerprint of a program. Programs given without a dir
+            part are searched for in PATH. The fingerprint is the checksum of
+            the program, which changes whenever the program is upgraded.
+        '''
+        if(path is None):
+            return None
+        if(not os.path.dirname(path)):
+            found_path = shutil.which(path)
+            if(found_path is None):
+                return path
+            path = found_path
+        if(not os.path.isfile(path)):
+            return path
+        return self.file_fingerprint(path)
+
+    @staticmethod
+    def db_fingerprint(path):
+        ''' Returns a fingerprint of a database file or directory, made from
+            the relative paths, sizes and modification times of its files.
+        '''
+        if(path is None):
+            return None
+        path = os.path.realpath(path)
+        if(os.path.isfile(path)):
+            stat = os.stat(path)
+            return "{}\t{}\t{}".format(path, stat.st_size, stat.st_mtime_ns)
+
+        sha256 = hashlib.sha256(path.encode("utf-8"))
+        for dir_path, dir_names, file_names in os.walk(path):
+            dir_names.sort()
+            # Skip version control data.
+            if(".git" in dir_names):
+                dir_names.remove(".git")
+            for file_name in sorted(file_names):
+                file_path = os.path.join(dir_path, file_name)
+                try:
+                    stat = os.stat(file_path)
+                except FileNotFoundError:
+                    continue
+                rel_path = os.path.relpath(file_path, path)
+                sha256.update("{}\t{}\t{}\n".format(rel_path, stat.st_size,
+                                                    stat.st_mtime_ns)
+                              .encode("utf-8"))
+        return sha256.hexdigest()
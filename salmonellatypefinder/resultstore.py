@@ -0,0 +1,383 @@
+#!/usr/bin/env python3
+
+import datetime
+import hashlib
+import json
+import os
+import shutil
+import socket
+import sqlite3
+import sys
+import time
+import uuid
+
+from .outputparser import Parser
+from .tracing import span
+
+
+def eprint(*args, **kwargs):
+    print(*args, file=sys.stderr, **kwargs)
+
+
+SCHEMA_VERSION = 1
+
+# Queries usually select a serotype or ST within a range of run dates, so
+# the run date is part of those indexes.
+SCHEMA = '''
+CREATE TABLE IF NOT EXISTS runs (
+    run_id TEXT PRIMARY KEY,
+    started REAL NOT NULL,
+    run_date TEXT NOT NULL,
+    host TEXT,
+    command TEXT,
+    tool_versions TEXT
+);
+CREATE TABLE IF NOT EXISTS samples (
+    id INTEGER PRIMARY KEY,
+    run_id TEXT NOT NULL REFERENCES runs(run_id),
+    run_date TEXT NOT NULL,
+    typed_at REAL NOT NULL,
+    sample TEXT NOT NULL,
+    files TEXT,
+    predicted_serotype TEXT,
+    st INTEGER,
+    st_text TEXT,
+    st_sero_prediction TEXT,
+    seqsero_prediction TEXT,
+    o_type TEXT,
+    h1_type TEXT,
+    h2_type TEXT,
+    flagged INTEGER NOT NULL,
+    mlst_method TEXT,
+    sero_method TEXT,
+    mlst_cmd TEXT,
+    seqsero_cmd TEXT,
+    timings TEXT,
+    tsv TEXT NOT NULL,
+    result TEXT NOT NULL
+);
+CREATE TABLE IF NOT EXISTS mlst_serotypes (
+    sample_id INTEGER NOT NULL REFERENCES samples(id),
+    serotype TEXT NOT NULL,
+    count INTEGER,
+    total INTEGER,
+    frac REAL
+);
+CREATE INDEX IF NOT EXISTS samples_st ON samples(st, run_date);
+CREATE INDEX IF NOT EXISTS samples_serotype
+    ON samples(predicted_serotype COLLATE NOCASE, run_date);
+CREATE INDEX IF NOT EXISTS samples_run_date ON samples(run_date);
+CREATE INDEX IF NOT EXISTS samples_sample ON samples(sample);
+CREATE INDEX IF NOT EXISTS mlst_serotypes_sample
+    ON mlst_serotypes(sample_id);
+'''
+
+
+def connect(db_path, timeout=60):
+    ''' Opens the database, and creates the tables if they do not exist.
+        Several runs can write to the same database; writers wait up to
+        timeout seconds for each other.
+    '''
+    conn = sqlite3.connect(db_path, timeout=timeout)
+    conn.execute("PRAGMA journal_mode=WAL")
+    version = conn.execute("PRAGMA user_version").fetchone()[0]
+    if(version > SCHEMA_VERSION):
+        conn.close()
+        sys.exit("! ERROR: Results database {} was written by a newer "
+                 "version (schema {})".format(db_path, version))
+    if(version < SCHEMA_VERSION):
+        with conn:
+            conn.executescript(SCHEMA)
+            conn.execute("PRAGMA user_version = {}".format(SCHEMA_VERSION))
+    return conn
+
+
+def tool_versions(tools):
+    ''' None of the tools report a version that can be relied on, so a tool
+        is identified by its path and the checksum of its content, which
+        changes whenever it is upgraded. Databases that are dirs are
+        identified by their path only.
+        tools: dict name --> path. Paths without a dir part are searched
+               for in PATH.
+        RETURN: dict name --> {"path": path, "sha256": checksum or None}
+    '''
+    versions = {}
+    for name, path in sorted(tools.items()):
+        if(path is None):
+            continue
+        if(not os.path.dirname(path)):
+            path = shutil.which(path) or path
+        checksum = None
+        if(os.path.isfile(path)):
+            sha256 = hashlib.sha256()
+            with open(path, "rb") as tool_fh:
+                for chunk in iter(lambda: tool_fh.read(1024 * 1024), b""):
+                    sha256.update(chunk)
+            checksum = sha256.hexdigest()
+        versions[name] = {"path": path, "sha256": checksum}
+    return versions
+
+
+class ResultStore():
+    ''' Stores the results of every TypingProfile of a run in a SQLite
+        database, see SCHEMA. Results are kept in memory and written in one
+        transaction for every batch_size results, or when batch_seconds have
+        passed since the last write, and when the store is closed.
+        Used as a context manager.
+    '''
+
+    def __init__(self, db_path, tools=None, command=None, batch_size=500,
+                 batch_seconds=5, tracer=None):
+        ''' Constructor.
+            db_path: SQLite database. Created if it does not exist.
+            tools: dict name --> path of the tools and databases used by the
+                   run, see tool_versions.
+            command: Command line of the run.
+            tracer: Tracer object. If given, the time spent writing each
+                    batch is recorded.
+        '''
+        self.db_path = db_path
+        self.batch_size = batch_size
+        self.batch_seconds = batch_seconds
+        self.tracer = tracer
+        self.rows = []
+        self.last_write = time.monotonic()
+        self.count = 0
+
+        self.run_id = uuid.uuid4().hex
+        started = time.time()
+        self.run_date = datetime.date.fromtimestamp(started).isoformat()
+        self.conn = connect(db_path)
+        with self.conn:
+            self.conn.execute(
+                "INSERT INTO runs VALUES (?, ?, ?, ?, ?, ?)",
+                (self.run_id, started, self.run_date, socket.gethostname(),
+                 command, json.dumps(tool_versions(tools or {}))))
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def write(self, profile):
+        result = Parser.profile2dict(profile)
+        st = result["st"]
+        self.rows.append((
+            time.time(),
+            profile.sample_name,
+            json.dumps(result["files"]),
+            result["predicted_serotype"],
+            st if(isinstance(st, int)) else None,
+            None if(st is None) else str(st),
+            result["st_sero_prediction"],
+            result["seqsero_prediction"],
+            result["o_type"],
+            result["h1_type"],
+            result["h2_type"],
+            1 if(result["flagged"]) else 0,
+            profile.mlst.method,
+            profile.kauffmanwhite.method,
+            result["mlst_cmd"],
+            result["seqsero_cmd"],
+            json.dumps(result["timings"]),
+            Parser.profile2txt(profile),
+            json.dumps(result),
+            result["mlst_serotype_details"]
+        ))
+        if(len(self.rows) >= self.batch_size
+           or time.monotonic() - self.last_write >= self.batch_seconds):
+            self.flush()
+
+    def flush(self):
+        ''' Writes the results kept in memory in one transaction.
+        '''
+        self.last_write = time.monotonic()
+        if(not self.rows):
+            return
+        with span(self.tracer, "store.write"):
+            with self.conn:
+                for row in self.rows:
+                    cursor = self.conn.execute(
+                        "INSERT INTO samples (run_id, run_date, typed_at, "
+                        "sample, files, predicted_serotype, st, st_text, "
+                        "st_sero_prediction, seqsero_prediction, o_type, "
+                        "h1_type, h2_type, flagged, mlst_method, "
+                        "sero_method, mlst_cmd, seqsero_cmd, timings, tsv, "
+                        "result) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, "
+                        "?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                        (self.run_id, self.run_date) + row[:-1])
+                    self.conn.executemany(
+                        "INSERT INTO mlst_serotypes VALUES (?, ?, ?, ?, ?)",
+                        [(cursor.lastrowid, detail["serotype"],
+                          detail["count"], detail["total"], detail["frac"])
+                         for detail in row[-1]])
+        self.count += len(self.rows)
+        self.rows = []
+
+    def close(self):
+        if(self.conn is None):
+            return
+        self.flush()
+        # Updates the statistics the query planner uses to pick an index.
+        self.conn.execute("PRAGMA optimize")
+        self.conn.close()
+        self.conn = None
+
+
+def query(conn, serotype=None, st=None, since=None, until=None, sample=None,
+          flagged=None, run_id=None, mlst_serotype=None, columns="*",
+          limit=None):
+    ''' Selects samples. All conditions given must hold.
+        serotype: Predicted serotype, case insensitive.
+        st: List of STs.
+        since, until: First and last run date, YYYY-MM-DD.
+        sample: Sample name, "*" matches any text.
+        flagged: True or False to select flagged or unflagged samples.
+        mlst_serotype: Serotype found among the isolates of the ST in the
+                       MLST database, case insensitive.
+        RETURN: sqlite3 cursor over the rows, in the order they were stored.
+    '''
+    conditions = []
+    params = []
+    if(serotype is not None):
+        conditions.append("predicted_serotype = ? COLLATE NOCASE")
+        params.append(serotype)
+    if(st):
+        conditions.append("st IN ({})".format(", ".join("?" * len(st))))
+        params += list(st)
+    if(since is not None):
+        conditions.append("run_date >= ?")
+        params.append(since)
+    if(until is not None):
+        conditions.append("run_date <= ?")
+        params.append(until)
+    if(sample is not None):
+        conditions.append("sample GLOB ?")
+        params.append(sample)
+    if(flagged is not None):
+        conditions.append("flagged = ?")
+        params.append(1 if(flagged) else 0)
+    if(run_id is not None):
+        conditions.append("run_id = ?")
+        params.append(run_id)
+    if(mlst_serotype is not None):
+        conditions.append("id IN (SELECT sample_id FROM mlst_serotypes "
+                          "WHERE serotype = ? COLLATE NOCASE)")
+        params.append(mlst_serotype)
+
+    sql = "SELECT {} FROM samples".format(columns)
+    if(conditions):
+        sql += " WHERE " + " AND ".join(conditions)
+    if(columns != "count(*)"):
+        sql += " ORDER BY id"
+    if(limit is not None):
+        sql += " LIMIT ?"
+        params.append(limit)
+    return conn.execute(sql, params)
+
+
+def iso_date(text):
+    try:
+        return datetime.date.fromisoformat(text).isoformat()
+    except ValueError:
+        raise ValueError("Not a date (YYYY-MM-DD): {}".format(text))
+
+
+def query_main(argv=None):
+    ''' Command line of "SalmonellaTypeFinder.py query".
+        RETURN: Exit code.
+    '''
+    import argparse
+
+    #
+    # Handling arguments
+    #
+    parser = argparse.ArgumentParser(
+        prog="SalmonellaTypeFinder.py query",
+        description="Select typed samples from a results database written\
+            with --store, and write them in the output format of\
+            SalmonellaTypeFinder.")
+    # Posotional arguments
+    parser.add_argument("db",
+                        help="Results database.",
+                        metavar="DB")
+    parser.add_argument("--serotype",
+                        help="Predicted serotype, case insensitive.",
+                        default=None)
+    parser.add_argument("--st",
+                        help="ST. Can be given several times.",
+                        type=int,
+                        action="append",
+                        default=[])
+    parser.add_argument("--since",
+                        help="First run date, YYYY-MM-DD.",
+                        type=iso_date,
+                        default=None)
+    parser.add_argument("--until",
+                        help="Last run date, YYYY-MM-DD.",
+                        type=iso_date,
+                        default=None)
+    parser.add_argument("--sample",
+                        help="Sample name. '*' matches any text.",
+                        default=None)
+    parser.add_argument("--mlst_serotype",
+                        help="Serotype among the isolates of the ST in the\
+                              MLST database, case insensitive.",
+                        default=None)
+    parser.add_argument("--flagged",
+                        help="Only flagged samples.",
+                        action="store_true",
+                        default=None)
+    parser.add_argument("--run",
+                        help="Run id.",
+                        default=None)
+    parser.add_argument("--limit",
+                        help="Max. number of samples.",
+                        type=int,
+                        default=None)
+    parser.add_argument("--out_format",
+                        help="'tsv' is the table written by\
+                              SalmonellaTypeFinder, 'jsonl' one JSON object\
+                              per sample, 'count' the number of samples.\
+                              Default: tsv",
+                        choices=["tsv", "jsonl", "count"],
+                        default="tsv")
+    parser.add_argument("-o", "--output",
+                        help="Output file. Default: stdout",
+                        default=None)
+
+    args = parser.parse_args(argv)
+
+    if(not os.path.isfile(args.db)):
+        sys.exit("! ERROR: Results database not found: {}".format(args.db))
+
+    conn = connect(args.db)
+    columns = {"tsv": "tsv", "jsonl": "result", "count": "count(*)"}
+    rows = query(conn, serotype=args.serotype, st=args.st, since=args.since,
+                 until=args.until, sample=args.sample, flagged=args.flagged,
+                 run_id=args.run, mlst_serotype=args.mlst_serotype,
+                 columns=columns[args.out_format], limit=args.limit)
+
+    out_fh = sys.stdout
+    if(args.output):
+        out_fh = open(args.output, "w", encoding="utf-8")
+    try:
+        if(args.out_format == "count"):
+            out_fh.write("{}\n".format(rows.fetchone()[0]))
+        else:
+            if(args.out_format == "tsv"):
+                out_fh.write(Parser.header_txt())
+            for (line,) in rows:
+                out_fh.write(line if(args.out_format == "tsv")
+                             else line + "\n")
+    finally:
+        if(out_fh is not sys.stdout):
+            out_fh.close()
+        conn.close()
+
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(query_main())
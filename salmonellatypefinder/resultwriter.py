@@ -0,0 +1,140 @@
+#!/usr/bin/env python3
+
+import gzip
+import json
+import sys
+import zlib
+
+from .outputparser import Parser
+from .tracing import span
+
+
+class ResultWriter():
+    ''' Writes TypingProfile results one sample at a time. Every row is
+        flushed as soon as it is written, so memory use does not grow with
+        the number of samples and finished rows survive a crashed batch.
+
+        Formats:
+            tsv: Same output as Parser.output_txt.
+            jsonl: One JSON object per line, see Parser.profile2dict.
+    '''
+
+    FORMATS = ("tsv", "jsonl")
+
+    def __init__(self, path=None, out_format="tsv", compress=False,
+                 shard_size=None, headers=True, tracer=None):
+        ''' Constructor.
+            path: Output file. If None, results are written to stdout.
+            out_format: "tsv" or "jsonl".
+            compress: Write gzip compressed output. ".gz" is appended to
+                      the path unless it is already there.
+            shard_size: If given, a new output file is started for every
+                        shard_size samples. The shards are named
+                        <path>.<shard no.>, ex. results.txt.00001.
+            headers: Write the header line at the top of each TSV file.
+            tracer: Tracer object. If given, the time spent writing each
+                    result is recorded.
+        '''
+        if(out_format not in self.FORMATS):
+            raise ValueError("Unknown output format: {}".format(out_format))
+        if(path is None and (compress or shard_size)):
+            raise ValueError("Compressed and sharded output needs a path.")
+
+        self.path = path
+        self.out_format = out_format
+        self.compress = compress
+        self.shard_size = shard_size
+        self.headers = headers
+        self.tracer = tracer
+        self.out_fh = None
+        self.shard_no = 0
+        self.rows_in_shard = 0
+        self.rows = 0
+        self.paths = []
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def shard_path(self):
+        path = self.path
+        if(self.shard_size):
+            path = "{}.{:05d}".format(path, self.shard_no)
+        if(self.compress and not path.endswith(".gz")):
+            path += ".gz"
+        return path
+
+    def open_next(self):
+        ''' Closes the current output file and opens the next.
+        '''
+        self.close_current()
+        self.shard_no += 1
+        self.rows_in_shard = 0
+
+        if(self.path is None):
+            self.out_fh = sys.stdout
+        else:
+            path = self.shard_path()
+            if(self.compress):
+                self.out_fh = gzip.open(path, "wt", encoding="utf-8")
+            else:
+                self.out_fh = open(path, "w", encoding="utf-8")
+            self.paths.append(path)
+
+        if(self.headers and self.out_format == "tsv"):
+            self.out_fh.write(Parser.header_txt())
+            self.flush()
+
+    def write(self, profile):
+        ''' Writes and flushes the result of a single TypingProfile.
+        '''
+        if(self.out_format == "tsv"):
+            self.write_result(txt=Parser.profile2txt(profile),
+                              sample=profile.sample_name)
+        else:
+            self.write_result(result=Parser.profile2dict(profile),
+                              sample=profile.sample_name)
+
+    def write_result(self, txt=None, result=None, sample=None):
+        ''' Writes and flushes a result that has already been formatted,
+            ex. one read back from a BatchJournal.
+            txt: Output line, see Parser.profile2txt. Used by tsv.
+            result: Result dict, see Parser.profile2dict. Used by jsonl.
+        '''
+        if(self.out_fh is None
+           or (self.shard_size and self.rows_in_shard >= self.shard_size)):
+            self.open_next()
+
+        with span(self.tracer, "output.write", sample=sample):
+            if(self.out_format == "tsv"):
+                self.out_fh.write(txt)
+            else:
+                self.out_fh.write(json.dumps(result) + "\n")
+            self.flush()
+
+        self.rows_in_shard += 1
+        self.rows += 1
+
+    def flush(self):
+        self.out_fh.flush()
+        # Makes everything written so far decompressible, even if the gzip
+        # file is never closed.
+        if(self.compress):
+            self.out_fh.buffer.flush(zlib.Z_SYNC_FLUSH)
+
+    def close(self):
+        ''' Closes the current output file. If no rows have been written,
+            an output file with only the header is created.
+        '''
+        if(self.out_fh is None and self.shard_no == 0):
+            self.open_next()
+        self.close_current()
+
+    def close_current(self):
+        if(self.out_fh is None):
+            return
+        if(self.out_fh is not sys.stdout):
+            self.out_fh.close()
+        self.out_fh = None
@@ -0,0 +1,388 @@
+#!/usr/bin/env python3
+
+import json
+import multiprocessing
+import multiprocessing.forkserver
+import os
+import queue
+import signal
+import socketserver
+import sys
+import threading
+import time
+import uuid
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from .mlst2serotype import MLST2Serotype
+from .outputparser import Parser
+from .toolrunner import kill_running_tools
+from .typingprofile import TypingProfile
+
+
+def eprint(*args, **kwargs):
+    print(*args, file=sys.stderr, **kwargs)
+
+
+class Job():
+    ''' A typing job submitted to the server.
+        state: queued, running, done, failed or cancelled.
+    '''
+
+    def __init__(self, files, seqtype="paired", mlst=None, sample_name=None):
+        self.id = uuid.uuid4().hex
+        self.files = files
+        self.seqtype = seqtype
+        self.mlst = mlst
+        self.sample_name = sample_name
+        self.state = "queued"
+        self.result = None
+        self.error = None
+        self.submitted = time.time()
+        self.started = None
+        self.finished = None
+        self.process = None
+
+    def to_dict(self):
+        return {
+            "id": self.id,
+            "state": self.state,
+            "files": self.files,
+            "seq_type": self.seqtype,
+            "sample_name": self.sample_name,
+            "submitted": self.submitted,
+            "started": self.started,
+            "finished": self.finished,
+            "error": self.error,
+            "result": self.result
+        }
+
+
+def run_job(conn, job, serotyper, tmp_dir, typing_options):
+    ''' Runs in a process started by the fork server. The process starts a
+        new session, so a cancelled job can be stopped by killing its
+        process group. The tools run in sessions of their own, so they are
+        killed when the job gets SIGTERM.
+    '''
+    def handle_sigterm(signum, frame):
+        kill_running_tools()
+        raise SystemExit("Cancelled")
+    signal.signal(signal.SIGTERM, handle_sigterm)
+    os.setsid()
+    try:
+        profile = TypingProfile(files=job.files,
+                                mlst2serotype=serotyper,
+                                seqtype=job.seqtype,
+                                mlst=job.mlst,
+                                tmp_dir=os.path.join(tmp_dir, job.id),
+                                sample_name=job.sample_name,
+                                **typing_options)
+        conn.send(("done", Parser.profile2dict(profile)))
+    except BaseException as e:
+        conn.send(("failed", "{}: {}".format(type(e).__name__, e)))
+    finally:
+        conn.close()
+
+
+class TypingServer():
+    ''' Keeps the MLST database and the tool configuration resident and runs
+        typing jobs on at most "workers" processes at a time. Each job is run
+        in a process forked from a single threaded fork server, not from the
+        server, whose HTTP and dispatch threads may hold locks at fork time
+        that would stay locked in the child. The database is sent to the
+        job; a compiled index (db.idx) is only reopened, not copied.
+    '''
+
+    def __init__(self, serotyper_options, tmp_dir, workers=None,
+                 max_finished_jobs=10000, **typing_options):
+        ''' Constructor.
+            serotyper_options: Keyword arguments for MLST2Serotype. Used
+                               again when the database is reloaded.
+            tmp_dir: Each job gets a tmp dir inside tmp_dir.
+            workers: Max. number of jobs running at the same time.
+            max_finished_jobs: Number of finished jobs kept for status
+                               requests.
+            typing_options: Keyword arguments for TypingProfile.
+        '''
+        self.serotyper_options = dict(serotyper_options)
+        self.serotyper = MLST2Serotype(**self.serotyper_options)
+        self.tmp_dir = tmp_dir
+        self.typing_options = typing_options
+        self.max_finished_jobs = max_finished_jobs
+        self.workers = workers or os.cpu_count() or 1
+
+        self.jobs = {}
+        self.finished_jobs = []
+        self.lock = threading.Lock()
+        self.queue = queue.Queue()
+        self.mp_context = multiprocessing.get_context("forkserver")
+        self.mp_context.set_forkserver_preload([
+            "salmonellatypefinder.server"])
+        # The fork server is started before the dispatch threads.
+        multiprocessing.forkserver.ensure_running()
+
+        for i in range(self.workers):
+            thread = threading.Thread(target=self.dispatch, daemon=True)
+            thread.start()
+
+    def submit(self, files, seqtype="paired", mlst=None, sample_name=None):
+        for filepath in files:
+            if(not os.path.isfile(filepath)):
+                raise ValueError("Unable to locate input file: {}"
+                                 .format(filepath))
+        if(seqtype not in ("paired", "single", "assembled")):
+            raise ValueError("Unknown seq type: {}".format(seqtype))
+        if(seqtype == "paired" and len(files) != 2):
+            raise ValueError("Paired data needs two input files.")
+        if(mlst is not None):
+            try:
+                mlst = int(str(mlst))
+            except ValueError:
+                raise ValueError("ST must be an integer: {}".format(mlst))
+
+        job = Job(files, seqtype=seqtype, mlst=mlst, sample_name=sample_name)
+        with self.lock:
+            self.jobs[job.id] = job
+        self.queue.put(job)
+        return job
+
+    def get(self, job_id):
+        with self.lock:
+            return self.jobs.get(job_id)
+
+    def cancel(self, job_id):
+        ''' Cancels a queued or running job. A running job is stopped by
+            killing its process group.
+        '''
+        with self.lock:
+            job = self.jobs.get(job_id)
+            if(job is None or job.state not in ("queued", "running")):
+                return job
+            job.state = "cancelled"
+            job.finished = time.time()
+            process = job.process
+        if(process is not None):
+            self.kill(process)
+        return job
+
+    @staticmethod
+    def kill(process):
+        ''' Kills the process group of a job. A job that has not started its
+            session yet has no process group, and has not started any tools,
+            so the process itself is killed.
+        '''
+        try:
+            os.killpg(process.pid, signal.SIGTERM)
+        except ProcessLookupError:
+            process.kill()
+
+    def forget_finished(self, job):
+        ''' Adds a job to the finished jobs, and forgets the oldest. Called
+            with self.lock held.
+        '''
+        self.finished_jobs.append(job.id)
+        while(len(self.finished_jobs) > self.max_finished_jobs):
+            self.jobs.pop(self.finished_jobs.pop(0), None)
+
+    def reload(self, mlst_db=None):
+        ''' Loads the MLST database again, from mlst_db if given. Jobs
+            started after the reload use the new database.
+        '''
+        serotyper_options = dict(self.serotyper_options)
+        if(mlst_db):
+            serotyper_options["json_file"] = mlst_db
+        serotyper = MLST2Serotype(**serotyper_options)
+        with self.lock:
+            self.serotyper = serotyper
+            self.serotyper_options = serotyper_options
+        return serotyper_options["json_file"]
+
+    def dispatch(self):
+        ''' Worker thread. Runs queued jobs one at a time.
+        '''
+        while(True):
+            job = self.queue.get()
+            with self.lock:
+                if(job.state != "queued"):
+                    # Cancelled while queued.
+                    self.forget_finished(job)
+                    continue
+                job.state = "running"
+                job.started = time.time()
+                serotyper = self.serotyper
+            recv_conn, send_conn = self.mp_context.Pipe(duplex=False)
+            process = self.mp_context.Process(
+                target=run_job, args=(send_conn, job, serotyper,
+                                      self.tmp_dir, self.typing_options))
+            process.start()
+            with self.lock:
+                job.process = process
+                cancelled = (job.state == "cancelled")
+            send_conn.close()
+            # Cancelled while the process was started.
+            if(cancelled):
+                self.kill(process)
+
+            try:
+                state, result = recv_conn.recv()
+            except EOFError:
+                state, result = ("failed", "Job process exited with code {}"
+                                 .format(process.exitcode))
+            recv_conn.close()
+            process.join()
+
+            with self.lock:
+                job.process = None
+                if(job.state == "running"):
+                    job.state = state
+                    job.finished = time.time()
+                    if(state == "done"):
+                        job.result = result
+                    else:
+                        job.error = result
+                self.forget_finished(job)
+
+
+class RequestHandler(BaseHTTPRequestHandler):
+    ''' JSON API:
+            POST   /jobs            Submit a job. Body: {"files": [...],
+                                    "seq_type": "paired", "mlst": null,
+                                    "sample_name": null}
+            GET    /jobs            List jobs.
+            GET    /jobs/<id>       Job status and result.
+            DELETE /jobs/<id>       Cancel a job.
+            POST   /reload          Reload the MLST database. Body
+                                    (optional): {"mlst_db": "path"}
+            GET    /health          Server status.
+    '''
+
+    server_version = "SalmonellaTypeFinder"
+
+    def address_string(self):
+        # Unix socket clients have no address.
+        if(not self.client_address):
+            return "unix"
+        return super().address_string()
+
+    def send_json(self, status, data):
+        body = json.dumps(data).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def read_json(self):
+        length = int(self.headers.get("Content-Length", 0))
+        if(not length):
+            return {}
+        return json.loads(self.rfile.read(length).decode("utf-8"))
+
+    def path_parts(self):
+        return [part for part in self.path.split("?")[0].split("/") if part]
+
+    def do_GET(self):
+        typing_server = self.server.typing_server
+        parts = self.path_parts()
+        if(parts == ["health"]):
+            self.send_json(200, {
+                "status": "ok",
+                "mlst_db": typing_server.serotyper_options["json_file"],
+                "workers": typing_server.workers,
+                "queued": typing_server.queue.qsize()
+            })
+        elif(parts == ["jobs"]):
+            with typing_server.lock:
+                jobs = [{"id": job.id, "state": job.state}
+                        for job in typing_server.jobs.values()]
+            self.send_json(200, jobs)
+        elif(len(parts) == 2 and parts[0] == "jobs"):
+            job = typing_server.get(parts[1])
+            if(job is None):
+                self.send_json(404, {"error": "Job not found"})
+            else:
+                self.send_json(200, job.to_dict())
+        else:
+            self.send_json(404, {"error": "Not found"})
+
+    def do_POST(self):
+        typing_server = self.server.typing_server
+        parts = self.path_parts()
+        try:
+            request = self.read_json()
+        except ValueError as e:
+            self.send_json(400, {"error": "Invalid JSON: {}".format(e)})
+            return
+
+        if(parts == ["jobs"]):
+            try:
+                job = typing_server.submit(
+                    files=[os.path.abspath(filepath)
+                           for filepath in request["files"]],
+                    seqtype=request.get("seq_type", "paired"),
+                    mlst=request.get("mlst"),
+                    sample_name=request.get("sample_name"))
+            except (KeyError, TypeError, ValueError) as e:
+                self.send_json(400, {"error": str(e)})
+                return
+            self.send_json(202, {"id": job.id, "state": job.state})
+        elif(parts == ["reload"]):
+            try:
+                mlst_db = typing_server.reload(request.get("mlst_db"))
+            except (OSError, ValueError, SystemExit) as e:
+                self.send_json(500, {"error": "Reload failed: {}"
+                                              .format(e)})
+                return
+            self.send_json(200, {"mlst_db": mlst_db})
+        elif(len(parts) == 3 and parts[0] == "jobs"
+             and parts[2] == "cancel"):
+            self.cancel(parts[1])
+        else:
+            self.send_json(404, {"error": "Not found"})
+
+    def do_DELETE(self):
+        parts = self.path_parts()
+        if(len(parts) == 2 and parts[0] == "jobs"):
+            self.cancel(parts[1])
+        else:
+            self.send_json(404, {"error": "Not found"})
+
+    def cancel(self, job_id):
+        job = self.server.typing_server.cancel(job_id)
+        if(job is None):
+            self.send_json(404, {"error": "Job not found"})
+        else:
+            self.send_json(200, {"id": job.id, "state": job.state})
+
+
+class UnixHTTPServer(socketserver.ThreadingMixIn,
+                     socketserver.UnixStreamServer):
+    daemon_threads = True
+
+
+def serve(address, typing_server):
+    ''' Serves the JSON API of typing_server until interrupted.
+        address: "unix:<path>" for a local Unix socket or "<host>:<port>".
+    '''
+    if(address.startswith("unix:")):
+        socket_path = address[len("unix:"):]
+        if(os.path.exists(socket_path)):
+            os.remove(socket_path)
+        httpd = UnixHTTPServer(socket_path, RequestHandler)
+    else:
+        host, port = address.rsplit(":", 1)
+        httpd = ThreadingHTTPServer((host, int(port)), RequestHandler)
+    httpd.typing_server = typing_server
+
+    def handle_sigterm(signum, frame):
+        raise KeyboardInterrupt()
+    signal.signal(signal.SIGTERM, handle_sigterm)
+
+    eprint("Serving on {}".format(address))
+    try:
+        httpd.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        httpd.server_close()
+        if(address.startswith("unix:")):
+            os.remove(address[len("unix:"):])
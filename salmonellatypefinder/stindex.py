@@ -0,0 +1,192 @@
+#!/usr/bin/env python3
+
+import json
+import mmap
+import os
+import struct
+import sys
+from array import array
+from bisect import bisect_left
+
+
+def eprint(*args, **kwargs):
+    print(*args, file=sys.stderr, **kwargs)
+
+
+class STIndex():
+    ''' Read-only, memory mapped ST --> serovar index compiled from the JSON
+        database. STs are stored as sorted integers and every ST holds its
+        serovar counts in the order of the JSON database, together with the
+        total count, the max count and the serovar with the max count
+        calculated with the mask_low_count the index was compiled with.
+
+        All processes opening the same index share the pages of the file
+        through the page cache.
+
+        Layout (native byte order, 4 byte integers):
+            header: MAGIC, byte order, mask_low_count, no. of STs,
+                    no. of entries, no. of serovars, size of serovar names
+            st_keys[no. of STs]             sorted STs
+            entry_start[no. of STs + 1]     first entry of each ST
+            totals[no. of STs]              total of counts above the mask
+            max_counts[no. of STs]          max count above the mask
+            argmax[no. of STs]              serovar id of max count or -1
+            entry_serovar[no. of entries]   serovar id of each entry
+            entry_count[no. of entries]     isolate count of each entry
+            name_start[no. of serovars + 1] offset of each serovar name
+            names                           utf-8 encoded serovar names
+    '''
+
+    MAGIC = b"STFIDX01"
+    HEADER = struct.Struct("=8s6i")
+    BYTE_ORDER = {"little": 1, "big": 2}
+
+    def __init__(self, index_file):
+        ''' Constructor. Opens and memory maps the index file.
+        '''
+        self.index_file = os.path.abspath(index_file)
+        with open(self.index_file, "rb") as index_fh:
+            self.mm = mmap.mmap(index_fh.fileno(), 0, access=mmap.ACCESS_READ)
+
+        (magic, byte_order, self.mask_low_count, n_st, n_entries,
+         n_serovars, names_size) = self.HEADER.unpack_from(self.mm, 0)
+        if(magic != self.MAGIC):
+            raise ValueError("Not an ST index file: {}"
+                             .format(self.index_file))
+        if(byte_order != self.BYTE_ORDER[sys.byteorder]):
+            raise ValueError("ST index was compiled on a machine with a "
+                             "different byte order: {}"
+                             .format(self.index_file))
+
+        view = memoryview(self.mm)
+        offset = self.HEADER.size
+
+        def int_section(length):
+            nonlocal offset
+            section = view[offset:offset + 4 * length].cast("i")
+            offset += 4 * length
+            return section
+
+        self.st_keys = int_section(n_st)
+        self.entry_start = int_section(n_st + 1)
+        self.totals = int_section(n_st)
+        self.max_counts = int_section(n_st)
+        self.argmax = int_section(n_st)
+        self.entry_serovar = int_section(n_entries)
+        self.entry_count = int_section(n_entries)
+        name_start = int_section(n_serovars + 1)
+        names = bytes(view[offset:offset + names_size])
+
+        self.serovars = [names[name_start[i]:name_start[i + 1]]
+                         .decode("utf-8")
+                         for i in range(n_serovars)]
+
+    def __reduce__(self):
+        # Worker processes reopen the file instead of receiving a copy.
+        return (STIndex, (self.index_file,))
+
+    def __len__(self):
+        return len(self.st_keys)
+
+    def find(self, st):
+        ''' Returns the position of the ST in the index or None if the ST is
+            not found.
+        '''
+        i = bisect_left(self.st_keys, st)
+        if(i < len(self.st_keys) and self.st_keys[i] == st):
+            return i
+        return None
+
+    def entries(self, i):
+        ''' Returns a list of (serovar, count) tuples of the ST at position i
+            in the order of the JSON database.
+        '''
+        return [(self.serovars[self.entry_serovar[j]], self.entry_count[j])
+                for j in range(self.entry_start[i], self.entry_start[i + 1])]
+
+    @staticmethod
+    def is_st_key(key):
+        ''' Returns True if the database key is an integer ST written the
+            way str() writes integers.
+        '''
+        try:
+            return str(int(key)) == key
+        except ValueError:
+            return False
+
+    @classmethod
+    def compile(cls, json_file, index_file, mask_low_count=2):
+        ''' Compiles the JSON database into an index file. Keys that are not
+            integer STs (ex. the "ebg" section) are not included.
+            The index is written to a tmp file and renamed into place, so
+            processes never see a partial index.
+        '''
+        with open(json_file, "r", encoding="utf-8") as json_fh:
+            data = json.load(json_fh)
+
+        st_hashes = {}
+        for key, st_hash in data.items():
+            if(not cls.is_st_key(key)):
+                eprint("Skipping non-ST key in database: '{}'".format(key))
+                continue
+            st_hashes[int(key)] = st_hash
+
+        serovar_ids = {}
+        st_keys = array("i")
+        entry_start = array("i", [0])
+        totals = array("i")
+        max_counts = array("i")
+        argmax = array("i")
+        entry_serovar = array("i")
+        entry_count = array("i")
+
+        for st in sorted(st_hashes):
+            st_hash = st_hashes[st]
+            total = 0
+            max_count = 0
+            max_serovar = -1
+            for serovar, count in st_hash.items():
+                serovar_id = serovar_ids.setdefault(serovar, len(serovar_ids))
+                entry_serovar.append(serovar_id)
+                entry_count.append(count)
+                if(count <= mask_low_count):
+                    continue
+                total += count
+                # First serovar wins if counts are equal.
+                if(count > max_count):
+                    max_count = count
+                    max_serovar = serovar_id
+            st_keys.append(st)
+            entry_start.append(len(entry_serovar))
+            totals.append(total)
+            max_counts.append(max_count)
+            argmax.append(max_serovar)
+
+        encoded_names = [serovar.encode("utf-8") for serovar in serovar_ids]
+        name_start = array("i", [0])
+        for encoded_name in encoded_names:
+            name_start.append(name_start[-1] + len(encoded_name))
+        names = b"".join(encoded_names)
+
+        header = cls.HEADER.pack(cls.MAGIC, cls.BYTE_ORDER[sys.byteorder],
+                                 mask_low_count, len(st_keys),
+                                 len(entry_serovar), len(serovar_ids),
+                                 len(names))
+
+        tmp_file = "{}.tmp{}".format(index_file, os.getpid())
+        with open(tmp_file, "wb") as index_fh:
+            index_fh.write(header)
+            for section in (st_keys, entry_start, totals, max_counts, argmax,
+                            entry_serovar, entry_count, name_start):
+                section.tofile(index_fh)
+            index_fh.write(names)
+        os.replace(tmp_file, index_file)
+
+        return len(st_keys)
+
+    @classmethod
+    def is_index_file(cls, path):
+        ''' Returns True if the file at path is a compiled ST index.
+        '''
+        with open(path, "rb") as fh:
+            return fh.read(len(cls.MAGIC)) == cls.MAGIC
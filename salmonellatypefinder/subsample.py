@@ -0,0 +1,254 @@
+#!/usr/bin/env python3
+
+import gzip
+import os
+import random
+import sys
+
+
+def eprint(*args, **kwargs):
+    print(*args, file=sys.stderr, **kwargs)
+
+
+class InputError(ValueError):
+    ''' Raised when input files are malformed, ex. a truncated FASTQ file
+        or paired files that are out of sync.
+    '''
+
+
+def open_fastq(path):
+    ''' Opens a FASTQ file in binary mode. Gzip compressed files are detected
+        by their magic bytes.
+    '''
+    with open(path, "rb") as fh:
+        magic = fh.read(2)
+    if(magic == b"\x1f\x8b"):
+        return gzip.open(path, "rb")
+    return open(path, "rb")
+
+
+def read_record(fastq_fh, path):
+    ''' RETURN: The four lines of the next FASTQ record or None at the end of
+                the file.
+    '''
+    header = fastq_fh.readline()
+    if(not header):
+        return None
+    seq = fastq_fh.readline()
+    plus = fastq_fh.readline()
+    qual = fastq_fh.readline()
+    if(not qual or header[:1] != b"@" or plus[:1] != b"+"):
+        raise InputError("Truncated or malformed FASTQ record in {}: {}"
+                         .format(path,
+                                 header.decode("utf-8", "replace").strip()))
+    return (header, seq, plus, qual)
+
+
+def read_name(header):
+    ''' Read name without the "/1" or "/2" suffix and without comments.
+    '''
+    name = header[1:].split(None, 1)[0]
+    if(name[-2:] in (b"/1", b"/2")):
+        name = name[:-2]
+    return name
+
+
+class Subsampler():
+    ''' Caps the coverage of FASTQ data. The coverage is estimated from the
+        first reads and the size of the input, then a random fraction of the
+        reads (pairs) is written out, so the input is read once and only the
+        first estimate_reads records are held in memory. Paired reads are
+        kept or dropped together.
+    '''
+
+    def __init__(self, max_coverage, genome_size=5000000, seed=11,
+                 estimate_reads=20000):
+        ''' Constructor.
+            max_coverage: Target depth. Data with a lower estimated depth is
+                          not subsampled.
+            genome_size: Genome size in bp used to estimate the depth.
+            seed: Seed of the random generator. The same input and seed gives
+                  the same output, so subsampled files can be cached.
+            estimate_reads: Number of records read to estimate the depth.
+        '''
+        self.max_coverage = max_coverage
+        self.genome_size = genome_size
+        self.seed = seed
+        self.estimate_reads = estimate_reads
+
+        self.estimated_coverage = None
+        self.fraction = 1
+        # Only counted when the data is subsampled.
+        self.reads_in = None
+        self.reads_out = None
+
+    def to_dict(self):
+        return {
+            "max_coverage": self.max_coverage,
+            "estimated_coverage": self.estimated_coverage,
+            "fraction": self.fraction,
+            "reads_in": self.reads_in,
+            "reads_out": self.reads_out
+        }
+
+    def cache_args(self):
+        ''' RETURN: The options that change the subsampled reads, part of
+                    the cache keys of the tools given the reads.
+        '''
+        return ["subsample", self.max_coverage, self.genome_size, self.seed,
+                self.estimate_reads]
+
+    def estimate_total(self, fastq_fh, path, records):
+        ''' Estimates the number of records in the file from the size of the
+            records read so far.
+        '''
+        if(isinstance(fastq_fh, gzip.GzipFile)):
+            # Compressed bytes consumed vs. decompressed bytes read. The raw
+            # file is read ahead in blocks, so this is approximate.
+            raw_pos = fastq_fh.fileobj.tell()
+            if(not raw_pos):
+                return records
+            size = fastq_fh.tell() * os.path.getsize(path) / raw_pos
+        else:
+            size = os.path.getsize(path)
+        return records * size / max(fastq_fh.tell(), 1)
+
+    def subsample(self, files, out_dir):
+        ''' Subsamples one (single-end) or two (paired-end) FASTQ files.
+            RETURN: Tuple of the files to use. The input files are returned
+                    if the estimated depth is at or below max_coverage.
+                    Raises InputError if the files are malformed.
+        '''
+        paths = list(files)
+        fastq_fhs = [open_fastq(path) for path in paths]
+        out_fhs = []
+        try:
+            # Read the first records to estimate the depth.
+            head = []
+            done = False
+            while(len(head) < self.estimate_reads):
+                records = self.read_records(fastq_fhs, paths)
+                if(records is None):
+                    done = True
+                    break
+                head.append(records)
+
+            if(not head):
+                return tuple(files)
+
+            bases = sum(len(record[1].rstrip()) for records in head
+                        for record in records)
+            total_records = len(head)
+            if(not done):
+                total_records = self.estimate_total(fastq_fhs[0], paths[0],
+                                                    len(head))
+            total_bases = bases / len(head) * total_records
+            self.estimated_coverage = total_bases / self.genome_size
+
+            if(self.estimated_coverage <= self.max_coverage):
+                return tuple(files)
+            self.fraction = self.max_coverage / self.estimated_coverage
+            self.reads_in = 0
+            self.reads_out = 0
+
+            os.makedirs(out_dir, exist_ok=True)
+            out_paths = []
+            for i, path in enumerate(paths, start=1):
+                out_path = os.path.join(out_dir, "subsample_R{}.fastq"
+                                        .format(i))
+                out_fhs.append(open(out_path, "wb"))
+                out_paths.append(out_path)
+
+            rng = random.Random(self.seed)
+            records_iter = self.iter_records(fastq_fhs, paths, head)
+            for records in records_iter:
+                self.reads_in += 1
+                if(rng.random() >= self.fraction):
+                    continue
+                self.reads_out += 1
+                for out_fh, record in zip(out_fhs, records):
+                    out_fh.writelines(record)
+
+            return tuple(out_paths)
+        finally:
+            for fh in fastq_fhs + out_fhs:
+                fh.close()
+
+    def iter_records(self, fastq_fhs, paths, head):
+        for records in head:
+            yield records
+        while(True):
+            records = self.read_records(fastq_fhs, paths)
+            if(records is None):
+                return
+            yield records
+
+    @staticmethod
+    def read_records(fastq_fhs, paths):
+        ''' RETURN: Tuple with the next record of each file, or None at the
+                    end of the files. Raises InputError if paired files are
+                    out of sync.
+        '''
+        records = tuple(read_record(fastq_fh, path)
+                        for fastq_fh, path in zip(fastq_fhs, paths))
+        if(records[0] is None):
+            if(any(records)):
+                raise InputError("Paired FASTQ files have a different number"
+                                 " of reads: {}".format(", ".join(paths)))
+            return None
+        if(len(records) > 1):
+            if(records[1] is None):
+                raise InputError("Paired FASTQ files have a different number"
+                                 " of reads: {}".format(", ".join(paths)))
+            if(read_name(records[0][0]) != read_name(records[1][0])):
+                raise InputError(
+                    "Paired FASTQ files are out of sync at read {} and {}"
+                    .format(records[0][0].decode("utf-8", "replace").strip(),
+                            records[1][0].decode("utf-8", "replace").strip()))
+        return records
+
+
+if __name__ == '__main__':
+
+    import argparse
+
+    #
+    # Handling arguments
+    #
+    parser = argparse.ArgumentParser(description="Subsample FASTQ data to a\
+        max. coverage, keeping read pairs together.")
+    # Posotional arguments
+    parser.add_argument("input_files",
+                        help="FASTQ file(s), one for single-end and two for\
+                              paired-end data. Can be gzip compressed.",
+                        nargs='+',
+                        metavar='FASTQ')
+    parser.add_argument("-o", "--out_dir",
+                        help="Output directory.",
+                        default=".")
+    parser.add_argument("-c", "--max_coverage",
+                        help="Target depth. Default: 40",
+                        type=float,
+                        default=40)
+    parser.add_argument("-g", "--genome_size",
+                        help="Genome size in bp. Default: 5000000",
+                        type=int,
+                        default=5000000)
+    parser.add_argument("--seed",
+                        help="Seed of the random generator. Default: 11",
+                        type=int,
+                        default=11)
+
+    args = parser.parse_args()
+
+    if(len(args.input_files) > 2):
+        sys.exit("! ERROR: Too many input files.")
+
+    subsampler = Subsampler(args.max_coverage, genome_size=args.genome_size,
+                            seed=args.seed)
+    try:
+        out_files = subsampler.subsample(args.input_files, args.out_dir)
+    except InputError as e:
+        sys.exit("! ERROR: {}".format(e))
+    eprint(subsampler.to_dict())
+    print("\n".join(out_files))
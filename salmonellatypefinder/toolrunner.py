@@ -0,0 +1,169 @@
+#!/usr/bin/env python3
+
+import os
+import shlex
+import signal
+from collections import deque
+
+# Process ids of the tools running in this process, see kill_running_tools.
+_running = set()
+
+
+class ToolError(Exception):
+    ''' Raised when an external tool fails or times out.
+    '''
+
+    def __init__(self, msg, cmd=None, returncode=None, stdout="", stderr=""):
+        super().__init__(msg)
+        self.cmd = cmd
+        self.returncode = returncode
+        self.stdout = stdout
+        self.stderr = stderr
+
+    def details(self):
+        ''' Returns a multi line description of the failure.
+        '''
+        lines = ["ERROR: " + str(self)]
+        if(self.cmd):
+            lines.append("CMD that failed: " + self.cmd)
+        if(self.returncode is not None):
+            lines.append("EXIT CODE: " + str(self.returncode))
+        if(self.stdout):
+            lines.append("ERROR STDOUT: " + self.stdout)
+        if(self.stderr):
+            lines.append("ERROR STDERR: " + self.stderr)
+        return "\n".join(lines)
+
+
+class ToolResult():
+    ''' Output of a finished external tool.
+        stdout is empty if the output was streamed to a line callback.
+    '''
+
+    def __init__(self, cmd, returncode, stdout, stderr):
+        self.cmd = cmd
+        self.returncode = returncode
+        self.stdout = stdout
+        self.stderr = stderr
+
+
+def cmd2string(argv):
+    ''' Returns the argv list as a string that can be pasted into a shell.
+    '''
+    return shlex.join(str(arg) for arg in argv)
+
+
+async def run_tool_async(argv, cwd=None, env=None, timeout=None,
+                         line_callback=None, tail_lines=200):
+    ''' Executes argv directly (no shell) and waits for it to finish.
+        cwd, env: Working dir and environment of the tool only.
+        timeout: Max. wall-clock seconds. On timeout the tool and everything
+                 it started is killed and reaped, and ToolError is raised.
+        line_callback: If given, every stdout line (without newline) is
+                       passed to it as it arrives, and only the last
+                       tail_lines lines are kept for error messages.
+        RETURN: ToolResult. Raises ToolError if the tool exits with a
+                non-zero exit code.
+    '''
+    # asyncio is the slowest import of the package, so it is imported when
+    # the first tool is run.
+    import asyncio
+
+    argv = [str(arg) for arg in argv]
+    cmd = cmd2string(argv)
+
+    try:
+        proc = await asyncio.create_subprocess_exec(
+            *argv, stdin=asyncio.subprocess.DEVNULL,
+            stdout=asyncio.subprocess.PIPE, stderr=asyncio.subprocess.PIPE,
+            cwd=cwd, env=env, start_new_session=True, limit=2 ** 24)
+    except OSError as e:
+        raise ToolError("Unable to execute: {}".format(e), cmd=cmd)
+    _running.add(proc.pid)
+
+    async def read_stdout():
+        if(line_callback is None):
+            return (await proc.stdout.read()).decode("utf-8", "replace")
+        tail = deque(maxlen=tail_lines)
+        while(True):
+            line = await proc.stdout.readline()
+            if(not line):
+                break
+            line = line.decode("utf-8", "replace")
+            tail.append(line)
+            line_callback(line.rstrip("\r\n"))
+        return "".join(tail)
+
+    async def read_stderr():
+        tail = deque(maxlen=tail_lines)
+        while(True):
+            line = await proc.stderr.readline()
+            if(not line):
+                break
+            tail.append(line.decode("utf-8", "replace"))
+        return "".join(tail)
+
+    async def communicate():
+        stdout, stderr = await asyncio.gather(read_stdout(), read_stderr())
+        # A tool may close its output and keep running, so the wait is
+        # timed out too.
+        return (stdout, stderr, await proc.wait())
+
+    try:
+        stdout, stderr, returncode = await asyncio.wait_for(communicate(),
+                                                            timeout)
+    except asyncio.TimeoutError:
+        kill_process_group(proc)
+        await proc.wait()
+        raise ToolError("Timed out after {} seconds".format(timeout),
+                        cmd=cmd)
+    except ValueError as e:
+        # Raised by readline for a line longer than the stream limit.
+        kill_process_group(proc)
+        await proc.wait()
+        raise ToolError("Unable to read the output: {}".format(e), cmd=cmd)
+    except BaseException:
+        # Ex. the task was cancelled. Do not leave the tool running.
+        kill_process_group(proc)
+        await proc.wait()
+        raise
+    finally:
+        _running.discard(proc.pid)
+
+    if(returncode != 0):
+        raise ToolError("Exited with code {}".format(returncode), cmd=cmd,
+                        returncode=returncode, stdout=stdout, stderr=stderr)
+
+    if(line_callback is not None):
+        stdout = ""
+    return ToolResult(cmd, returncode, stdout, stderr)
+
+
+def kill_process_group(proc):
+    # The tool was started in its own session, so its children are killed
+    # with it.
+    try:
+        os.killpg(proc.pid, signal.SIGKILL)
+    except ProcessLookupError:
+        pass
+
+
+def kill_running_tools():
+    ''' Kills the tools running in this process and everything they have
+        started. The tools run in sessions of their own, so they are not
+        reached by signals sent to the process group of this process.
+    '''
+    for pid in list(_running):
+        try:
+            os.killpg(pid, signal.SIGKILL)
+        except ProcessLookupError:
+            pass
+
+
+def run_tool(argv, **kwargs):
+    ''' Blocking version of run_tool_async, see run_tool_async. Each call
+        runs its own event loop. Tools that should run at the same time are
+        run as tasks of one event loop instead, see TypingProfile.
+    '''
+    import asyncio
+    return asyncio.run(run_tool_async(argv, **kwargs))
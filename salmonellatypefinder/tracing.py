@@ -0,0 +1,180 @@
+#!/usr/bin/env python3
+
+import json
+import os
+import threading
+import time
+from contextlib import contextmanager, nullcontext
+
+
+class Tracer():
+    ''' Records timing spans of the stages of a sample. Spans are stored as
+        dictionaries:
+            name: Stage name, ex. "cgemlst.run".
+            sample: Sample name or None for stages not tied to a sample.
+            start, end: Wall-clock timestamps (seconds since the epoch).
+            duration: Seconds, measured with a monotonic clock.
+            pid, thread: Process and thread the stage ran in.
+        Extra keyword arguments given to span() are stored with the span.
+    '''
+
+    def __init__(self, sample=None):
+        self.sample = sample
+        self.spans = []
+        self.lock = threading.Lock()
+
+    def __getstate__(self):
+        # Locks cannot be pickled, ex. when a TypingProfile is returned from
+        # a worker process.
+        state = self.__dict__.copy()
+        del state["lock"]
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self.lock = threading.Lock()
+
+    @contextmanager
+    def span(self, name, **attrs):
+        start = time.time()
+        start_counter = time.perf_counter()
+        try:
+            yield
+        finally:
+            duration = time.perf_counter() - start_counter
+            span = {
+                "name": name,
+                "sample": self.sample,
+                "start": start,
+                "end": start + duration,
+                "duration": duration,
+                "pid": os.getpid(),
+                "thread": threading.get_ident()
+            }
+            span.update(attrs)
+            with self.lock:
+                self.spans.append(span)
+
+    def call(self, name, func, *args, **kwargs):
+        ''' Calls func(*args, **kwargs) inside a span and returns the result.
+        '''
+        with self.span(name):
+            return func(*args, **kwargs)
+
+    async def call_async(self, name, awaitable):
+        ''' Awaits awaitable inside a span and returns the result.
+        '''
+        with self.span(name):
+            return await awaitable
+
+    def pop(self):
+        ''' Returns the recorded spans and forgets them.
+        '''
+        with self.lock:
+            spans = self.spans
+            self.spans = []
+        return spans
+
+    def durations(self):
+        ''' Returns a dictionary with the total duration of each stage.
+        '''
+        durations = {}
+        with self.lock:
+            for span in self.spans:
+                durations[span["name"]] = (durations.get(span["name"], 0)
+                                           + span["duration"])
+        return durations
+
+
+def span(tracer, name, **attrs):
+    ''' Returns tracer.span(name) or, if tracer is None, a context that does
+        nothing.
+    '''
+    if(tracer is None):
+        return nullcontext()
+    return tracer.span(name, **attrs)
+
+
+class TraceExporter():
+    ''' Exports spans as JSON Lines trace events and/or as a Prometheus text
+        format file. Spans are written to the JSON Lines file as they are
+        added, while the Prometheus file holds per stage histograms that are
+        written on close, so memory use does not grow with the number of
+        samples.
+    '''
+
+    BUCKETS = (0.01, 0.1, 0.5, 1, 5, 10, 30, 60, 120, 300, 600, 1800, 3600)
+
+    def __init__(self, jsonl_path=None, prom_path=None):
+        self.prom_path = prom_path
+        self.jsonl_fh = None
+        if(jsonl_path):
+            self.jsonl_fh = open(jsonl_path, "a", encoding="utf-8")
+        # stage --> [bucket counts, count, sum, max]
+        self.stages = {}
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def add(self, spans):
+        for span_dict in spans:
+            if(self.jsonl_fh):
+                self.jsonl_fh.write(json.dumps(span_dict) + "\n")
+            if(self.prom_path):
+                stage = self.stages.setdefault(
+                    span_dict["name"], [[0] * len(self.BUCKETS), 0, 0.0, 0.0])
+                duration = span_dict["duration"]
+                for i, bucket in enumerate(self.BUCKETS):
+                    if(duration <= bucket):
+                        stage[0][i] += 1
+                stage[1] += 1
+                stage[2] += duration
+                stage[3] = max(stage[3], duration)
+        if(self.jsonl_fh):
+            self.jsonl_fh.flush()
+
+    def close(self):
+        if(self.jsonl_fh):
+            self.jsonl_fh.close()
+            self.jsonl_fh = None
+        if(self.prom_path):
+            self.write_prometheus()
+
+    def write_prometheus(self):
+        lines = [
+            "# HELP salmonellatypefinder_stage_duration_seconds Duration of"
+            " each typing stage.",
+            "# TYPE salmonellatypefinder_stage_duration_seconds histogram"
+        ]
+        for name, (buckets, count, total, max_duration) in \
+                sorted(self.stages.items()):
+            for bucket, bucket_count in zip(self.BUCKETS, buckets):
+                lines.append("salmonellatypefinder_stage_duration_seconds"
+                             "_bucket{{stage=\"{}\",le=\"{}\"}} {}"
+                             .format(name, bucket, bucket_count))
+            lines.append("salmonellatypefinder_stage_duration_seconds_bucket"
+                         "{{stage=\"{}\",le=\"+Inf\"}} {}"
+                         .format(name, count))
+            lines.append("salmonellatypefinder_stage_duration_seconds_sum"
+                         "{{stage=\"{}\"}} {}".format(name, total))
+            lines.append("salmonellatypefinder_stage_duration_seconds_count"
+                         "{{stage=\"{}\"}} {}".format(name, count))
+
+        lines.append("# HELP salmonellatypefinder_stage_duration_seconds_max"
+                     " Longest duration of each typing stage.")
+        lines.append("# TYPE salmonellatypefinder_stage_duration_seconds_max"
+                     " gauge")
+        for name, (buckets, count, total, max_duration) in \
+                sorted(self.stages.items()):
+            lines.append("salmonellatypefinder_stage_duration_seconds_max"
+                         "{{stage=\"{}\"}} {}".format(name, max_duration))
+
+        # Written to a tmp file and renamed, so a scraper never reads a
+        # partial file.
+        tmp_path = "{}.tmp{}".format(self.prom_path, os.getpid())
+        with open(tmp_path, "w", encoding="utf-8") as prom_fh:
+            prom_fh.write("\n".join(lines) + "\n")
+        os.replace(tmp_path, self.prom_path)
@@ -1,15 +1,13 @@
 #!/usr/bin/env python3
 
-import argparse
 import os.path
-import gzip
-import subprocess
 import sys
 
 from .kauffmanwhite import KauffmanWhite
 from .mlst import MLST
-from .mlst2serotype import MLST2Serotype, PredictedSerotype
-from .outputparser import Parser
+from .mlst2serotype import PredictedSerotype
+from .tracing import Tracer
+from .workspace import Workspace
 
 
 def eprint(*args, **kwargs):
@@ -20,13 +18,60 @@ class TypingProfile():
     '''
     '''
 
+    # Predicted serotype of samples failing the Salmonella pre-screen.
+    PRESCREEN_FAILED = "Not Salmonella (failed pre-screen)"
+
     def __init__(self, files, mlst2serotype=None, seqtype="paired", mlst=None,
                  tmp_dir="tmp_dir", python2_env=None, cgemlst_path="mlst.py",
                  cgemlstdb_path=None, python3="python3", seqsero="SeqSero.py",
                  blastn="blastn", makeblastdb="makeblastdb",
                  samtools="samtools", bwa="bwa", python2="python2.7",
-                 seqsero2="SeqSero2_package.py", seromethod="seqsero"):
+                 seqsero2="SeqSero2_package.py", seromethod="seqsero",
+                 sample_name=None, cache=None, tool_timeout=None,
+                 max_coverage=None, genome_size=5000000, bait=False,
+                 bait_fastas=None, bait_workers=1, prescreen=False,
+                 prescreen_fastas=None, index_cache_dir=None,
+                 workspaces=None, input_stager=None, mlstmethod="default",
+                 kma="kma", kma_shm_level=None, tool_threads=1):
         ''' Constructor.
+            sample_name: Name used for the sample in the output. Defaults to
+                         the filename of the first input file.
+            cache: ResultCache object used to reuse results from earlier
+                   runs of the external tools.
+            tool_timeout: Max. seconds each external tool may run. A tool
+                          running longer is killed and ToolError is raised.
+            max_coverage: If given, reads are subsampled to this estimated
+                          depth before MLST and SeqSero are run, see
+                          Subsampler. Assemblies are never subsampled.
+            genome_size: Genome size in bp used to estimate the depth.
+            bait: If True, only the reads sharing k-mers with the MLST
+                  alleles or the SeqSero antigen references are passed to
+                  the tools, see ReadBait.
+            bait_fastas: Extra references for the read bait.
+            bait_workers: Number of processes filtering reads.
+            prescreen: If True, samples are checked for Salmonella MLST
+                       k-mers first, see PreScreen. Samples failing the check
+                       are not typed, and are flagged with the serotype
+                       PRESCREEN_FAILED.
+            prescreen_fastas: Extra marker loci for the pre-screen.
+            index_cache_dir: Dir of the cached bait and pre-screen k-mer
+                             indexes. Default: tmp_dir.
+            workspaces: WorkspaceManager. If given, the sample is run in an
+                        isolated workspace created by it instead of tmp_dir,
+                        and the workspace is removed or kept when the sample
+                        is done. Otherwise all files are written to tmp_dir
+                        and kept.
+            input_stager: InputStager. If given, gzipped input is
+                          decompressed once to the workspace when that is
+                          cheaper than letting each tool read it.
+            mlstmethod: MLST method, see MLST. "kma" runs KMA (kma) directly
+                        instead of CGE MLST.
+            kma_shm_level: Shared memory level of the KMA index, if it has
+                           been loaded with KMASharedIndex.
+            tool_threads: Number of threads given to each external tool that
+                          takes a thread count (KMA and SeqSero2), see
+                          plan_resources.
+            The time spent in each stage is recorded in self.tracer.
         '''
         # SeqSero dependencies
         seqsero_dependencies = {
@@ -42,30 +87,159 @@ class TypingProfile():
         self.kauffmanwhite = ""
         self.mlst_serotype = ""
         self.files = files
+        if(sample_name is None):
+            sample_name = os.path.basename(files[0])
+        self.sample_name = sample_name
+        self.tracer = Tracer(sample=sample_name)
         self.serotype = ""
         self.uncertain_sero = False
+        self.subsampler = None
+        self.read_bait = None
+        self.prescreen = None
+        self.workspace = None
+        self.staged_input = None
 
         self.cgemlst_path = cgemlst_path
         self.cgemlstdb_path = cgemlstdb_path
         self.python3 = python3
 
-        os.makedirs(tmp_dir, exist_ok=True)
+        with self.tracer.span("typing_profile", seqtype=seqtype):
+            if(workspaces):
+                with self.tracer.span("workspace.open"):
+                    self.workspace = workspaces.open(sample_name, files)
+            else:
+                self.workspace = Workspace(tmp_dir)
+            with self.workspace:
+                workspace = self.workspace
+                # The optional steps are imported when used, which keeps the
+                # import of the package fast.
+                if(prescreen):
+                    from .prescreen import PreScreen
+                    self.prescreen = PreScreen(
+                        cgemlstdb_path=cgemlstdb_path,
+                        marker_fastas=prescreen_fastas,
+                        cache_dir=index_cache_dir or tmp_dir)
+                    with self.tracer.span("prescreen"):
+                        passed = self.prescreen.screen(files, seqtype=seqtype)
+                    if(not passed):
+                        self.set_prescreen_failed(files, workspace.path)
+                        return
+
+                # The external tools get the staged, subsampled and/or baited
+                # reads, the output still lists the input files.
+                tool_files = tuple(files)
+                subsample = max_coverage and seqtype != "assembled"
+                bait = bait and seqtype != "assembled"
+                subsampler = None
+                read_bait = None
+                # Options of the steps that change the reads, part of the
+                # cache keys of the tools.
+                stage_args = []
+                if(subsample):
+                    from .subsample import Subsampler
+                    subsampler = Subsampler(max_coverage,
+                                            genome_size=genome_size)
+                    stage_args += subsampler.cache_args()
+                if(bait):
+                    from .readbait import ReadBait
+                    read_bait = ReadBait(
+                        cgemlstdb_path=cgemlstdb_path, seqsero_path=seqsero,
+                        seqsero2_path=seqsero2, bait_fastas=bait_fastas,
+                        cache_dir=index_cache_dir or tmp_dir,
+                        workers=bait_workers)
+                    stage_args += read_bait.cache_args()
+
+                # MLST and SeqSero are independent of each other, so both
+                # external tools are run at the same time, as tasks of one
+                # event loop, and joined before the results are compared.
+                self.mlst = MLST(
+                    tool_files, method=mlstmethod, seqtype=seqtype,
+                    mlst=mlst, tmp_dir=workspace.stage_dir("mlst"),
+                    cgemlst_path=cgemlst_path, cgemlstdb_path=cgemlstdb_path,
+                    python3_path=python3, cache=cache, timeout=tool_timeout,
+                    tracer=self.tracer, kma_path=kma,
+                    kma_shm_level=kma_shm_level, threads=tool_threads,
+                    cache_args=stage_args, run=False)
+                self.kauffmanwhite = KauffmanWhite(
+                    tool_files, seqtype=seqtype,
+                    tmp_dir=workspace.stage_dir(seromethod),
+                    method=seromethod, python2_env=python2_env,
+                    seqsero2=seqsero2, cache=cache, timeout=tool_timeout,
+                    tracer=self.tracer, threads=tool_threads,
+                    cache_args=stage_args, run=False,
+                    **seqsero_dependencies)
+
+                # The cache is keyed on the input files, so a sample found in
+                # the cache skips staging, subsampling and baiting too.
+                cached = False
+                if(cache):
+                    mlst_cached = self.mlst.lookup_cache()
+                    sero_cached = self.kauffmanwhite.lookup_cache()
+                    cached = mlst_cached and sero_cached
+
+                if(input_stager and not cached):
+                    # Only the first step reads the input files.
+                    if(subsample):
+                        consumers = ["subsample"]
+                    elif(bait):
+                        consumers = ["read_bait"]
+                    else:
+                        consumers = [seromethod]
+                        if(mlst is None):
+                            consumers.append("kma" if(mlstmethod == "kma")
+                                             else "cgemlst")
+                    with self.tracer.span("input_stage"):
+                        self.staged_input = input_stager.stage(
+                            tool_files, consumers, workspace)
+                    tool_files = self.staged_input.files
+                if(subsampler and not cached):
+                    self.subsampler = subsampler
+                    with self.tracer.span("subsample"):
+                        tool_files = self.subsampler.subsample(
+                            tool_files, workspace.stage_dir("subsample"))
+                if(read_bait and not cached):
+                    self.read_bait = read_bait
+                    with self.tracer.span("read_bait"):
+                        tool_files = self.read_bait.filter(
+                            tool_files, workspace.stage_dir("read_bait"))
+                self.mlst.files = tool_files
+                self.kauffmanwhite.files = tool_files
+
+                import asyncio
+                asyncio.run(self.run_tools())
+
+                # Get serotype from MLST.
+                if(mlst2serotype):
+                    with self.tracer.span("mlst2serotype.lookup"):
+                        self.mlst_serotype = mlst2serotype.mlst2serotype(
+                            self.mlst.st)
 
-        self.mlst = MLST((files[0], files[1]), seqtype=seqtype, mlst=mlst,
-                         tmp_dir=tmp_dir, cgemlst_path=cgemlst_path,
-                         cgemlstdb_path=cgemlstdb_path, python3_path=python3)
+                self.tracer.call("consensus", self.predict_serotype)
 
-        self.kauffmanwhite = KauffmanWhite((files[0], files[1]),
-                                           seqtype=seqtype, tmp_dir=tmp_dir,
-                                           method=seromethod,
-                                           python2_env=python2_env,
-                                           seqsero2=seqsero2,
-                                           **seqsero_dependencies)
+    async def run_tools(self):
+        ''' Runs MLST and SeqSero at the same time. If one fails, the other
+            is cancelled when the event loop ends, which kills its tool.
+        '''
+        import asyncio
+        await asyncio.gather(
+            self.tracer.call_async("mlst", self.mlst.run_async()),
+            self.tracer.call_async("kauffmanwhite",
+                                   self.kauffmanwhite.run_async()))
 
-        # Get serotype from MLST.
-        if(mlst2serotype):
-            self.mlst_serotype = mlst2serotype.mlst2serotype(self.mlst.st)
+    def set_prescreen_failed(self, files, tmp_dir):
+        ''' Sets empty MLST and KauffmanWhite results without running the
+            external tools, and flags the sample.
+        '''
+        self.mlst = MLST(tuple(files), method="none", tmp_dir=tmp_dir)
+        self.kauffmanwhite = KauffmanWhite(tuple(files), method="none",
+                                           tmp_dir=tmp_dir)
+        self.mlst_serotype = PredictedSerotype()
+        self.serotype = self.PRESCREEN_FAILED
+        self.uncertain_sero = True
 
+    def predict_serotype(self):
+        ''' Sets the serotype from the MLST and KauffmanWhite predictions.
+        '''
         # Get serotype from in silico KauffmanWhite.
         kauffwhite_sero = self.kauffmanwhite.serotype2string()
 
@@ -91,9 +265,23 @@ class TypingProfile():
             self.uncertain_sero = True
             self.serotype = "n/a"
 
+    def to_dict(self):
+        ''' RETURN: The results as a JSON serializable dict, as written by
+                    --out_format jsonl.
+        '''
+        from .outputparser import Parser
+
+        return Parser.profile2dict(self)
+
 
 if __name__ == '__main__':
 
+    import argparse
+    import subprocess
+
+    from .mlst2serotype import MLST2Serotype
+    from .outputparser import Parser
+
     #
     # Handling arguments
     #
@@ -0,0 +1,369 @@
+#!/usr/bin/env python3
+
+import json
+import os
+import shutil
+import socket
+import sys
+import threading
+import time
+
+from .batch import Sample
+
+
+def eprint(*args, **kwargs):
+    print(*args, file=sys.stderr, **kwargs)
+
+
+QUEUE_VERSION = 1
+
+
+def worker_id():
+    return "{}:{}".format(socket.gethostname(), os.getpid())
+
+
+def write_json_atomic(path, data):
+    ''' Writes to a tmp file in the same dir and renames it, so readers
+        either see the whole file or none.
+    '''
+    tmp_path = os.path.join(os.path.dirname(path), ".tmp.{}.{}.{}".format(
+        socket.gethostname(), os.getpid(), os.path.basename(path)))
+    with open(tmp_path, "w", encoding="utf-8") as tmp_fh:
+        json.dump(data, tmp_fh)
+        tmp_fh.flush()
+        os.fsync(tmp_fh.fileno())
+    os.rename(tmp_path, path)
+
+
+def read_json(path):
+    with open(path, "r", encoding="utf-8") as fh:
+        return json.load(fh)
+
+
+class WorkQueue():
+    ''' Queue of samples in a dir on a filesystem shared by the nodes, for
+        clusters without a message broker. Each sample is a task file that
+        moves between the dirs:
+            todo: Waiting to be typed.
+            claimed: Being typed. A worker claims a task by renaming it from
+                     todo, which only one worker can do. The worker touches
+                     the claimed file while it works (heartbeat).
+            done: Result of the sample.
+            failed: Samples that failed max_attempts times.
+        Claims without a heartbeat for claim_timeout seconds are put back in
+        todo by any worker, so samples of workers that died are typed again.
+        Times are compared with the clock of the file server, as the clocks
+        of the nodes may differ.
+    '''
+
+    DIRS = ("todo", "claimed", "done", "failed", "clock")
+
+    def __init__(self, queue_dir, claim_timeout=600, max_attempts=3):
+        ''' Constructor.
+            queue_dir: Queue dir made by WorkQueue.create.
+            claim_timeout: Seconds without a heartbeat before a claim is
+                           considered abandoned.
+            max_attempts: Times a sample is typed before it is failed.
+        '''
+        self.queue_dir = queue_dir
+        self.claim_timeout = claim_timeout
+        self.max_attempts = max_attempts
+        meta_path = os.path.join(queue_dir, "queue.json")
+        if(not os.path.isfile(meta_path)):
+            sys.exit("! ERROR: Not a work queue: {}".format(queue_dir))
+        self.meta = read_json(meta_path)
+        if(self.meta.get("version") != QUEUE_VERSION):
+            sys.exit("! ERROR: Unknown work queue version: {}"
+                     .format(queue_dir))
+        self.clock_path = os.path.join(queue_dir, "clock",
+                                       socket.gethostname())
+
+    @staticmethod
+    def create(queue_dir, samples, signature):
+        ''' Makes a queue dir with a task for each sample. The queue is
+            built next to queue_dir and renamed into place, so when several
+            workers start at once, one creates the queue and the others use
+            it.
+            signature: JSON serializable options the samples are typed
+                       with. Workers with other options are warned.
+            RETURN: True if the queue was created, False if it existed.
+        '''
+        if(os.path.exists(queue_dir)):
+            return False
+        build_dir = "{}.tmp.{}.{}".format(queue_dir.rstrip("/"),
+                                          socket.gethostname(), os.getpid())
+        for name in WorkQueue.DIRS:
+            os.makedirs(os.path.join(build_dir, name), exist_ok=True)
+        for index, sample in enumerate(samples):
+            task = {
+                "index": index,
+                "name": sample.name,
+                "files": list(sample.files),
+                "seqtype": sample.seqtype,
+                "mlst": sample.mlst,
+                "attempts": 0
+            }
+            write_json_atomic(os.path.join(build_dir, "todo",
+                                           WorkQueue.task_name(index)), task)
+        write_json_atomic(os.path.join(build_dir, "queue.json"), {
+            "version": QUEUE_VERSION,
+            "samples": [sample.name for sample in samples],
+            "signature": signature,
+            "created": time.time()
+        })
+        try:
+            os.rename(build_dir, queue_dir)
+        except OSError:
+            # Another worker created the queue first.
+            shutil.rmtree(build_dir, ignore_errors=True)
+            return False
+        return True
+
+    @staticmethod
+    def task_name(index):
+        return "{:07d}.json".format(index)
+
+    def path(self, state, name):
+        return os.path.join(self.queue_dir, state, name)
+
+    def tasks(self, state):
+        return sorted(name for name in os.listdir(
+            os.path.join(self.queue_dir, state))
+            if(name.endswith(".json") and not name.startswith(".")))
+
+    def fs_now(self):
+        ''' RETURN: Current time of the file server.
+        '''
+        with open(self.clock_path, "a"):
+            pass
+        os.utime(self.clock_path)
+        return os.stat(self.clock_path).st_mtime
+
+    def claim(self):
+        ''' Claims the first task in todo.
+            RETURN: (claimed path, task) or None if todo is empty.
+        '''
+        for name in self.tasks("todo"):
+            claimed_path = self.path("claimed", name)
+            try:
+                os.rename(self.path("todo", name), claimed_path)
+            except FileNotFoundError:
+                # Claimed by another worker.
+                continue
+            try:
+                os.utime(claimed_path)
+            except FileNotFoundError:
+                # Requeued by a worker that found the old mtime of the task
+                # stale, between the rename and the touch.
+                continue
+            # A task requeued from a worker that was only slow may have
+            # been finished since.
+            if(os.path.exists(self.path("done", name))):
+                self.release(claimed_path)
+                continue
+            return (claimed_path, read_json(claimed_path))
+        return None
+
+    def release(self, claimed_path):
+        try:
+            os.remove(claimed_path)
+        except FileNotFoundError:
+            pass
+
+    def heartbeat(self, claimed_path):
+        ''' RETURN: Heartbeat that touches the claimed task while the sample
+                    is typed.
+        '''
+        return Heartbeat(claimed_path, max(self.claim_timeout / 5, 1))
+
+    def finish(self, claimed_path, task, txt, result):
+        ''' Stores the result of a task and removes the claim.
+        '''
+        write_json_atomic(self.path("done", os.path.basename(claimed_path)), {
+            "sample": task["name"],
+            "worker": worker_id(),
+            "finished": time.time(),
+            "txt": txt,
+            "result": result
+        })
+        self.release(claimed_path)
+
+    def retry(self, claimed_path, task, reason):
+        ''' Puts a task that failed back in todo, or in failed after
+            max_attempts attempts. The claim is first renamed to a private
+            name, so a claim lost to requeue_stale, and maybe claimed again
+            by another worker, is left alone.
+        '''
+        task = dict(task, attempts=task["attempts"] + 1, reason=reason,
+                    worker=worker_id())
+        name = os.path.basename(claimed_path)
+        private_path = self.path("claimed", ".retry.{}.{}.{}".format(
+            socket.gethostname(), os.getpid(), name))
+        try:
+            os.rename(claimed_path, private_path)
+        except FileNotFoundError:
+            # The claim was lost and the task requeued by another worker.
+            return
+        write_json_atomic(private_path, task)
+        if(task["attempts"] >= self.max_attempts):
+            os.rename(private_path, self.path("failed", name))
+        else:
+            os.rename(private_path, self.path("todo", name))
+
+    def requeue_stale(self):
+        ''' Puts claims without a heartbeat for claim_timeout seconds back
+            in todo, counted as a failed attempt. A stale claim is first
+            taken by renaming it to a private name, so when several workers
+            find it only the one whose rename succeeds requeues it.
+            RETURN: Number of claims requeued.
+        '''
+        now = self.fs_now()
+        requeued = 0
+        for name in self.tasks("claimed"):
+            claimed_path = self.path("claimed", name)
+            private_path = self.path("claimed", ".requeue.{}.{}.{}".format(
+                socket.gethostname(), os.getpid(), name))
+            try:
+                if(now - os.stat(claimed_path).st_mtime < self.claim_timeout):
+                    continue
+                os.rename(claimed_path, private_path)
+            except FileNotFoundError:
+                # Finished, or taken by another worker.
+                continue
+            # Another worker may have requeued the task, and a third claimed
+            # it again, between the stat and the rename.
+            if(now - os.stat(private_path).st_mtime < self.claim_timeout):
+                os.rename(private_path, claimed_path)
+                continue
+            task = read_json(private_path)
+            eprint("# Requeuing abandoned sample: {}".format(task["name"]))
+            task["attempts"] += 1
+            task["reason"] = "claim abandoned"
+            if(task["attempts"] >= self.max_attempts):
+                write_json_atomic(self.path("failed", name), task)
+            else:
+                write_json_atomic(self.path("todo", name), task)
+            self.release(private_path)
+            requeued += 1
+        return requeued
+
+    def counts(self):
+        return {state: len(self.tasks(state))
+                for state in ("todo", "claimed", "done", "failed")}
+
+    def results(self):
+        ''' Yields (sample name, done record or None, failed task or None)
+            in the order of the sample sheet.
+        '''
+        for index, sample_name in enumerate(self.meta["samples"]):
+            name = self.task_name(index)
+            done = None
+            failed = None
+            if(os.path.exists(self.path("done", name))):
+                done = read_json(self.path("done", name))
+            elif(os.path.exists(self.path("failed", name))):
+                failed = read_json(self.path("failed", name))
+            yield (sample_name, done, failed)
+
+
+class Heartbeat():
+    ''' Touches a file every interval seconds in a thread, while used as a
+        context manager.
+    '''
+
+    def __init__(self, path, interval):
+        self.path = path
+        self.interval = interval
+        self.stopped = threading.Event()
+        self.thread = threading.Thread(target=self.run, daemon=True)
+
+    def __enter__(self):
+        self.thread.start()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.stopped.set()
+        self.thread.join()
+
+    def run(self):
+        while(not self.stopped.wait(self.interval)):
+            try:
+                os.utime(self.path)
+            except FileNotFoundError:
+                eprint("! WARNING: Claim lost, the sample was requeued: {}"
+                       .format(self.path))
+                return
+
+
+def work(queue, tmp_dir, typing_options, poll=10):
+    ''' Claims and types samples until the queue is empty. Runs in a worker
+        process set up by batch.init_worker. Waits while other workers hold
+        claims, as their samples are requeued if they die.
+        RETURN: Number of samples typed.
+    '''
+    from .batch import type_sample
+    from .outputparser import Parser
+
+    poll = min(poll, max(queue.claim_timeout / 3, 1))
+    typed = 0
+    while(True):
+        claimed = queue.claim()
+        if(claimed is None):
+            queue.requeue_stale()
+            if(not queue.tasks("todo") and not queue.tasks("claimed")):
+                return typed
+            time.sleep(poll)
+            continue
+
+        claimed_path, task = claimed
+        sample = Sample(task["name"], tuple(task["files"]),
+                        seqtype=task["seqtype"], mlst=task["mlst"])
+        with queue.heartbeat(claimed_path):
+            profile = type_sample(sample, tmp_dir, typing_options)
+        if(profile is None):
+            eprint("! ERROR: Typing failed for sample: {}"
+                   .format(sample.name))
+            queue.retry(claimed_path, task, "typing failed")
+        else:
+            queue.finish(claimed_path, task, Parser.profile2txt(profile),
+                         Parser.profile2dict(profile))
+            typed += 1
+
+
+def work_process(queue, serotyper, tmp_dir, typing_options):
+    from .batch import init_worker
+
+    init_worker(serotyper)
+    work(queue, tmp_dir, typing_options)
+
+
+def run_workers(queue, serotyper, tmp_dir, workers=1, **typing_options):
+    ''' Runs "workers" worker processes on the queue, see work. The
+        processes are forked, so they share the loaded database. A process
+        that dies, ex. killed for using too much memory, is replaced while
+        the queue has samples; its sample is requeued after claim_timeout.
+    '''
+    import multiprocessing
+
+    mp_context = multiprocessing.get_context("fork")
+
+    def start():
+        process = mp_context.Process(
+            target=work_process,
+            args=(queue, serotyper, tmp_dir, typing_options))
+        process.start()
+        return process
+
+    processes = [start() for i in range(workers)]
+    while(processes):
+        for process in list(processes):
+            process.join(timeout=1)
+            if(process.exitcode is None):
+                continue
+            processes.remove(process)
+            if(process.exitcode != 0):
+                eprint("! WARNING: Worker process {} exited with code {}"
+                       .format(process.pid, process.exitcode))
+                counts = queue.counts()
+                if(counts["todo"] or counts["claimed"]):
+                    processes.append(start())
@@ -0,0 +1,278 @@
+#!/usr/bin/env python3
+
+import os
+import re
+import shutil
+import socket
+import sys
+import tempfile
+import time
+
+
+def eprint(*args, **kwargs):
+    print(*args, file=sys.stderr, **kwargs)
+
+
+# Marker file written in every managed workspace. Holds "<host>:<pid>" of the
+# process using the workspace, and is removed when the workspace is released.
+MARKER = ".workspace"
+
+
+def dir_size(path):
+    ''' Bytes used by the files below path. Files removed while walking are
+        skipped.
+    '''
+    size = 0
+    for dirpath, dirnames, filenames in os.walk(path):
+        for filename in filenames:
+            try:
+                size += os.lstat(os.path.join(dirpath, filename)).st_size
+            except FileNotFoundError:
+                pass
+    return size
+
+
+def mem_available():
+    ''' Bytes of RAM available according to /proc/meminfo, or None if it
+        cannot be read.
+    '''
+    try:
+        with open("/proc/meminfo", "r") as meminfo_fh:
+            for line in meminfo_fh:
+                if(line.startswith("MemAvailable:")):
+                    return int(line.split()[1]) * 1024
+    except (OSError, ValueError, IndexError):
+        pass
+    return None
+
+
+def marker_is_active(marker_path):
+    ''' True if the process that wrote the marker may still be running.
+        Processes on other hosts cannot be checked and count as running.
+    '''
+    try:
+        with open(marker_path, "r") as marker_fh:
+            host, pid = marker_fh.read().strip().rsplit(":", 1)
+        pid = int(pid)
+    except (OSError, ValueError):
+        return False
+    if(host != socket.gethostname()):
+        return True
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+    return True
+
+
+class Workspace():
+    ''' Working directory of a single sample. Each stage writes to its own
+        sub dir, so the bytes written by each stage can be reported when the
+        workspace is closed.
+        Used as a context manager: the workspace is closed on exit, and
+        regarded as failed if an exception was raised.
+    '''
+
+    def __init__(self, path, keep="always", manager=None, tmpfs=False):
+        ''' Constructor.
+            path: Directory of the workspace. Created if missing.
+            keep: "always" keeps the files, "failed" keeps them only if the
+                  sample failed and "never" always removes them.
+            manager: WorkspaceManager that created the workspace.
+            tmpfs: True if the workspace is on the tmpfs staging dir. Stays
+                   True if the workspace is kept and moved to the disk.
+        '''
+        self.path = path
+        self.keep = keep
+        self.manager = manager
+        self.tmpfs = tmpfs
+        self.stages = []
+        self.stage_bytes = {}
+        self.kept = None
+        os.makedirs(path, exist_ok=True)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close(failed=exc_type is not None)
+
+    def to_dict(self):
+        return {
+            "path": self.path,
+            "tmpfs": self.tmpfs,
+            "kept": self.kept,
+            "stage_bytes": self.stage_bytes
+        }
+
+    def stage_dir(self, stage):
+        ''' RETURN: Directory of the stage, created if missing.
+        '''
+        path = os.path.join(self.path, stage)
+        os.makedirs(path, exist_ok=True)
+        if(stage not in self.stages):
+            self.stages.append(stage)
+        return path
+
+    def close(self, failed=False):
+        ''' Records the bytes written by each stage and removes the files,
+            unless they are to be kept. Kept workspaces on tmpfs are moved
+            to the disk, so they do not hold on to RAM.
+        '''
+        if(self.kept is not None):
+            return
+        for stage in self.stages:
+            self.stage_bytes[stage] = dir_size(os.path.join(self.path, stage))
+
+        self.kept = (self.keep == "always"
+                     or (self.keep == "failed" and failed))
+        if(self.manager is None):
+            return
+        marker_path = os.path.join(self.path, MARKER)
+        try:
+            os.remove(marker_path)
+        except FileNotFoundError:
+            pass
+        if(not self.kept):
+            shutil.rmtree(self.path, ignore_errors=True)
+            return
+        if(self.tmpfs):
+            disk_path = os.path.join(self.manager.root,
+                                     os.path.basename(self.path))
+            shutil.move(self.path, disk_path)
+            self.path = disk_path
+        if(failed):
+            eprint("# Kept workspace of failed sample: {}".format(self.path))
+
+
+class WorkspaceManager():
+    ''' Creates an isolated workspace for each sample below root, so runs and
+        samples sharing the same tmp dir never write to the same files.
+        Workspaces are staged on a tmpfs dir (ex. /dev/shm) when it and the
+        RAM have room for them. New workspaces are not created while the
+        workspaces below root and the tmpfs dir use more than quota bytes.
+        The manager holds no open resources and can be passed to worker
+        processes; the quota is checked on the files, so it is shared by all
+        processes and runs using the same dirs.
+    '''
+
+    def __init__(self, root, keep="failed", tmpfs_dir=None,
+                 tmpfs_reserve=1024 * 1024 * 1024, quota=None, poll=5):
+        ''' Constructor.
+            root: Directory of the workspaces on disk.
+            keep: See Workspace.
+            tmpfs_dir: If given, workspaces are created here when the free
+                       space on it and the available RAM both exceed the
+                       estimated size of the workspace plus tmpfs_reserve.
+            tmpfs_reserve: Bytes of RAM and tmpfs left free.
+            quota: Max. bytes used by all workspaces before new samples wait.
+                   Default: no limit
+            poll: Seconds between quota checks while waiting.
+        '''
+        if(keep not in ("always", "failed", "never")):
+            raise ValueError("Unknown keep option: {}".format(keep))
+        self.root = os.path.abspath(root)
+        self.keep = keep
+        self.tmpfs_dir = tmpfs_dir
+        if(tmpfs_dir):
+            self.tmpfs_dir = os.path.abspath(tmpfs_dir)
+        self.tmpfs_reserve = tmpfs_reserve
+        self.quota = quota
+        self.poll = poll
+
+    def workspace_dirs(self):
+        ''' RETURN: List of (path, active) of the workspaces below root and
+                    the tmpfs dir, including kept workspaces.
+        '''
+        dirs = []
+        for base_dir in (self.root, self.tmpfs_dir):
+            if(not base_dir or not os.path.isdir(base_dir)):
+                continue
+            for entry in os.scandir(base_dir):
+                if(not entry.is_dir(follow_symlinks=False)):
+                    continue
+                marker_path = os.path.join(entry.path, MARKER)
+                if(os.path.exists(marker_path)):
+                    dirs.append((entry.path, marker_is_active(marker_path)))
+                elif(entry.name.endswith(".ws")):
+                    dirs.append((entry.path, False))
+        return dirs
+
+    def used_bytes(self):
+        ''' RETURN: (bytes used by all workspaces, no. of active workspaces)
+        '''
+        used = 0
+        active = 0
+        for path, is_active in self.workspace_dirs():
+            used += dir_size(path)
+            active += is_active
+        return (used, active)
+
+    def wait_for_quota(self, name):
+        ''' Blocks while the workspaces use more than the quota. If no other
+            workspace is active, nothing will free space, so the sample is
+            started anyway.
+        '''
+        if(not self.quota):
+            return
+        waited = False
+        while(True):
+            used, active = self.used_bytes()
+            if(used < self.quota):
+                break
+            if(not active):
+                eprint("! WARNING: Workspaces use {} MB, more than the quota"
+                       " of {} MB, but none are active. Starting {} anyway."
+                       .format(used // 2**20, self.quota // 2**20, name))
+                break
+            if(not waited):
+                eprint("# Workspaces use {} MB of the {} MB quota, {} waits."
+                       .format(used // 2**20, self.quota // 2**20, name))
+                waited = True
+            time.sleep(self.poll)
+
+    def use_tmpfs(self, size):
+        if(not self.tmpfs_dir):
+            return False
+        needed = size + self.tmpfs_reserve
+        os.makedirs(self.tmpfs_dir, exist_ok=True)
+        if(shutil.disk_usage(self.tmpfs_dir).free < needed):
+            return False
+        ram = mem_available()
+        return ram is None or ram >= needed
+
+    @staticmethod
+    def estimate_size(files):
+        ''' Rough size of the intermediates of a sample: the SAM files
+            written by SeqSero are about the size of the uncompressed reads,
+            which are about 4 times the size of gzipped reads.
+        '''
+        size = 0
+        for path in files or ():
+            try:
+                file_size = os.path.getsize(path)
+            except OSError:
+                continue
+            with open(path, "rb") as fh:
+                if(fh.read(2) == b"\x1f\x8b"):
+                    file_size *= 4
+            size += file_size
+        return size
+
+    def open(self, name, files=None):
+        ''' Creates the workspace of a sample, waiting for the quota first.
+            files: Input files, used to estimate the size of the workspace.
+            RETURN: Workspace
+        '''
+        self.wait_for_quota(name)
+        tmpfs = self.use_tmpfs(self.estimate_size(files))
+        base_dir = self.tmpfs_dir if(tmpfs) else self.root
+        os.makedirs(base_dir, exist_ok=True)
+        prefix = re.sub(r"[^\w.-]", "_", name) + "."
+        path = tempfile.mkdtemp(prefix=prefix, suffix=".ws", dir=base_dir)
+        with open(os.path.join(path, MARKER), "w") as marker_fh:
+            marker_fh.write("{}:{}\n".format(socket.gethostname(),
+                                             os.getpid()))
+        return Workspace(path, keep=self.keep, manager=self, tmpfs=tmpfs)
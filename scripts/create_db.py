@@ -1,14 +1,13 @@
 #! /tools/bin/python3
 
-import subprocess
-import re
 import argparse
 import os.path
-import hashlib
 import json
-import textwrap
-import gzip
-from itertools import groupby
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.realpath(
+    __file__))))
+from salmonellatypefinder.dbbuilder import DBBuilder  # noqa: E402
 
 
 if __name__ == '__main__':
@@ -22,93 +21,36 @@ if __name__ == '__main__':
     parser.add_argument("tab_db_file",
                         help="File containing the database in a tab seperated\
                               text file. Texfile is assumed to be encoded in\
-                              utf-8.",
+                              utf-8. Can be gzip compressed.",
                         metavar='TAB_FILE')
     parser.add_argument("json_out",
                         help="Output path to write the JSON database/hash to.",
                         metavar='JSON_OUT')
+    parser.add_argument("-w", "--workers",
+                        help="Number of processes counting the rows.\
+                              Default: number of CPUs",
+                        type=int,
+                        default=os.cpu_count() or 1)
+    parser.add_argument("--block_size",
+                        help="MB of the file counted by a process at a time.\
+                              Default: 8",
+                        type=int,
+                        default=8)
+    parser.add_argument("-q", "--quiet",
+                        help="Do not print progress.",
+                        action="store_true",
+                        default=False)
 
     args = parser.parse_args()
 
     #
     # Load DB file.
     #
-    output_hash = {}
-    output_hash["ebg"] = {}  # stores eBG types.
+    builder = DBBuilder(workers=args.workers,
+                        block_size=args.block_size * 1024 * 1024,
+                        progress=not args.quiet)
     try:
-        with open(args.tab_db_file, "r", encoding="utf-8") as tab_db_fh:
-            header_line = tab_db_fh.readline()
-            header_line = header_line.strip()
-            headers = header_line.split("\t")
-
-            index_st = ""
-            index_serotype = ""
-            index_ebg = ""
-            index_subspecies = ""
-
-            for i, header in enumerate(headers):
-                header = header.lower()
-
-                if(header == "st"):
-                    index_st = i
-                if(header == "ebg"):
-                    index_ebg = i
-                elif(header == "serovar"):
-                    index_serotype = i
-                elif(header == "subspecies"):
-                    index_subspecies = i
-
-            # Regexp to detect serotypes written as ex. "Salmonella Typhi"
-            re_serotype_w_salm = re.compile(r"^salmonella\s*(.+)",
-                                            re.IGNORECASE)
-
-            for line in tab_db_fh:
-                entries = line.split("\t")
-                st = entries[index_st]
-                ebg = entries[index_ebg]
-                serotype = entries[index_serotype].lower()
-                serotype = serotype.strip()
-
-                # If serotype is blank, skip.
-                if(not serotype):
-                    continue
-
-                # Filtering out an error in the enterodatabase.
-                if(serotype == "shigella flexneri"):
-                    continue
-
-                # If required removes "Salmonella" from serotype.
-                salm_match = re_serotype_w_salm.search(serotype)
-                if(salm_match):
-                    serotype = salm_match.group(1)
-
-                # Ex.: changes saint-paul to saintpaul.
-                serotype = serotype.replace("-", "")
-
-                # Store the ST --> Serotype data
-                if(st in output_hash):
-                    if(serotype in output_hash[st]):
-                        count = output_hash[st][serotype]
-                        count = count+1
-                        output_hash[st][serotype] = count
-                    else:
-                        output_hash[st][serotype] = 1
-                else:
-                    output_hash[st] = {}
-                    output_hash[st][serotype] = 1
-
-                # Store the eBG --> Serotype data
-                if(ebg in output_hash["ebg"]):
-                    if(serotype in output_hash["ebg"][ebg]):
-                        count = output_hash["ebg"][ebg][serotype]
-                        count = count+1
-                        output_hash["ebg"][ebg][serotype] = count
-                    else:
-                        output_hash["ebg"][ebg][serotype] = 1
-                else:
-                    output_hash["ebg"][ebg] = {}
-                    output_hash["ebg"][ebg][serotype] = 1
-
+        output_hash = builder.build(args.tab_db_file)
     except FileNotFoundError:
         print("The input file "+args.tab_db_file+" was not found\n")
         quit(1)
@@ -1,8 +1,13 @@
 #! /home/data1/tools/bin/Anaconda3-2.5.0/bin/python3
 
 import argparse
+import os.path
 import sys
 
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.realpath(
+    __file__))))
+from salmonellatypefinder.htmlreport import HTMLReport, read_tsv_rows  # noqa
+
 
 if __name__ == '__main__':
 
@@ -30,81 +35,63 @@ if __name__ == '__main__':
                         metavar='FILE',
                         default=None)
 
-    args = parser.parse_args()
+    parser.add_argument("-o", "--output",
+                        help="Path to output file. Default: stdout",
+                        default=None)
+    parser.add_argument("--page_size",
+                        help="Rows shown per page of the tables.\
+                              Default: 100",
+                        type=int,
+                        default=100)
 
-    output_html = ("<center><h2>SalmonellaTypeFinder Results</h2></center>\n"
-                   "<p>Notice: 'Flagged' samples contain an uncertain or no "
-                   "prediction</p>\n"
-                   "<hr>\n"
-                   "<br>\n")
-
-    with open(args.input, "r", encoding="utf-8") as input_fh:
-        header_line = input_fh.readline()
-        headers = header_line.split("\t")
-
-        output_html += ("<table>\n" +
-                        "    <thead>\n" +
-                        "        <tr>\n")
-
-        for header in headers:
-            output_html += ("            <th><strong>" + header + "</strong>"
-                            "</th>\n")
-
-        output_html += ("        </tr>\n" +
-                        "   </thead>\n" +
-                        "   <tbody>\n")
-
-        # Parses each Sample.
-        counter_results = 0
-        for line in input_fh:
-            counter_results += 1
-            entries = line.split("\t")
-            output_html += "        <tr>"
-            # Parses each result of the sample.
-            for entry in entries:
-                entry = entry.rstrip()
-                output_html += "<td>" + entry + "</td>"
-            output_html += "</tr>\n"
-
-    output_html += ("    </tbody>\n" +
-                    "</table>\n")
-    output_html += "<br><br>\n"
+    args = parser.parse_args()
 
     downloadScript = "https://cge.cbs.dtu.dk/cge/download_files2.php"
 
-    if(args.button and counter_results > 0):
-        output_html += "<td>" + args.button + "</td>\n"
-    elif(counter_results > 0):
-        output_html += "<td><form action='" + downloadScript + "' method='post'><input type='hidden' name='service' value='SalmonellaTypeFinder'><input type='hidden' name='version' value='1.4'><input type='hidden' name='filename' value='typeFinderResults.txt'><input type='hidden' name='pathid' value='" + args.web + "'><input type='submit' value='Text'></form></td>\n"
-
-        if(not args.no_qc):
-            output_html += "<br><br>\n"
-            output_html += "<td><form action='" + downloadScript + "' method='post'><input type='hidden' name='service' value='SalmonellaTypeFinder'><input type='hidden' name='version' value='1.4'><input type='hidden' name='filename' value='qc_summary.txt'><input type='hidden' name='pathid' value='" + args.web + "'><input type='submit' value='QC table'></form></td>\n"
-
-    if(args.failed):
-        output_html += "<br><br>\n"
-        output_html += "<h3>Failed samples:</h3>\n"
-        output_html += "<table>\n"
-        output_html += "  <thead>\n"
-        output_html += "    <tr>"
-        output_html += "      <th>Filename</th>"
-        output_html += "      <th>Failed Analysis</th>"
-        output_html += "    </tr>\n"
-        output_html += "  </thead>\n"
-        with open(args.failed, "r") as fh:
-            fh.readline()  # Skip header
-            for line in fh:
-                line = line.rstrip()
-                filename, failed_analysis, result = line.split("\t")
-                output_html += "  <tr>\n"
-                output_html += "    <td>" + filename + "</td>\n"
-                output_html += "    <td>" + failed_analysis + "</td>\n"
-                output_html += "  </tr>\n"
-        output_html += "</table>\n"
-        output_html += "<br><br>\n"
-        output_html += "<td><form action='" + downloadScript + "' method='post'><input type='hidden' name='service' value='SalmonellaTypeFinder'><input type='hidden' name='version' value='1.4'><input type='hidden' name='filename' value='failed.tar.gz'><input type='hidden' name='pathid' value='" + args.web + "'><input type='submit' value='Partial results'></form></td>\n"
-
-    print(output_html)
+    # The report is written while the input is read, so memory use does not
+    # depend on the number of samples.
+    out_fh = sys.stdout
+    if(args.output):
+        out_fh = open(args.output, "w", encoding="utf-8")
+
+    with HTMLReport(out_fh, page_size=args.page_size) as report:
+        report.html("<center><h2>SalmonellaTypeFinder Results</h2></center>\n"
+                    "<p>Notice: 'Flagged' samples contain an uncertain or no "
+                    "prediction</p>\n"
+                    "<hr>\n"
+                    "<br>\n")
+
+        with open(args.input, "r", encoding="utf-8") as input_fh:
+            header_line = input_fh.readline()
+            headers = [header.strip() for header in header_line.split("\t")]
+            counter_results = report.table(
+                headers, read_tsv_rows(input_fh, columns=len(headers)))
+
+        report.html("<br><br>\n")
+
+        if(args.button and counter_results > 0):
+            report.html("<td>" + args.button + "</td>\n")
+        elif(counter_results > 0):
+            report.html("<td><form action='" + downloadScript + "' method='post'><input type='hidden' name='service' value='SalmonellaTypeFinder'><input type='hidden' name='version' value='1.4'><input type='hidden' name='filename' value='typeFinderResults.txt'><input type='hidden' name='pathid' value='" + args.web + "'><input type='submit' value='Text'></form></td>\n")
+
+            if(not args.no_qc):
+                report.html("<br><br>\n")
+                report.html("<td><form action='" + downloadScript + "' method='post'><input type='hidden' name='service' value='SalmonellaTypeFinder'><input type='hidden' name='version' value='1.4'><input type='hidden' name='filename' value='qc_summary.txt'><input type='hidden' name='pathid' value='" + args.web + "'><input type='submit' value='QC table'></form></td>\n")
+
+        if(args.failed):
+            report.html("<br><br>\n")
+            report.html("<h3>Failed samples:</h3>\n")
+            with open(args.failed, "r") as fh:
+                fh.readline()  # Skip header
+                # Columns: filename, failed analysis, result
+                report.table(["Filename", "Failed Analysis"],
+                             (fields[:2] for fields in
+                              read_tsv_rows(fh, columns=3)))
+            report.html("<br><br>\n")
+            report.html("<td><form action='" + downloadScript + "' method='post'><input type='hidden' name='service' value='SalmonellaTypeFinder'><input type='hidden' name='version' value='1.4'><input type='hidden' name='filename' value='failed.tar.gz'><input type='hidden' name='pathid' value='" + args.web + "'><input type='submit' value='Partial results'></form></td>\n")
+
+    if(args.output):
+        out_fh.close()
     print("Done", file=sys.stderr)
 
     quit(0)
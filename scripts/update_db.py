@@ -0,0 +1,211 @@
+#! /tools/bin/python3
+
+import argparse
+import datetime
+import hashlib
+import json
+import os.path
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.realpath(
+    __file__))))
+from salmonellatypefinder.dbbuilder import DBBuilder, apply_counts  # noqa
+
+
+def eprint(*args, **kwargs):
+    print(*args, file=sys.stderr, **kwargs)
+
+
+def file_sha256(path):
+    sha256 = hashlib.sha256()
+    with open(path, "rb") as fh:
+        for block in iter(lambda: fh.read(1024 * 1024), b""):
+            sha256.update(block)
+    return sha256.hexdigest()
+
+
+def write_json_atomic(path, data, **kwargs):
+    ''' Writes to a tmp file in the same dir and renames it, so readers
+        either see the old or the new file, never a partial one.
+    '''
+    tmp_path = "{}.tmp{}".format(path, os.getpid())
+    try:
+        with open(tmp_path, "w", encoding="utf-8") as json_fh:
+            json.dump(data, json_fh, **kwargs)
+            json_fh.flush()
+            os.fsync(json_fh.fileno())
+        os.replace(tmp_path, path)
+    finally:
+        if(os.path.exists(tmp_path)):
+            os.remove(tmp_path)
+
+
+def sort_keys(keys):
+    ''' Numerical STs first, in numerical order.
+    '''
+    return sorted(keys, key=lambda key: (not key.isdigit(),
+                                         int(key) if key.isdigit() else 0,
+                                         key))
+
+
+if __name__ == '__main__':
+
+    #
+    # Handling arguments
+    #
+    parser = argparse.ArgumentParser(description="Apply new and retracted\
+        isolates to an existing JSON db created by create_db.py, without\
+        rebuilding it from the full export.")
+    # Posotional arguments
+    parser.add_argument("json_db",
+                        help="Existing JSON database.",
+                        metavar='JSON_DB')
+    parser.add_argument("-a", "--add",
+                        help="Tab separated export with the new isolates.\
+                              Same format as the input of create_db.py, can\
+                              be gzip compressed. Can be given several times.",
+                        action="append",
+                        default=[],
+                        metavar='TAB_FILE')
+    parser.add_argument("-r", "--retract",
+                        help="Tab separated export with isolates to remove\
+                              from the database. Can be given several times.",
+                        action="append",
+                        default=[],
+                        metavar='TAB_FILE')
+    parser.add_argument("-o", "--json_out",
+                        help="Output path of the new database. Default:\
+                              db.<version>.json next to JSON_DB.",
+                        default=None,
+                        metavar='JSON_OUT')
+    parser.add_argument("--version",
+                        help="Version of the new database. Default: UTC time\
+                              stamp, ex. 20240131T120000Z",
+                        default=None)
+    parser.add_argument("--install",
+                        help="Also replace JSON_DB with the new database,\
+                              atomically.",
+                        action="store_true",
+                        default=False)
+    parser.add_argument("-w", "--workers",
+                        help="Number of processes counting the rows.\
+                              Default: number of CPUs",
+                        type=int,
+                        default=os.cpu_count() or 1)
+    parser.add_argument("-q", "--quiet",
+                        help="Do not print progress.",
+                        action="store_true",
+                        default=False)
+
+    args = parser.parse_args()
+
+    if(not args.add and not args.retract):
+        sys.exit("! ERROR: Nothing to do, give --add and/or --retract.")
+
+    version = args.version
+    if(version is None):
+        version = datetime.datetime.now(datetime.timezone.utc).strftime(
+            "%Y%m%dT%H%M%SZ")
+    json_out = args.json_out
+    if(json_out is None):
+        json_out = os.path.join(os.path.dirname(os.path.abspath(args.json_db)),
+                                "db.{}.json".format(version))
+    manifest_out = os.path.splitext(json_out)[0] + ".manifest.json"
+
+    #
+    # Load DB file.
+    #
+    try:
+        with open(args.json_db, "r", encoding="utf-8") as json_fh:
+            db = json.load(json_fh)
+    except FileNotFoundError:
+        print("The JSON file "+args.json_db+" was not found\n")
+        quit(1)
+    parent_sha256 = file_sha256(args.json_db)
+
+    ebg_db = db.setdefault("ebg", {})
+    changed_sts = set()
+    changed_ebgs = set()
+    missing = []
+    delta_rows = {"added": 0, "retracted": 0, "malformed": 0}
+    sts_before = set(db.keys())
+    # Serovar order of each ST, to find the STs whose order changes.
+    order_before = {key: list(serotypes) for key, serotypes in db.items()
+                    if key != "ebg"}
+
+    builder = DBBuilder(workers=args.workers, progress=not args.quiet)
+    for tab_files, sign, row_key in ((args.add, 1, "added"),
+                                     (args.retract, -1, "retracted")):
+        for tab_file in tab_files:
+            if(not os.path.isfile(tab_file)):
+                sys.exit("! ERROR: Unable to locate delta file: {}"
+                         .format(tab_file))
+            st_counts, ebg_counts = builder.count(tab_file)
+            delta_rows[row_key] += builder.rows - builder.malformed
+            delta_rows["malformed"] += builder.malformed
+
+            # The eBG map is stored in the same dict as the STs.
+            ebg_counts_st = st_counts.pop("ebg", None)
+            if(ebg_counts_st is not None):
+                eprint("! WARNING: Ignoring rows with ST 'ebg' in {}"
+                       .format(tab_file))
+
+            changed, missing_st = apply_counts(db, st_counts, sign)
+            changed_sts.update(changed)
+            changed, missing_ebg = apply_counts(ebg_db, ebg_counts, sign)
+            changed_ebgs.update(changed)
+            missing += [("st", key, serotype, count)
+                        for key, serotype, count in missing_st]
+            missing += [("ebg", key, serotype, count)
+                        for key, serotype, count in missing_ebg]
+
+    # Keep the eBG map even if every eBG was retracted.
+    db.setdefault("ebg", ebg_db)
+
+    # Serovars new to an ST are appended after the others, where a full
+    # build with create_db.py lists them in the order they are first found
+    # in the export. When serovars tie for the most isolates the first one
+    # is predicted, so the prediction of these STs may differ from a full
+    # build.
+    reordered_sts = set()
+    for key in changed_sts & set(order_before) & set(db.keys()):
+        kept = [serotype for serotype in order_before[key]
+                if serotype in db[key]]
+        if(list(db[key]) != kept):
+            reordered_sts.add(key)
+
+    for kind, key, serotype, count in missing:
+        eprint("! WARNING: Retracted {} more isolate(s) of serovar '{}' than "
+               "found for {} {}".format(count, serotype, kind, key))
+
+    #
+    # Save JSON file and manifest.
+    #
+    write_json_atomic(json_out, db)
+    manifest = {
+        "version": version,
+        "database": os.path.basename(json_out),
+        "sha256": file_sha256(json_out),
+        "parent": os.path.abspath(args.json_db),
+        "parent_sha256": parent_sha256,
+        "added_files": args.add,
+        "retracted_files": args.retract,
+        "rows": delta_rows,
+        "changed_sts": sort_keys(changed_sts),
+        "new_sts": sort_keys(set(db.keys()) - sts_before),
+        "removed_sts": sort_keys(sts_before - set(db.keys())),
+        "reordered_sts": sort_keys(reordered_sts),
+        "changed_ebgs": sort_keys(changed_ebgs)
+    }
+    write_json_atomic(manifest_out, manifest, indent=2)
+
+    print("# Wrote JSON hash to: "+json_out)
+    print("# Wrote manifest to: "+manifest_out)
+    print("# Changed STs: {}, changed eBGs: {}".format(len(changed_sts),
+                                                       len(changed_ebgs)))
+
+    if(args.install):
+        write_json_atomic(args.json_db, db)
+        print("# Installed as: "+args.json_db)
+
+    quit(0)
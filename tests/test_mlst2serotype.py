@@ -0,0 +1,84 @@
+#!/usr/bin/env python3
+
+import json
+import os.path
+import unittest
+
+import numpy as np
+
+from salmonellatypefinder.mlst2serotype import MLST2Serotype
+from salmonellatypefinder.stindex import STIndex
+
+DB_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..",
+                       "data", "db.json")
+
+
+class BulkMLST2SerotypeTest(unittest.TestCase):
+    ''' bulk_mlst2serotype must give the same predictions as mlst2serotype.
+    '''
+
+    @classmethod
+    def setUpClass(cls):
+        cls.serotyper = MLST2Serotype(DB_PATH)
+        with open(DB_PATH, "r", encoding="utf-8") as db_fh:
+            cls.keys = [key for key in json.load(db_fh)
+                        if STIndex.is_st_key(key)]
+
+    def assert_same(self, sts, results):
+        for i, st in enumerate(sts):
+            prediction = self.serotyper.mlst2serotype(st)
+            msg = "ST {!r}".format(st)
+            self.assertEqual(results["serotype"][i],
+                             prediction.result or "", msg)
+            top_serotype = results["top_serotype"][i]
+            if(not prediction):
+                self.assertEqual(top_serotype, "", msg)
+                self.assertEqual(results["total"][i], 0, msg)
+                continue
+            count, total, frac = prediction[top_serotype]
+            self.assertEqual(results["max_count"][i], count, msg)
+            self.assertEqual(results["total"][i], total, msg)
+            self.assertEqual(count, max(entry[0]
+                                        for entry in prediction.values()),
+                             msg)
+
+    def test_all_keys_as_text(self):
+        results = self.serotyper.bulk_mlst2serotype(self.keys)
+        self.assertTrue(results["found"].all())
+        self.assertEqual(results["st"].tolist(),
+                         [int(key) for key in self.keys])
+        self.assert_same(self.keys, results)
+
+    def test_all_keys_as_integers(self):
+        sts = np.array([int(key) for key in self.keys])
+        results = self.serotyper.bulk_mlst2serotype(sts)
+        self.assertTrue(results["found"].all())
+        self.assert_same(self.keys, results)
+
+    def test_all_keys_as_text_array(self):
+        results = self.serotyper.bulk_mlst2serotype(np.array(self.keys))
+        self.assert_same(self.keys, results)
+
+    def test_negative_key(self):
+        negative_keys = [key for key in self.keys if key.startswith("-")]
+        self.assertTrue(negative_keys)
+        results = self.serotyper.bulk_mlst2serotype(negative_keys)
+        self.assertTrue(results["found"].all())
+
+    def test_not_sts(self):
+        # The JSON database has an entry for "", but it is not an ST.
+        sts = ["", "-", "-0", "007", "+1", "1.0", " 1", "1 ", "abc", "--1",
+               "1-", "1" * 19, "9" * 30, "-" + "1" * 19, "1\x001"]
+        results = self.serotyper.bulk_mlst2serotype(sts)
+        self.assertFalse(results["found"].any())
+        self.assertEqual(results["st"].tolist(), [0] * len(sts))
+        self.assertEqual(results["serotype"].tolist(), [""] * len(sts))
+
+    def test_outside_table(self):
+        sts = np.array([-2**63, -10**9, 10**9, 2**63 - 1])
+        results = self.serotyper.bulk_mlst2serotype(sts)
+        self.assertFalse(results["found"].any())
+
+
+if __name__ == '__main__':
+    unittest.main()